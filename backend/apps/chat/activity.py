@@ -0,0 +1,192 @@
+"""
+Buffered ChatUserActivity logging.
+
+Views call ``log_activity`` instead of inserting a row per interaction. The
+record is appended to a list in the real-time store in one round trip, and
+the ``flush_activity_log`` task bulk-inserts the queue in batches.
+
+The queue is capped at ``CHAT_ACTIVITY_QUEUE_LIMIT`` records: when it is
+full the oldest records are trimmed and counted as dropped, and if the
+store cannot be reached the record is dropped and counted in-process. The
+request path never waits on the database for activity logging. Activity is
+best-effort: a flusher that dies mid-batch loses that batch.
+
+A batch that fails on a transient database error is requeued. Records that
+do not decode or that the database rejects are moved to
+``chat:activity:dead`` so they cannot hold up the records behind them.
+"""
+
+import json
+import logging
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import InterfaceError, OperationalError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.common.realtime import get_redis, release_lock
+from .models import ChatMessage, ChatRoom, ChatUserActivity
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'chat:activity:queue'
+STATS_KEY = 'chat:activity:stats'
+LOCK_KEY = 'chat:activity:flush-lock'
+DEAD_LETTER_KEY = 'chat:activity:dead'
+
+FIELDS = {'activity_type', 'room_id', 'user_id', 'session_id', 'message_id', 'metadata', 'timestamp'}
+# Database errors a batch is requeued for; anything else is down to its records
+TRANSIENT_ERRORS = (InterfaceError, OperationalError)
+
+# Records lost because the real-time store was unreachable, per process
+unreachable_drops = 0
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def log_activity(activity_type, room, user=None, session_id='', message=None, metadata=None):
+    """Queue a ChatUserActivity row; never raises."""
+    global unreachable_drops
+    record = {
+        'activity_type': activity_type,
+        'room_id': str(room.pk),
+        'user_id': user.pk if user is not None and user.is_authenticated else None,
+        'session_id': session_id or '',
+        'message_id': str(message.pk) if message is not None else None,
+        'metadata': metadata or {},
+        'timestamp': timezone.now().isoformat(),
+    }
+    limit = _setting('CHAT_ACTIVITY_QUEUE_LIMIT', 100000)
+    try:
+        redis = get_redis()
+        pipe = redis.pipeline()
+        pipe.rpush(QUEUE_KEY, json.dumps(record))
+        pipe.ltrim(QUEUE_KEY, -limit, -1)
+        pipe.hincrby(STATS_KEY, 'queued', 1)
+        length = pipe.execute()[0]
+        if length > limit:
+            redis.hincrby(STATS_KEY, 'dropped_overflow', length - limit)
+    except Exception:
+        unreachable_drops += 1
+        logger.warning("Dropped chat activity record; real-time store unavailable", exc_info=True)
+
+
+def write_records(records):
+    """Bulk-insert queued records, skipping rooms and clearing references that are gone."""
+    room_ids = {record['room_id'] for record in records}
+    message_ids = {record['message_id'] for record in records if record['message_id']}
+    user_ids = {record['user_id'] for record in records if record['user_id']}
+    rooms = {str(pk) for pk in ChatRoom.objects.filter(pk__in=room_ids).values_list('pk', flat=True)}
+    messages = {
+        str(pk) for pk in ChatMessage.objects.filter(pk__in=message_ids).values_list('pk', flat=True)
+    }
+    users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+    ChatUserActivity.objects.bulk_create([
+        ChatUserActivity(
+            activity_type=record['activity_type'],
+            room_id=record['room_id'],
+            user_id=record['user_id'] if record['user_id'] in users else None,
+            session_id=record['session_id'],
+            message_id=record['message_id'] if record['message_id'] in messages else None,
+            metadata=record['metadata'],
+            timestamp=parse_datetime(record['timestamp']),
+        )
+        for record in records if record['room_id'] in rooms
+    ])
+
+
+def decode(raw):
+    """The queued record in ``raw``, or None if it is not a usable record."""
+    try:
+        record = json.loads(raw)
+        if not FIELDS <= record.keys() or parse_datetime(record['timestamp']) is None:
+            return None
+    except (ValueError, TypeError, AttributeError):
+        return None
+    return record
+
+
+def flush_activity_log(batch_size=None, max_batches=50):
+    """
+    Move queued activity into the database; returns the number of records written.
+
+    A batch that hits a transient database error goes back on the queue.
+    Records that do not decode, or that the database rejects when retried
+    on their own, are moved to the dead-letter list.
+    """
+    batch_size = batch_size or _setting('CHAT_ACTIVITY_FLUSH_BATCH_SIZE', 1000)
+    redis = get_redis()
+    token = uuid.uuid4().hex
+    if not redis.set(LOCK_KEY, token, ex=60, nx=True):
+        return 0
+
+    written = 0
+    try:
+        for _ in range(max_batches):
+            pipe = redis.pipeline()
+            pipe.lrange(QUEUE_KEY, 0, batch_size - 1)
+            pipe.ltrim(QUEUE_KEY, batch_size, -1)
+            raw = pipe.execute()[0]
+            if not raw:
+                break
+
+            batch, dead, requeue = [], [], []
+            for item in raw:
+                record = decode(item)
+                if record is None:
+                    dead.append(item)
+                else:
+                    batch.append((item, record))
+            flushed = 0
+            try:
+                write_records([record for _, record in batch])
+                flushed = len(batch)
+            except TRANSIENT_ERRORS:
+                logger.exception("Chat activity flush failed; requeueing %d records", len(batch))
+                requeue = [item for item, _ in batch]
+            except Exception:
+                logger.exception("Chat activity batch rejected; writing its records one by one")
+                for index, (item, record) in enumerate(batch):
+                    try:
+                        write_records([record])
+                    except TRANSIENT_ERRORS:
+                        requeue = [item for item, _ in batch[index:]]
+                        logger.exception("Chat activity flush failed; requeueing %d records", len(requeue))
+                        break
+                    except Exception:
+                        dead.append(item)
+                    else:
+                        flushed += 1
+
+            pipe = redis.pipeline()
+            if dead:
+                logger.warning("Moved %d unwritable chat activity records to %s", len(dead), DEAD_LETTER_KEY)
+                pipe.rpush(DEAD_LETTER_KEY, *dead)
+                pipe.ltrim(DEAD_LETTER_KEY, -_setting('CHAT_ACTIVITY_QUEUE_LIMIT', 100000), -1)
+                pipe.hincrby(STATS_KEY, 'dead_records', len(dead))
+            if requeue:
+                pipe.rpush(QUEUE_KEY, *requeue)
+                pipe.hincrby(STATS_KEY, 'failed_batches', 1)
+            pipe.hincrby(STATS_KEY, 'flushed', flushed)
+            pipe.execute()
+            written += flushed
+            if requeue or len(raw) < batch_size:
+                break
+    finally:
+        release_lock([LOCK_KEY], [token])
+    return written
+
+
+def activity_stats():
+    """Queued, flushed and dropped counters plus the current queue length."""
+    redis = get_redis()
+    stats = {name: int(value) for name, value in redis.hgetall(STATS_KEY).items()}
+    stats['queue_length'] = redis.llen(QUEUE_KEY)
+    stats['dead_letter_length'] = redis.llen(DEAD_LETTER_KEY)
+    stats['dropped_unreachable'] = unreachable_drops
+    return stats
@@ -3,7 +3,11 @@ Chat system admin configuration for GenFree Network.
 """
 
 from django.contrib import admin
-from .models import ChatRoom, ChatMessage, ChatUserActivity, MessageReport
+from .models import (
+    ChatRoom, ChatMessage, ChatUserActivity, MessageReport, MessageReactionCount, ChatArchive,
+    ChatStatsRollup
+)
+from .tasks import restore_chat_archive
 
 
 @admin.register(ChatRoom)
@@ -12,12 +16,14 @@ class ChatRoomAdmin(admin.ModelAdmin):
     
     list_display = [
         'name', 'room_type', 'is_active', 'is_moderated',
-        'allow_anonymous', 'created_by', 'created_at'
+        'allow_anonymous', 'message_count', 'participant_count',
+        'created_by', 'created_at'
     ]
     list_filter = ['room_type', 'is_active', 'is_moderated', 'allow_anonymous', 'created_at']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     filter_horizontal = ['moderators']
+    readonly_fields = ['message_count', 'participant_count']
     
     fieldsets = (
         ('Basic Information', {
@@ -35,7 +41,7 @@ class ChatRoomAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
         ('Metadata', {
-            'fields': ('created_by',),
+            'fields': ('created_by', 'message_count', 'participant_count'),
             'classes': ('collapse',)
         }),
     )
@@ -91,6 +97,15 @@ class ChatMessageAdmin(admin.ModelAdmin):
     moderate_messages.short_description = "Moderate selected messages"
 
 
+@admin.register(MessageReactionCount)
+class MessageReactionCountAdmin(admin.ModelAdmin):
+    """Admin interface for aggregated message reactions."""
+    
+    list_display = ['message', 'kind', 'count']
+    list_filter = ['kind']
+    readonly_fields = ['message', 'kind', 'count']
+
+
 @admin.register(ChatUserActivity)
 class ChatUserActivityAdmin(admin.ModelAdmin):
     """Admin interface for chat user activity."""
@@ -132,4 +147,37 @@ class MessageReportAdmin(admin.ModelAdmin):
     
     def resolve_reports(self, request, queryset):
         queryset.update(is_resolved=True, resolved_by=request.user)
-    resolve_reports.short_description = "Resolve selected reports"
\ No newline at end of file
+    resolve_reports.short_description = "Resolve selected reports"
+
+
+@admin.register(ChatArchive)
+class ChatArchiveAdmin(admin.ModelAdmin):
+    """Admin interface for archived chat history."""
+    
+    list_display = [
+        'room', 'month', 'message_count', 'first_message_at',
+        'last_message_at', 'created_at', 'restored_at'
+    ]
+    list_filter = ['room', 'month', 'restored_at']
+    readonly_fields = [
+        'room', 'month', 'file', 'message_count', 'first_message_at',
+        'last_message_at', 'created_at', 'restored_at'
+    ]
+    
+    actions = ['restore_archives']
+    
+    def restore_archives(self, request, queryset):
+        for archive in queryset:
+            restore_chat_archive.delay(archive.pk)
+        self.message_user(request, f"Queued {queryset.count()} archive(s) for restore.")
+    restore_archives.short_description = "Restore selected archives"
+
+
+@admin.register(ChatStatsRollup)
+class ChatStatsRollupAdmin(admin.ModelAdmin):
+    """Admin interface for chat statistics rollups."""
+    
+    list_display = ['room', 'period', 'bucket', 'message_count', 'sender_count']
+    list_filter = ['period', 'room']
+    date_hierarchy = 'bucket'
+    readonly_fields = ['room', 'period', 'bucket', 'message_count', 'senders']
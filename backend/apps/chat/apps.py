@@ -4,4 +4,10 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.chat'
-    verbose_name = 'Chat System'
\ No newline at end of file
+    verbose_name = 'Chat System'
+    
+    def ready(self):
+        """
+        Import signals when the app is ready.
+        """
+        import apps.chat.signals
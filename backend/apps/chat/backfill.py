@@ -0,0 +1,229 @@
+"""
+Per-room ring buffer of recent messages for WebSocket join backfill.
+
+Each room keeps its last ``CHAT_BACKFILL_SIZE`` approved messages in the
+real-time store as encoded JSON, appended by the broadcast path. A new
+connection gets them in one ``backfill`` frame assembled from the stored
+strings, without querying ``ChatMessage`` or re-encoding anything.
+
+A cold room (nothing buffered since the TTL lapsed) is filled from the
+database by whichever connection claims the fill lock; the others wait for
+that fill rather than running their own query, and read the database
+directly if it does not finish in time. The fill includes messages still
+waiting in the write-behind journal. Messages broadcast while the fill runs
+are parked in a side list and merged in by the same script that marks the
+room warm, which retries if anything was parked after the fill read it.
+"""
+
+import asyncio
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.utils.dateparse import parse_datetime
+
+from apps.common.realtime import Script, get_async_redis, get_redis
+from . import persistence
+from .models import ChatMessage, ChatRoom
+from .serializers import ChatMessageSerializer
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def buffer_key(room_slug):
+    return f'chat:recent:{room_slug}'
+
+
+def warm_key(room_slug):
+    return f'chat:recent:{room_slug}:warm'
+
+
+def fill_lock_key(room_slug):
+    return f'chat:recent:{room_slug}:filling'
+
+
+def parked_key(room_slug):
+    return f'chat:recent:{room_slug}:parked'
+
+
+def _room_keys(room_slug):
+    return [buffer_key(room_slug), warm_key(room_slug), fill_lock_key(room_slug), parked_key(room_slug)]
+
+
+def _limits():
+    return [_setting('CHAT_BACKFILL_SIZE', 50), _setting('CHAT_BACKFILL_TTL', 6 * 60 * 60)]
+
+
+def _push_local(redis, keys, args):
+    buffer, warm, lock, parked = keys
+    size, ttl, encoded = int(args[0]), int(args[1]), args[2]
+    if redis.exists(warm):
+        redis.rpush(buffer, encoded)
+        redis.ltrim(buffer, -size, -1)
+        redis.expire(buffer, ttl)
+        redis.expire(warm, ttl)
+        return 1
+    if redis.exists(lock):
+        redis.rpush(parked, encoded)
+        redis.expire(parked, 60)
+        return 2
+    return 0
+
+
+# KEYS: buffer, warm marker, fill lock, parked list; ARGV: size, ttl, message.
+# Appends to a warm buffer, parks the message while a fill runs, and drops
+# it otherwise (the next fill reads it from the database).
+push_message = Script("""
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('RPUSH', KEYS[1], ARGV[3])
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    redis.call('EXPIRE', KEYS[2], ARGV[2])
+    return 1
+end
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('RPUSH', KEYS[4], ARGV[3])
+    redis.call('EXPIRE', KEYS[4], 60)
+    return 2
+end
+return 0
+""", _push_local)
+
+
+def _finish_fill_local(redis, keys, args):
+    buffer, warm, _, parked = keys
+    size, ttl, seen, encoded = int(args[0]), int(args[1]), int(args[2]), args[3:]
+    if redis.llen(parked) != seen:
+        return 0
+    redis.delete(buffer, parked)
+    if encoded:
+        redis.rpush(buffer, *encoded)
+        redis.ltrim(buffer, -size, -1)
+        redis.expire(buffer, ttl)
+    redis.set(warm, 1, ex=ttl)
+    return 1
+
+
+# KEYS: as for push_message; ARGV: size, ttl, parked messages already merged,
+# then the messages. Stores the buffer and marks the room warm, unless more
+# messages were parked since the fill read the parked list.
+finish_fill = Script("""
+if redis.call('LLEN', KEYS[4]) ~= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[4])
+if #ARGV > 3 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 4))
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+return 1
+""", _finish_fill_local)
+
+
+async def apush(room_slug, message_data):
+    """Append a broadcast message to a warm room's buffer."""
+    await push_message.acall(_room_keys(room_slug), [*_limits(), json.dumps(message_data)])
+
+
+def push(room_slug, message_data):
+    """Append a message created outside the WebSocket path."""
+    push_message(_room_keys(room_slug), [*_limits(), json.dumps(message_data)])
+
+
+def invalidate(room_slug):
+    """Drop a room's buffer, e.g. after a message is removed."""
+    get_redis().delete(buffer_key(room_slug), warm_key(room_slug))
+
+
+def journaled_messages(room_id):
+    """Approved messages waiting in the write-behind journal, as ``(created_at, payload)``."""
+    records = [
+        json.loads(raw) for raw in get_redis().hgetall(persistence.PENDING_KEY).values()
+    ]
+    records = [
+        record for record in records
+        if record.get('room_id') == str(room_id) and record.get('is_approved', True)
+    ]
+    users = User.objects.in_bulk({record['user_id'] for record in records if record['user_id']})
+    return [
+        (
+            parse_datetime(record['created_at']),
+            persistence.message_payload(record, users.get(record['user_id']) or AnonymousUser())
+        )
+        for record in records
+    ]
+
+
+def load_recent(room_slug):
+    """The room's latest approved messages, oldest first, as encoded JSON."""
+    size = _setting('CHAT_BACKFILL_SIZE', 50)
+    room_id = ChatRoom.objects.filter(slug=room_slug).values_list('id', flat=True).first()
+    if room_id is None:
+        return []
+    messages = list(
+        ChatMessage.objects.filter(
+            room_id=room_id, is_approved=True
+        ).select_related('user').order_by('-created_at', '-id')[:size]
+    )
+    recent = [
+        (message.created_at, data)
+        for message, data in zip(messages, ChatMessageSerializer(messages, many=True).data)
+    ]
+    stored = {str(message.pk) for message in messages}
+    recent += [item for item in journaled_messages(room_id) if item[1]['id'] not in stored]
+    recent.sort(key=lambda item: (item[0], item[1]['id']))
+    return [json.dumps(data) for _, data in recent[-size:]]
+
+
+def fill_from_database(room_slug, store=True):
+    """
+    Load the room's latest approved messages and, with ``store``, buffer them.
+
+    Messages parked while the fill ran are appended. Returns the buffered
+    messages as encoded JSON.
+    """
+    encoded = load_recent(room_slug)
+    if not store:
+        return encoded
+
+    size, ttl = _limits()
+    redis = get_redis()
+    while True:
+        parked = redis.lrange(parked_key(room_slug), 0, -1)
+        loaded = {json.loads(message)['id'] for message in encoded}
+        filled = encoded + [message for message in parked if json.loads(message)['id'] not in loaded]
+        if finish_fill(_room_keys(room_slug), [size, ttl, len(parked), *filled[-size:]]):
+            return filled[-size:]
+
+
+async def abackfill_frame(room_slug, fill):
+    """
+    Return the encoded ``backfill`` frame for a room.
+
+    ``fill`` is an async wrapper around ``fill_from_database``; it only runs
+    on a cold room, for the connection that wins the fill lock. A connection
+    that waits in vain reads the database without storing the result.
+    """
+    redis = get_async_redis()
+    for _ in range(20):
+        pipe = redis.pipeline()
+        pipe.exists(warm_key(room_slug))
+        pipe.lrange(buffer_key(room_slug), 0, -1)
+        warm, encoded = await pipe.execute()
+        if warm:
+            break
+        if await redis.set(fill_lock_key(room_slug), 1, ex=10, nx=True):
+            try:
+                encoded = await fill(room_slug)
+            finally:
+                await redis.delete(fill_lock_key(room_slug))
+            break
+        await asyncio.sleep(0.1)  # Another connection is filling this room
+    else:
+        encoded = await fill(room_slug, store=False)
+
+    return '{"type": "backfill", "messages": [' + ', '.join(encoded) + ']}'
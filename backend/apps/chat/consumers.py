@@ -2,219 +2,351 @@
 Chat WebSocket consumers for real-time messaging.
 """
 
-import json
+import asyncio
+import time
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
+from apps.common.broadcast import FrameBroadcastMixin, GroupBroadcastCoalescer, frame_event
+from apps.common.presence import keepalive
+from apps.common.snapshots import SnapshotConsumerMixin
+from . import backfill, counters, moderation_queue, reactions, throttling
 from .models import ChatRoom, ChatMessage
+from .moderation import BANNED, FLAGGED, get_room_filter
+from .persistence import build_message_record, message_payload, write_behind
+from .presence import chat_presence
 from .serializers import ChatMessageSerializer
+from .signals import ROOM_SNAPSHOT_FIELDS, room_snapshot
+from .typing_indicators import schedule_typing_snapshot, typing_tracker
 
+user_count_broadcasts = GroupBroadcastCoalescer('chat_user_count')
 
-class ChatConsumer(AsyncWebsocketConsumer):
+
+class ChatConsumer(SnapshotConsumerMixin, FrameBroadcastMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for chat functionality."""
     
+    # Inbound frame types; anything else counts against the 'invalid' limit
+    frame_types = ('chat_message', 'typing', 'reaction', 'ping')
+    
     async def connect(self):
         self.room_slug = self.scope['url_route']['kwargs']['room_slug']
         self.room_group_name = f'chat_{self.room_slug}'
         
+        # Refuse unknown and closed rooms before the handshake completes
+        if not await self.resolve_snapshot() or not self.snapshot['is_active']:
+            await self.close()
+            return
+        self.room_id = self.snapshot['id']
+        
         # Join room group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.group_join(self.room_group_name)
+        
+        await self.accept_connection()
+        self.is_typing = False
+        self.throttle = throttling.ConnectionThrottle()
+        self.throttle_notice_until = {}
         
-        await self.accept()
+        # Register this connection, keep it registered while the socket is
+        # open, and send current user count
+        user_count = await chat_presence.ajoin(self.room_slug, self.channel_name)
+        self.keepalive_task = asyncio.ensure_future(keepalive(self.keep_alive, chat_presence.ttl / 3))
+        await self.user_count_update({'count': user_count})
+        
+        # Everyone else gets at most one coalesced count update per tick
+        await user_count_broadcasts.schedule(
+            self.channel_layer, self.room_group_name, self.user_count_event
+        )
         
-        # Send current user count
-        user_count = await self.get_room_user_count()
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_count_update',
-                'count': user_count
-            }
+        # Recent history from the room's ring buffer
+        frame = await backfill.abackfill_frame(
+            self.room_slug, database_sync_to_async(backfill.fill_from_database)
         )
+        if frame:
+            await self.send_encoded(frame)
     
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_id'):
+            return  # Refused at connect
+        
+        if hasattr(self, 'keepalive_task'):
+            self.keepalive_task.cancel()
+        
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        await self.group_leave(self.room_group_name)
+        
+        # Clear a dangling typing indicator
+        if getattr(self, 'is_typing', False):
+            await typing_tracker.set_typing(self.room_slug, self.typing_identity, '', False)
+            await schedule_typing_snapshot(self.channel_layer, self.room_slug, self.room_group_name)
         
         # Update user count
-        user_count = await self.get_room_user_count()
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'user_count_update',
-                'count': user_count
-            }
+        await chat_presence.aleave(self.room_slug, self.channel_name)
+        await user_count_broadcasts.schedule(
+            self.channel_layer, self.room_group_name, self.user_count_event
         )
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            text_data_json = json.loads(text_data)
-            message_type = text_data_json.get('type', 'chat_message')
-            
-            if message_type == 'chat_message':
-                await self.handle_chat_message(text_data_json)
-            elif message_type == 'typing':
-                await self.handle_typing(text_data_json)
-            elif message_type == 'reaction':
-                await self.handle_reaction(text_data_json)
-            elif message_type == 'ping':
-                await self.send(text_data=json.dumps({'type': 'pong'}))
-                
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+            text_data_json = self.decode_frame(text_data, bytes_data)
+        except ValueError as exc:
+            await self.reject_frame(str(exc))
+            return
+        
+        message_type = text_data_json.get('type', 'chat_message')
+        if message_type not in self.frame_types:
+            await self.reject_frame('Unsupported frame type')
+            return
+        
+        if not await self.allow_frame(message_type):
+            return
+        
+        if message_type == 'chat_message':
+            await self.handle_chat_message(text_data_json)
+        elif message_type == 'typing':
+            await self.handle_typing(text_data_json)
+        elif message_type == 'reaction':
+            await self.handle_reaction(text_data_json)
+        elif message_type == 'ping':
+            await self.send_frame({'type': 'pong'})
+    
+    async def reject_frame(self, message):
+        """Answer an undecodable or unknown frame, charged to the ``invalid`` limit."""
+        if await self.allow_frame('invalid'):
+            await self.send_frame({
                 'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
+                'message': message
+            })
+    
+    async def allow_frame(self, message_type):
+        """
+        Apply the connection and user rate limits to an inbound frame.
+        
+        A throttled client gets at most one ``rate_limited`` frame per frame
+        type per second, telling it how long to back off.
+        """
+        scope, retry_after = 'connection', self.throttle.consume(message_type)
+        user = self.scope['user']
+        if not retry_after and user.is_authenticated:
+            scope, retry_after = 'user', await throttling.aconsume_user(user.pk, message_type)
+        if not retry_after:
+            return True
+        
+        await throttling.arecord_rejection(scope, message_type)
+        now = time.monotonic()
+        if now >= self.throttle_notice_until.get(message_type, 0):
+            self.throttle_notice_until[message_type] = now + 1
+            await self.send_frame({
+                'type': 'rate_limited',
+                'message_type': message_type,
+                'scope': scope,
+                'retry_after': round(retry_after, 2)
+            })
+        return False
+    
+    async def user_count_event(self):
+        """Build a user count update carrying the latest count."""
+        return frame_event({
+            'type': 'user_count',
+            'count': await self.get_room_user_count()
+        })
+    
+    @property
+    def sender_session(self):
+        """The session key stored with messages; the channel name for anonymous clients without one."""
+        return self.scope.get('session', {}).get('session_key') or self.channel_name
+    
+    @property
+    def typing_identity(self):
+        """One typing entry per signed-in user, or per anonymous connection."""
+        user = self.scope['user']
+        return f'user:{user.pk}' if user.is_authenticated else self.channel_name
+    
+    async def keep_alive(self):
+        """Run by the keepalive task: refresh presence and groups, reload a stale snapshot."""
+        await chat_presence.atouch(self.room_slug, self.channel_name)
+        await self.touch_groups()
+        await self.refresh_snapshot()
     
     async def handle_chat_message(self, data):
         """Handle incoming chat messages."""
-        content = data.get('content', '').strip()
+        content = data.get('content', '')
+        content = content.strip() if isinstance(content, str) else ''
         user = self.scope['user']
         
-        if not content:
+        if not content or self.snapshot is None:
             return
         
-        # Save message to database
-        message_data = await self.save_message(content, user)
+        verdict = self.moderate(content)
+        if verdict == BANNED:
+            await self.send_frame({
+                'type': 'error',
+                'message': 'Message contains inappropriate content.'
+            })
+            return
+        
+        # Flagged messages in moderated rooms wait for a moderator
+        is_approved = not (verdict == FLAGGED and self.snapshot['is_moderated'])
+        
+        # Save message to database, or buffer it for a batched insert
+        if write_behind.enabled:
+            message_data = await self.buffer_message(content, user, is_approved)
+        else:
+            message_data = await self.save_message(content, user, is_approved)
         
-        if message_data:
+        if message_data and not is_approved:
+            await self.send_frame({
+                'type': 'message_pending',
+                'message': message_data
+            })
+            await moderation_queue.aenqueue(message_data['id'], moderation_queue.flagged_priority())
+        elif message_data:
             # Send message to room group
-            await self.channel_layer.group_send(
+            await self.group_send_frame(
                 self.room_group_name,
                 {
-                    'type': 'chat_message_broadcast',
+                    'type': 'chat_message',
                     'message': message_data
                 }
             )
+            await backfill.apush(self.room_slug, message_data)
+            await counters.arecord_message(
+                self.room_id,
+                user.id if user.is_authenticated else None,
+                self.sender_session
+            )
+    
+    def moderate(self, content):
+        """Check a message against the compiled word filter for the room snapshot."""
+        room = self.snapshot
+        return get_room_filter(room['id'], room['banned_words'], room['version']).check(content)
+    
+    async def snapshot_changed(self, previous):
+        """Close the socket once the room is deleted or deactivated."""
+        if self.snapshot is None or not self.snapshot['is_active']:
+            await self.send_frame({
+                'type': 'system_message',
+                'message': 'This chat room has been closed.'
+            })
+            await self.close()
     
     async def handle_typing(self, data):
-        """Handle typing indicators."""
+        """Record a typing toggle; the room gets periodic snapshots."""
         user = self.scope['user']
         username = user.username if user.is_authenticated else 'Anonymous'
+        typing = bool(data.get('typing', False))
         
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'typing_broadcast',
-                'user': username,
-                'typing': data.get('typing', False)
-            }
-        )
+        if not typing and not self.is_typing:
+            return
+        
+        self.is_typing = typing
+        await typing_tracker.set_typing(self.room_slug, self.typing_identity, username, typing)
+        await schedule_typing_snapshot(self.channel_layer, self.room_slug, self.room_group_name)
     
     async def handle_reaction(self, data):
-        """Handle message reactions."""
-        message_id = data.get('message_id')
+        """Count a message reaction; totals are broadcast once per tick."""
         reaction = data.get('reaction')
-        user = self.scope['user']
+        try:
+            message_id = str(uuid.UUID(str(data.get('message_id'))))
+        except ValueError:
+            return
         
-        if message_id and reaction:
-            # Update message likes in database
-            await self.add_reaction(message_id, reaction)
-            
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'reaction_broadcast',
-                    'message_id': message_id,
-                    'reaction': reaction,
-                    'user': user.username if user.is_authenticated else 'Anonymous'
-                }
+        if reaction not in reactions.reaction_kinds():
+            await self.send_frame({
+                'type': 'error',
+                'message': 'Unsupported reaction'
+            })
+            return
+        
+        totals = await reactions.aincrement(
+            message_id, self.room_slug, reaction, database_sync_to_async(reactions.load_totals)
+        )
+        if totals is not None:
+            await reactions.schedule_reaction_counts(
+                self.channel_layer, self.room_slug, self.room_group_name
             )
     
     # Message broadcast handlers
+    # Consumers fan out pre-encoded frames via broadcast_frame; the handlers
+    # below serve events sent by other code and by nodes on older releases.
     async def chat_message_broadcast(self, event):
         """Send chat message to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'chat_message',
             'message': event['message']
-        }))
+        })
     
     async def typing_broadcast(self, event):
         """Send typing indicator to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'typing',
             'user': event['user'],
             'typing': event['typing']
-        }))
+        })
     
     async def reaction_broadcast(self, event):
         """Send reaction to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'reaction',
             'message_id': event['message_id'],
             'reaction': event['reaction'],
             'user': event['user']
-        }))
+        })
     
     async def user_count_update(self, event):
         """Send user count update to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'user_count',
             'count': event['count']
-        }))
+        })
     
     async def system_message(self, event):
         """Send system message to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'system_message',
             'message': event['message']
-        }))
+        })
     
     # Database operations
     @database_sync_to_async
-    def save_message(self, content, user):
+    def load_snapshot(self):
+        """Load the room snapshot, or None for an unknown slug."""
+        room = ChatRoom.objects.only(*ROOM_SNAPSHOT_FIELDS).filter(slug=self.room_slug).first()
+        return room_snapshot(room) if room else None
+    
+    @database_sync_to_async
+    def save_message(self, content, user, is_approved=True):
         """Save chat message to database."""
         try:
-            room = ChatRoom.objects.get(slug=self.room_slug)
-            
             # Create message
             message = ChatMessage.objects.create(
-                room=room,
+                room_id=self.room_id,
                 user=user if user.is_authenticated else None,
                 content=content,
-                anonymous_name=user.username if not user.is_authenticated else None,
-                session_id=self.scope.get('session', {}).get('session_key', '')
+                anonymous_name='' if user.is_authenticated else user.username,
+                session_id=self.sender_session,
+                is_approved=is_approved
             )
             
             # Serialize message data
             serializer = ChatMessageSerializer(message)
             return serializer.data
             
-        except ChatRoom.DoesNotExist:
-            return None
         except Exception as e:
             print(f"Error saving message: {e}")
             return None
     
-    @database_sync_to_async
-    def add_reaction(self, message_id, reaction):
-        """Add reaction to a message."""
-        try:
-            message = ChatMessage.objects.get(id=message_id)
-            if reaction == 'like':
-                message.likes += 1
-                message.save(update_fields=['likes'])
-            return True
-        except ChatMessage.DoesNotExist:
-            return False
-    
-    @database_sync_to_async 
-    def get_room_user_count(self):
-        """Get approximate user count for the room."""
-        # In production, this would use Redis to track active connections
-        # For now, return a placeholder based on recent activity
-        try:
-            recent_time = timezone.now() - timezone.timedelta(minutes=5)
-            count = ChatMessage.objects.filter(
-                room__slug=self.room_slug,
-                created_at__gte=recent_time
-            ).values('user', 'session_id').distinct().count()
-            return max(count, 1)  # At least 1 (current user)
-        except:
-            return 1
\ No newline at end of file
+    async def buffer_message(self, content, user, is_approved=True):
+        """Queue a chat message for write-behind and return its payload."""
+        record = build_message_record(
+            self.room_id,
+            user,
+            content,
+            self.sender_session,
+            is_approved=is_approved
+        )
+        await write_behind.enqueue(record)
+        return message_payload(record, user)
+    
+    async def get_room_user_count(self):
+        """Get the number of live connections in the room."""
+        return await chat_presence.acount(self.room_slug)
@@ -0,0 +1,179 @@
+"""
+Denormalized message and participant counters on ChatRoom.
+
+``ChatRoom.message_count`` (approved messages) and
+``ChatRoom.participant_count`` (distinct signed-in senders plus distinct
+anonymous sessions) are read by the room list instead of counting per room.
+
+The write paths record each new approved message here. Deltas collect in
+the ``chat:roomcounters:pending`` hash and are applied by the
+``flush_room_counters`` task with ``F()`` updates, so busy rooms do not
+contend on their row. A per-room set of participant ids in the real-time
+store tells whether a sender is new to the room.
+
+Moderation, deletes and lost real-time state can still skew the counters;
+``reconcile_room_counters`` recomputes them from ``ChatMessage`` and
+reseeds the participant sets.
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F
+
+from apps.common.realtime import get_async_redis, get_redis, release_lock
+from .models import ChatMessage, ChatRoom
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'chat:roomcounters:pending'
+FLUSHING_PREFIX = 'chat:roomcounters:flushing:'
+LOCK_KEY = 'chat:roomcounters:lock'
+
+FIELDS = {'messages': 'message_count', 'participants': 'participant_count'}
+
+
+def participants_key(room_id):
+    return f'chat:participants:{room_id}'
+
+
+def participant_id(user_id, session_id):
+    """
+    Signed-in users count once each, anonymous senders once per session.
+
+    Anonymous WebSocket senders without a session are stored with their
+    channel name as ``session_id`` (see ``ChatConsumer.sender_session``), so
+    they count once per connection.
+    """
+    if user_id:
+        return f'u:{user_id}'
+    if session_id:
+        return f's:{session_id}'
+    return None
+
+
+def record_message(room_id, user_id, session_id):
+    """Count a new approved message from a sync caller."""
+    redis = get_redis()
+    participant = participant_id(user_id, session_id)
+    pipe = redis.pipeline()
+    pipe.hincrby(PENDING_KEY, f'{room_id}:messages', 1)
+    if participant:
+        pipe.sadd(participants_key(room_id), participant)
+    results = pipe.execute()
+    if participant and results[-1]:
+        redis.hincrby(PENDING_KEY, f'{room_id}:participants', 1)
+
+
+async def arecord_message(room_id, user_id, session_id):
+    """Count a new approved message from a consumer."""
+    redis = get_async_redis()
+    participant = participant_id(user_id, session_id)
+    pipe = redis.pipeline()
+    pipe.hincrby(PENDING_KEY, f'{room_id}:messages', 1)
+    if participant:
+        pipe.sadd(participants_key(room_id), participant)
+    results = await pipe.execute()
+    if participant and results[-1]:
+        await redis.hincrby(PENDING_KEY, f'{room_id}:participants', 1)
+
+
+def record_removed(removed_by_room):
+    """Subtract ``{room_id: approved messages removed}`` from the message counts."""
+    pipe = get_redis().pipeline()
+    for room_id, removed in removed_by_room.items():
+        pipe.hincrby(PENDING_KEY, f'{room_id}:messages', -removed)
+    pipe.execute()
+
+
+def apply_deltas(deltas):
+    """Write ``{(room_id, field): delta}`` with grouped F() updates."""
+    rooms_by_delta = defaultdict(list)
+    for (room_id, field), delta in deltas.items():
+        if delta and field in FIELDS:
+            rooms_by_delta[(FIELDS[field], delta)].append(room_id)
+
+    with transaction.atomic():
+        for (column, delta), room_ids in rooms_by_delta.items():
+            ChatRoom.objects.filter(pk__in=room_ids).update(**{column: F(column) + delta})
+
+
+def flush_room_counters():
+    """
+    Move pending counter deltas into ChatRoom.
+
+    Same scheme as ``reactions.flush_reaction_counts``: a token lock, the
+    pending hash is renamed before it is read, and a batch that fails keeps
+    its key for the next run. Returns the number of deltas written.
+    """
+    redis = get_redis()
+    token = uuid.uuid4().hex
+    if not redis.set(LOCK_KEY, token, ex=60, nx=True):
+        return 0
+
+    try:
+        if redis.exists(PENDING_KEY):
+            redis.rename(PENDING_KEY, f'{FLUSHING_PREFIX}{uuid.uuid4().hex}')
+
+        flushed = 0
+        for key in list(redis.scan_iter(match=f'{FLUSHING_PREFIX}*')):
+            deltas = {}
+            for name, delta in redis.hgetall(key).items():
+                room_id, field = name.rsplit(':', 1)
+                deltas[(room_id, field)] = int(delta)
+            try:
+                apply_deltas(deltas)
+            except Exception:
+                logger.exception("Room counter flush failed for %s; will retry", key)
+                continue
+            redis.delete(key)
+            flushed += len(deltas)
+        return flushed
+    finally:
+        release_lock([LOCK_KEY], [token])
+
+
+def reconcile_room_counters():
+    """
+    Recompute every room's counters from ChatMessage.
+
+    Pending deltas are flushed first; messages written while this runs may
+    be counted twice until the next reconciliation. Returns the number of
+    rooms whose counters changed.
+    """
+    flush_room_counters()
+
+    # One grouped query: approved messages per room and sender
+    message_counts = defaultdict(int)
+    participants = defaultdict(set)
+    for room_id, user_id, session_id, count in ChatMessage.objects.filter(
+        is_approved=True
+    ).order_by().values('room_id', 'user_id', 'session_id').annotate(
+        count=Count('id')
+    ).values_list('room_id', 'user_id', 'session_id', 'count').iterator():
+        message_counts[room_id] += count
+        participant = participant_id(user_id, session_id)
+        if participant:
+            participants[room_id].add(participant)
+
+    changed = 0
+    redis = get_redis()
+    for room in ChatRoom.objects.only('id', 'message_count', 'participant_count').iterator():
+        message_count = message_counts.get(room.id, 0)
+        room_participants = participants.get(room.id, set())
+        participant_count = len(room_participants)
+
+        pipe = redis.pipeline()
+        pipe.delete(participants_key(room.id))
+        if room_participants:
+            pipe.sadd(participants_key(room.id), *room_participants)
+        pipe.execute()
+
+        if (room.message_count, room.participant_count) != (message_count, participant_count):
+            ChatRoom.objects.filter(pk=room.pk).update(
+                message_count=message_count, participant_count=participant_count
+            )
+            changed += 1
+    return changed
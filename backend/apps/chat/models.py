@@ -48,6 +48,10 @@ class ChatRoom(models.Model):
     banned_words = models.TextField(blank=True, help_text="Comma-separated list of banned words")
     moderators = models.ManyToManyField(User, blank=True, related_name='moderated_rooms')
     
+    # Denormalized counters, maintained by apps.chat.counters
+    message_count = models.IntegerField(default=0)
+    participant_count = models.IntegerField(default=0)
+    
     # Metadata
     created_by = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -63,11 +67,9 @@ class ChatRoom(models.Model):
     
     @property
     def active_users_count(self):
-        """Count of active users in the last 5 minutes."""
-        five_minutes_ago = timezone.now() - timezone.timedelta(minutes=5)
-        return self.messages.filter(
-            created_at__gte=five_minutes_ago
-        ).values('user').distinct().count()
+        """Count of live WebSocket connections in the room."""
+        from .presence import chat_presence
+        return chat_presence.count(self.slug)
 
 
 class ChatMessage(models.Model):
@@ -111,13 +113,24 @@ class ChatMessage(models.Model):
     # Metadata
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: write-behind batches keep the timestamp clients saw
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Chat Message'
         verbose_name_plural = 'Chat Messages'
+        indexes = [
+            # Keyset history: (created_at, id) cursors over a room's approved messages
+            models.Index(
+                fields=['room', 'created_at', 'id'],
+                condition=models.Q(is_approved=True),
+                name='chat_msg_room_history_idx'
+            ),
+            # Also drives retention, which walks every message by age
+            models.Index(fields=['created_at'], name='chat_msg_created_idx'),
+        ]
     
     def __str__(self):
         sender = self.user.username if self.user else self.anonymous_name or 'Anonymous'
@@ -139,6 +152,53 @@ class ChatMessage(models.Model):
         self.save()
 
 
+class MessageReactionCount(models.Model):
+    """Aggregated reaction totals per message and kind (likes stay on ChatMessage)."""
+    
+    message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name='reaction_counts')
+    kind = models.CharField(max_length=20)
+    count = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['message', 'kind']
+        verbose_name = 'Message Reaction Count'
+        verbose_name_plural = 'Message Reaction Counts'
+    
+    def __str__(self):
+        return f"{self.kind}: {self.count}"
+
+
+class ChatStatsRollup(models.Model):
+    """Pre-aggregated approved message counts per room and hour or day."""
+    
+    PERIOD_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+    ]
+    
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='stats_rollups')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the hour (UTC) or local day")
+    
+    message_count = models.IntegerField(default=0)
+    senders = models.JSONField(default=list, blank=True, help_text="Distinct signed-in sender ids")
+    
+    class Meta:
+        unique_together = ['room', 'period', 'bucket']
+        indexes = [
+            models.Index(fields=['period', 'bucket'], name='chat_rollup_period_bucket_idx'),
+        ]
+        verbose_name = 'Chat Stats Rollup'
+        verbose_name_plural = 'Chat Stats Rollups'
+    
+    def __str__(self):
+        return f"{self.room_id} {self.period} {self.bucket:%Y-%m-%d %H:%M}: {self.message_count}"
+    
+    @property
+    def sender_count(self):
+        return len(self.senders)
+
+
 class ChatUserActivity(models.Model):
     """Track user activity in chat rooms."""
     
@@ -155,7 +215,8 @@ class ChatUserActivity(models.Model):
     session_id = models.CharField(max_length=100, blank=True)
     
     activity_type = models.CharField(max_length=20, choices=ACTIVITY_TYPE_CHOICES)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: rows are bulk-inserted later with the time of the activity
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     # Additional data
     message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, null=True, blank=True)
@@ -202,4 +263,27 @@ class MessageReport(models.Model):
         unique_together = ['message', 'reported_by', 'session_id']
         ordering = ['-created_at']
         verbose_name = 'Message Report'
-        verbose_name_plural = 'Message Reports'
\ No newline at end of file
+        verbose_name_plural = 'Message Reports'
+
+
+class ChatArchive(models.Model):
+    """A compressed JSONL archive of one room's expired messages for one month."""
+    
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archives')
+    month = models.DateField(help_text="First day of the archived month")
+    file = models.FileField(upload_to='chat-archives/')
+    
+    message_count = models.IntegerField(default=0)
+    first_message_at = models.DateTimeField()
+    last_message_at = models.DateTimeField()
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    restored_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['room', '-month', 'created_at']
+        verbose_name = 'Chat Archive'
+        verbose_name_plural = 'Chat Archives'
+    
+    def __str__(self):
+        return f"{self.room.name} {self.month:%Y-%m} ({self.message_count} messages)"
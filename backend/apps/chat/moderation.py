@@ -0,0 +1,121 @@
+"""
+Word-list moderation for chat messages.
+
+Each room's comma-separated ``banned_words`` plus the site-wide
+``CHAT_FLAGGED_WORDS`` are compiled into a single Aho-Corasick automaton,
+so checking a message is one pass over its text whatever the list sizes.
+Compiled filters are cached per process, keyed by the room's
+``updated_at``, so editing a room's word list replaces its filter.
+
+Both the REST serializers and ChatConsumer use this module.
+"""
+
+import threading
+from collections import deque
+
+from django.conf import settings
+
+from apps.common.snapshots import version_of
+
+# Verdicts, strongest first
+BANNED = 'banned'    # Reject the message
+FLAGGED = 'flagged'  # Hold it for a moderator in moderated rooms
+
+_PRIORITY = {BANNED: 0, FLAGGED: 1}
+
+
+class WordMatcher:
+    """Aho-Corasick automaton mapping lower-cased words to verdicts."""
+
+    def __init__(self, words):
+        self._goto = [{}]
+        self._fail = [0]
+        self._verdict = [None]
+
+        for word, verdict in words:
+            state = 0
+            for char in word:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._verdict.append(None)
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._verdict[state] = self._stronger(self._verdict[state], verdict)
+
+        # Breadth-first pass to set failure links and inherit verdicts
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self._goto[state].items():
+                queue.append(target)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[target] = self._goto[fail].get(char, 0)
+                self._verdict[target] = self._stronger(
+                    self._verdict[target], self._verdict[self._fail[target]]
+                )
+
+    @staticmethod
+    def _stronger(first, second):
+        if first is None:
+            return second
+        if second is None:
+            return first
+        return first if _PRIORITY[first] <= _PRIORITY[second] else second
+
+    def check(self, text):
+        """Return the strongest verdict for any word found in ``text``, or None."""
+        goto, fail, verdicts = self._goto, self._fail, self._verdict
+        state = 0
+        result = None
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if verdicts[state] is not None:
+                result = self._stronger(result, verdicts[state])
+                if result == BANNED:
+                    break
+        return result
+
+
+def parse_words(value):
+    """Split a comma-separated word list into lower-cased entries."""
+    return [word.strip().lower() for word in (value or '').split(',') if word.strip()]
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_room_filter(room_id, banned_words, version):
+    """
+    Return the compiled filter for a room.
+
+    ``version`` is the room's ``updated_at``, as a datetime or already
+    through ``version_of``; a new value compiles a fresh automaton and
+    replaces the cached one. Both forms, and str or UUID ids, share one
+    entry per room.
+    """
+    room_id = str(room_id)
+    if not isinstance(version, int):
+        version = version_of(version)
+    cached = _cache.get(room_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    flagged = [word.lower() for word in getattr(settings, 'CHAT_FLAGGED_WORDS', [])]
+    matcher = WordMatcher(
+        [(word, FLAGGED) for word in flagged] +
+        [(word, BANNED) for word in parse_words(banned_words)]
+    )
+    with _cache_lock:
+        _cache[room_id] = (version, matcher)
+    return matcher
+
+
+def check_message(room, content):
+    """Moderation verdict for ``content`` posted to ``room``."""
+    return get_room_filter(room.pk, room.banned_words, room.updated_at).check(content)
@@ -0,0 +1,259 @@
+"""
+Moderation work queue for flagged and reported messages.
+
+Nothing on the message insert or report path acts on a message beyond one
+``ZINCRBY``: held messages and reports are queued for review in
+``chat:moderation:queue``, a sorted set of message ids scored by priority.
+A report adds the weight of its reason (``CHAT_REPORT_PRIORITIES``) and a
+message held by the word filter adds ``CHAT_FLAGGED_PRIORITY``, so messages
+reported most often for the most serious reasons come first.
+
+Moderator decisions (approve, remove, dismiss) are appended to
+``chat:moderation:decisions`` and applied in batches by the
+``apply_moderation_decisions`` task, with grouped updates of the messages
+and their open reports. Connected clients are then sent a
+``message_deleted`` frame per room for removed messages and the usual
+``chat_message`` frame for approved ones.
+"""
+
+import json
+import logging
+import uuid
+from collections import Counter, defaultdict
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from apps.common import fanout
+from apps.common.broadcast import frame_event
+from apps.common.realtime import get_async_redis, get_redis, release_lock
+from . import backfill, counters, persistence
+from .models import ChatMessage, MessageReport
+from .serializers import ChatMessageSerializer
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY = 'chat:moderation:queue'
+DECISIONS_KEY = 'chat:moderation:decisions'
+STATS_KEY = 'chat:moderation:stats'
+LOCK_KEY = 'chat:moderation:lock'
+
+# Decision -> result counter
+ACTIONS = {'approve': 'approved', 'remove': 'removed', 'dismiss': 'dismissed'}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def report_priority(reason):
+    return _setting('CHAT_REPORT_PRIORITIES', {}).get(reason, 1)
+
+
+def flagged_priority():
+    return _setting('CHAT_FLAGGED_PRIORITY', 2)
+
+
+def enqueue(message_id, weight):
+    """Queue a message for review, or raise its priority if already queued."""
+    get_redis().zincrby(QUEUE_KEY, weight, str(message_id))
+
+
+async def aenqueue(message_id, weight):
+    await get_async_redis().zincrby(QUEUE_KEY, weight, str(message_id))
+
+
+def pending_reviews(limit=50, room_ids=None):
+    """
+    The highest-priority queued messages, optionally only from ``room_ids``.
+
+    Returns ``[(message, priority)]``. Messages that no longer exist are
+    dropped from the queue as they are found; those still waiting in the
+    write-behind journal stay queued and show up once written.
+    """
+    redis = get_redis()
+    reviews = []
+    start, chunk = 0, max(limit, 100)
+    while len(reviews) < limit and start < 20 * chunk:
+        entries = redis.zrange(QUEUE_KEY, start, start + chunk - 1, desc=True, withscores=True)
+        if not entries:
+            break
+        messages = ChatMessage.objects.filter(
+            pk__in=[message_id for message_id, _ in entries]
+        ).select_related('user', 'room')
+        if room_ids is not None:
+            messages = messages.filter(room_id__in=room_ids)
+        messages = {str(message.pk): message for message in messages}
+        if room_ids is None:
+            missing = [message_id for message_id, _ in entries if message_id not in messages]
+            if missing:
+                pipe = redis.pipeline()
+                for message_id in missing:
+                    pipe.hget(persistence.PENDING_KEY, message_id)
+                gone = [message_id for message_id, record in zip(missing, pipe.execute()) if record is None]
+                if gone:
+                    redis.zrem(QUEUE_KEY, *gone)
+        reviews.extend(
+            (messages[message_id], int(score))
+            for message_id, score in entries if message_id in messages
+        )
+        start += chunk
+    return reviews[:limit]
+
+
+def submit_decisions(decisions, moderator):
+    """
+    Queue moderator decisions for the next batch.
+
+    ``decisions`` is a list of ``{'message_id', 'action', 'note'}`` dicts
+    with ``action`` one of ``ACTIONS``. Returns the number queued.
+    """
+    now = timezone.now().isoformat()
+    records = [
+        json.dumps({
+            'message_id': str(decision['message_id']),
+            'action': decision['action'],
+            'note': (decision.get('note') or '')[:200],
+            'moderator_id': moderator.pk,
+            'decided_at': now,
+        })
+        for decision in decisions
+    ]
+    if records:
+        get_redis().rpush(DECISIONS_KEY, *records)
+    return len(records)
+
+
+def broadcast_changes(removed, approved):
+    """Send ``message_deleted`` and ``chat_message`` frames to the affected rooms."""
+    channel_layer = get_channel_layer()
+    for room_slug in set(removed) | set(approved):
+        backfill.invalidate(room_slug)
+        if channel_layer is None:
+            continue
+        group = f'chat_{room_slug}'
+        try:
+            if removed.get(room_slug):
+                fanout.group_send_sync(channel_layer, group, frame_event({
+                    'type': 'message_deleted',
+                    'message_ids': removed[room_slug]
+                }))
+            for message in approved.get(room_slug, []):
+                fanout.group_send_sync(channel_layer, group, frame_event({
+                    'type': 'chat_message',
+                    'message': ChatMessageSerializer(message).data
+                }))
+        except Exception:
+            logger.exception("Moderation broadcast to %s failed", group)
+
+
+def apply_decisions(decisions):
+    """
+    Apply a batch of decisions; the latest decision per message wins.
+
+    Returns ``{'approved': n, 'removed': n, 'dismissed': n}``.
+    """
+    latest = {}
+    for decision in decisions:
+        if decision['action'] in ACTIONS:
+            latest[decision['message_id']] = decision
+    messages = {
+        str(message.pk): message
+        for message in ChatMessage.objects.filter(pk__in=list(latest)).select_related('user', 'room')
+    }
+
+    # Group identical updates: one UPDATE per (action, moderator, note)
+    groups = defaultdict(list)
+    for message_id, decision in latest.items():
+        if message_id in messages:
+            groups[(decision['action'], decision['moderator_id'], decision['note'])].append(message_id)
+
+    now = timezone.now()
+    removed, approved = defaultdict(list), defaultdict(list)
+    removed_counts, newly_approved = Counter(), []
+    result = {'approved': 0, 'removed': 0, 'dismissed': 0}
+    with transaction.atomic():
+        for (action, moderator_id, note), message_ids in groups.items():
+            if action != 'dismiss':
+                ChatMessage.objects.filter(pk__in=message_ids).update(
+                    is_approved=action == 'approve',
+                    is_moderated=True,
+                    moderated_by_id=moderator_id,
+                    moderation_reason=note if action == 'remove' else '',
+                    updated_at=now
+                )
+            MessageReport.objects.filter(message_id__in=message_ids, is_resolved=False).update(
+                is_resolved=True,
+                resolved_by_id=moderator_id,
+                resolved_at=now,
+                resolution_note=note
+            )
+            result[ACTIONS[action]] += len(message_ids)
+
+            for message_id in message_ids:
+                message = messages[message_id]
+                if action == 'remove' and message.is_approved:
+                    removed[message.room.slug].append(message_id)
+                    removed_counts[message.room_id] += 1
+                elif action == 'approve' and not message.is_approved:
+                    message.is_approved = True
+                    approved[message.room.slug].append(message)
+                    newly_approved.append(message)
+
+    if latest:
+        get_redis().zrem(QUEUE_KEY, *latest)
+    if removed_counts:
+        counters.record_removed(removed_counts)
+    for message in newly_approved:
+        counters.record_message(message.room_id, message.user_id, message.session_id)
+    broadcast_changes(removed, approved)
+    return result
+
+
+def apply_moderation_decisions(batch_size=None, max_batches=20):
+    """Apply queued decisions in batches; returns the number of decisions processed."""
+    batch_size = batch_size or _setting('CHAT_MODERATION_BATCH_SIZE', 500)
+    redis = get_redis()
+    token = uuid.uuid4().hex
+    if not redis.set(LOCK_KEY, token, ex=60, nx=True):
+        return 0
+
+    processed = 0
+    try:
+        for _ in range(max_batches):
+            pipe = redis.pipeline()
+            pipe.lrange(DECISIONS_KEY, 0, batch_size - 1)
+            pipe.ltrim(DECISIONS_KEY, batch_size, -1)
+            raw = pipe.execute()[0]
+            if not raw:
+                break
+            try:
+                result = apply_decisions([json.loads(item) for item in raw])
+            except Exception:
+                logger.exception("Moderation batch failed; requeueing %d decisions", len(raw))
+                pipe = redis.pipeline()
+                pipe.lpush(DECISIONS_KEY, *reversed(raw))
+                pipe.hincrby(STATS_KEY, 'failed_batches', 1)
+                pipe.execute()
+                break
+            pipe = redis.pipeline()
+            for name, count in result.items():
+                pipe.hincrby(STATS_KEY, name, count)
+            pipe.execute()
+            processed += len(raw)
+            if len(raw) < batch_size:
+                break
+    finally:
+        release_lock([LOCK_KEY], [token])
+    return processed
+
+
+def moderation_stats():
+    """Queue depth, pending decisions and decision totals."""
+    redis = get_redis()
+    stats = {name: int(value) for name, value in redis.hgetall(STATS_KEY).items()}
+    stats['queued'] = redis.zcard(QUEUE_KEY)
+    stats['decisions_pending'] = redis.llen(DECISIONS_KEY)
+    return stats
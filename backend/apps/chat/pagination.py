@@ -0,0 +1,73 @@
+"""
+Keyset pagination for chat history.
+
+Positions are ``(created_at, id)`` pairs, so paging back through a room is an
+index range scan on ``chat_msg_room_history_idx`` however deep the client
+scrolls, and no ``COUNT(*)`` is ever issued.
+"""
+
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import CursorPagination
+
+from apps.common.realtime import get_redis
+from . import persistence
+from .models import ChatMessage
+
+
+class ChatMessageCursorPagination(CursorPagination):
+    """Opaque-cursor pagination for the message list endpoint."""
+
+    ordering = '-created_at'
+    page_size = 50
+    page_size_query_param = 'limit'
+    max_page_size = 200
+
+
+def resolve_cursor(message_id):
+    """
+    Return the ``(created_at, id)`` position of a message, or None.
+
+    Messages still waiting in the write-behind journal resolve too, so a
+    client can page from a message it has only seen over the WebSocket.
+    """
+    try:
+        position = ChatMessage.objects.filter(id=message_id).values_list('created_at', 'id').first()
+    except ValidationError:  # Malformed UUID
+        return None
+    if position:
+        return position
+
+    raw = get_redis().hget(persistence.PENDING_KEY, str(message_id))
+    if raw:
+        record = json.loads(raw)
+        return parse_datetime(record['created_at']), record['id']
+    return None
+
+
+def history_page(queryset, before=None, after=None, limit=50):
+    """
+    Return up to ``limit`` messages, oldest first.
+
+    ``before``/``after`` are ``(created_at, id)`` positions; without either
+    the newest messages are returned. The plain ``created_at`` bound is what
+    lets the planner turn the cursor into an index range.
+    """
+    if after is not None:
+        created_at, message_id = after
+        queryset = queryset.filter(created_at__gte=created_at).filter(
+            Q(created_at__gt=created_at) | Q(id__gt=message_id)
+        ).order_by('created_at', 'id')
+        return list(queryset[:limit])
+
+    if before is not None:
+        created_at, message_id = before
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__lt=message_id)
+        )
+    messages = list(queryset.order_by('-created_at', '-id')[:limit])
+    messages.reverse()
+    return messages
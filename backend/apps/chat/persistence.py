@@ -0,0 +1,253 @@
+"""
+Write-behind persistence for WebSocket chat messages.
+
+With ``CHAT_WRITE_BEHIND`` enabled, ChatConsumer assigns the message id and
+timestamp itself, broadcasts straight away and hands the row to this buffer.
+The buffer flushes with ``bulk_create`` every ``CHAT_WRITE_BEHIND_INTERVAL_MS``
+or as soon as ``CHAT_WRITE_BEHIND_BATCH_SIZE`` messages are waiting.
+
+Every buffered message is first journaled in the real-time store and only
+removed once its batch is committed. Batches that fail, and anything left
+behind by a crashed node, stay in the journal until the
+``recover_pending_messages`` task writes them. Records that can never be
+written (their room or sender was deleted meanwhile, or they do not parse)
+are moved to ``chat:writebehind:dead`` so they cannot block their batch.
+"""
+
+import asyncio
+import atexit
+import json
+import logging
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from django.contrib.auth.models import User
+
+from apps.common.realtime import get_async_redis, get_redis
+from .models import ChatMessage, ChatRoom
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'chat:writebehind:pending'
+STATS_KEY = 'chat:writebehind:stats'
+DEAD_LETTER_KEY = 'chat:writebehind:dead'
+
+
+def build_message_record(room_id, user, content, session_id, message_type='text', is_approved=True):
+    """Create the journal record for a message, with server-assigned id and time."""
+    return {
+        'id': str(uuid.uuid4()),
+        'room_id': str(room_id),
+        'user_id': user.id if user.is_authenticated else None,
+        'anonymous_name': '' if user.is_authenticated else user.username,
+        'session_id': session_id or '',
+        'message_type': message_type,
+        'content': content,
+        'is_approved': is_approved,
+        'created_at': timezone.now().isoformat(),
+        'queued_at': time.time(),
+    }
+
+
+def message_payload(record, user):
+    """Broadcast payload matching ChatMessageSerializer, built without a query."""
+    created_at = serializers.DateTimeField().to_representation(
+        parse_datetime(record['created_at'])
+    )
+    payload = {
+        'id': record['id'],
+        'message_type': record['message_type'],
+        'content': record['content'],
+        'emoji_reaction': '',
+        'sender_name': (
+            (user.get_full_name() or user.username) if user.is_authenticated
+            else record['anonymous_name'] or 'Anonymous'
+        ),
+        'anonymous_name': record['anonymous_name'],
+        'is_approved': record.get('is_approved', True),
+        'likes': 0,
+        'reports': 0,
+        'is_own_message': False,
+        'created_at': created_at,
+        'updated_at': created_at,
+    }
+    if user.is_authenticated:
+        payload['username'] = user.username
+    return payload
+
+
+def persist_records(records):
+    """Insert journaled records; rows that already exist are skipped."""
+    ChatMessage.objects.bulk_create(
+        [
+            ChatMessage(
+                id=record['id'],
+                room_id=record['room_id'],
+                user_id=record['user_id'],
+                anonymous_name=record['anonymous_name'],
+                session_id=record['session_id'],
+                message_type=record['message_type'],
+                content=record['content'],
+                is_approved=record.get('is_approved', True),
+                created_at=parse_datetime(record['created_at']),
+            )
+            for record in records
+        ],
+        ignore_conflicts=True
+    )
+
+
+class MessageWriteBehind:
+    """Per-process buffer that batches chat message inserts."""
+
+    def __init__(self):
+        self._buffer = []
+        self._task = None
+        self._wakeup = None
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL_MS', 250) / 1000.0
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 200)
+
+    async def enqueue(self, record):
+        """Journal a record and schedule it for the next flush."""
+        await get_async_redis().hset(PENDING_KEY, record['id'], json.dumps(record))
+        self._buffer.append(record)
+        self._ensure_running()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:len(batch)]
+                await self._flush(batch)
+
+    async def _flush(self, batch):
+        redis = get_async_redis()
+        try:
+            await database_sync_to_async(persist_records)(batch)
+        except Exception:
+            logger.exception("Chat write-behind flush failed for %d messages", len(batch))
+            pipe = redis.pipeline()
+            pipe.hincrby(STATS_KEY, 'failed_batches', 1)
+            pipe.hincrby(STATS_KEY, 'failed_messages', len(batch))
+            await pipe.execute()
+            return
+
+        pipe = redis.pipeline()
+        pipe.hdel(PENDING_KEY, *[record['id'] for record in batch])
+        pipe.hincrby(STATS_KEY, 'flushed_batches', 1)
+        pipe.hincrby(STATS_KEY, 'flushed_messages', len(batch))
+        await pipe.execute()
+
+    def flush_sync(self):
+        """Write whatever is still buffered; used on interpreter shutdown."""
+        batch, self._buffer = self._buffer, []
+        if not batch:
+            return
+        try:
+            persist_records(batch)
+            get_redis().hdel(PENDING_KEY, *[record['id'] for record in batch])
+        except Exception:
+            logger.exception("Chat write-behind shutdown flush failed; messages remain journaled")
+
+
+def writable_records(records):
+    """Split ``records`` into those whose room and sender still exist, and the rest."""
+    room_ids = {record['room_id'] for record in records}
+    user_ids = {record['user_id'] for record in records if record['user_id']}
+    rooms = {str(pk) for pk in ChatRoom.objects.filter(id__in=room_ids).values_list('id', flat=True)}
+    users = set(User.objects.filter(id__in=user_ids).values_list('id', flat=True))
+    writable, dead = [], []
+    for record in records:
+        if record['room_id'] in rooms and (not record['user_id'] or record['user_id'] in users):
+            writable.append(record)
+        else:
+            dead.append(record)
+    return writable, dead
+
+
+def recover_pending_messages(min_age=60, batch_size=500):
+    """
+    Persist journaled messages older than ``min_age`` seconds.
+
+    These are batches that failed or whose node died before flushing.
+    Records that cannot be written are moved to the dead-letter hash.
+    Returns the number of messages written.
+    """
+    redis = get_redis()
+    cutoff = time.time() - min_age
+    records, dead = [], {}
+    for message_id, raw in redis.hgetall(PENDING_KEY).items():
+        try:
+            record = json.loads(raw)
+            if record['queued_at'] <= cutoff:
+                records.append(record)
+        except (ValueError, TypeError, KeyError):
+            dead[message_id] = raw
+
+    recovered = 0
+    for start in range(0, len(records), batch_size):
+        batch = records[start:start + batch_size]
+        try:
+            batch, unwritable = writable_records(batch)
+            dead.update((record['id'], json.dumps(record)) for record in unwritable)
+            persist_records(batch)
+        except Exception:
+            logger.exception("Chat write-behind recovery failed for %d messages", len(batch))
+            redis.hincrby(STATS_KEY, 'failed_batches', 1)
+            continue
+        if batch:
+            pipe = redis.pipeline()
+            pipe.hdel(PENDING_KEY, *[record['id'] for record in batch])
+            pipe.hincrby(STATS_KEY, 'recovered_messages', len(batch))
+            pipe.execute()
+        recovered += len(batch)
+
+    if dead:
+        logger.warning("Moved %d unwritable chat messages to %s", len(dead), DEAD_LETTER_KEY)
+        pipe = redis.pipeline()
+        pipe.hset(DEAD_LETTER_KEY, mapping=dead)
+        pipe.hdel(PENDING_KEY, *dead)
+        pipe.hincrby(STATS_KEY, 'dead_messages', len(dead))
+        pipe.execute()
+    return recovered
+
+
+def write_behind_stats():
+    """Flushed, failed and recovered counters plus the current journal size."""
+    redis = get_redis()
+    stats = {name: int(value) for name, value in redis.hgetall(STATS_KEY).items()}
+    stats['pending_messages'] = redis.hlen(PENDING_KEY)
+    stats['dead_letter_messages'] = redis.hlen(DEAD_LETTER_KEY)
+    return stats
+
+
+write_behind = MessageWriteBehind()
+atexit.register(write_behind.flush_sync)
@@ -0,0 +1,7 @@
+"""
+Presence registry for chat rooms, keyed by room slug.
+"""
+
+from apps.common.presence import PresenceTracker
+
+chat_presence = PresenceTracker('chat')
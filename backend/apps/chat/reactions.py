@@ -0,0 +1,275 @@
+"""
+Aggregated reaction counters for chat messages.
+
+Reactions are counted in the real-time store instead of doing a
+read-modify-write on the message row. Two hashes are kept:
+
+* ``reactions:pending`` - deltas not yet written to the database, keyed by
+  ``<message_id>:<kind>``. The ``flush_reaction_counts`` task swaps it out
+  and applies the deltas with ``F()`` updates.
+* ``reactions:totals:<message_id>`` - running totals per kind, seeded from
+  the database on first use, which is what clients are shown.
+
+Totals of messages reacted to are broadcast as one ``reaction_counts`` frame
+per room and tick: consumers coalesce them on their event loop, and the REST
+``like`` action queues the ``broadcast_reaction_counts`` task instead.
+
+Likes stay on ``ChatMessage.likes``; other kinds live in
+``MessageReactionCount``.
+"""
+
+import logging
+import uuid
+from collections import defaultdict
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from apps.common import fanout
+from apps.common.broadcast import GroupBroadcastCoalescer, frame_event
+from apps.common.realtime import get_async_redis, get_redis, release_lock
+from . import persistence
+from .models import ChatMessage, MessageReactionCount
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'reactions:pending'
+FLUSHING_PREFIX = 'reactions:flushing:'
+FLUSH_LOCK_KEY = 'reactions:flush-lock'
+BROADCAST_QUEUED_PREFIX = 'reactions:broadcast-queued:'
+TOTALS_TTL = 24 * 60 * 60
+
+
+def reaction_kinds():
+    return getattr(settings, 'CHAT_REACTION_KINDS', ['like'])
+
+
+def totals_key(message_id):
+    return f'reactions:totals:{message_id}'
+
+
+def dirty_key(room_slug):
+    return f'reactions:dirty:{room_slug}'
+
+
+def load_totals(message_id):
+    """
+    Read a message's reaction totals from the database.
+
+    Returns None for unknown messages. A message still waiting in the
+    write-behind journal has no reactions yet.
+    """
+    likes = ChatMessage.objects.filter(id=message_id).values_list('likes', flat=True).first()
+    if likes is None:
+        return {} if get_redis().hget(persistence.PENDING_KEY, str(message_id)) else None
+    totals = dict(
+        MessageReactionCount.objects.filter(message_id=message_id).values_list('kind', 'count')
+    )
+    totals['like'] = likes
+    return totals
+
+
+def _queue_increment(pipe, message_id, room_slug, kind, amount):
+    pipe.hincrby(PENDING_KEY, f'{message_id}:{kind}', amount)
+    pipe.hincrby(totals_key(message_id), kind, amount)
+    pipe.expire(totals_key(message_id), TOTALS_TTL)
+    pipe.sadd(dirty_key(room_slug), str(message_id))
+    pipe.hgetall(totals_key(message_id))
+
+
+def _seed(redis, message_id, totals):
+    pipe = redis.pipeline()
+    for name, count in totals.items():
+        pipe.hsetnx(totals_key(message_id), name, count)
+    return pipe
+
+
+def increment(message_id, room_slug, kind, amount=1):
+    """
+    Count a reaction from a sync caller.
+
+    Returns the message's totals, or None if the message does not exist.
+    """
+    redis = get_redis()
+    if not redis.exists(totals_key(message_id)):
+        totals = load_totals(message_id)
+        if totals is None:
+            return None
+        _seed(redis, message_id, totals).execute()
+    pipe = redis.pipeline()
+    _queue_increment(pipe, message_id, room_slug, kind, amount)
+    totals = pipe.execute()[-1]
+    return {name: int(count) for name, count in totals.items()}
+
+
+async def aincrement(message_id, room_slug, kind, seed_totals, amount=1):
+    """
+    Count a reaction from a consumer.
+
+    ``seed_totals`` is an async wrapper around ``load_totals``, only awaited
+    when the running totals are not cached yet. Returns the message's totals,
+    or None if the message does not exist.
+    """
+    redis = get_async_redis()
+    if not await redis.exists(totals_key(message_id)):
+        totals = await seed_totals(message_id)
+        if totals is None:
+            return None
+        await _seed(redis, message_id, totals).execute()
+    pipe = redis.pipeline()
+    _queue_increment(pipe, message_id, room_slug, kind, amount)
+    totals = (await pipe.execute())[-1]
+    return {name: int(count) for name, count in totals.items()}
+
+
+reaction_broadcasts = GroupBroadcastCoalescer(
+    'chat_reactions', interval_setting='CHAT_REACTION_BROADCAST_INTERVAL', default_interval=1.0
+)
+
+
+async def schedule_reaction_counts(channel_layer, room_slug, group_name):
+    """Broadcast totals for every message reacted to since the last tick."""
+
+    async def build_event():
+        redis = get_async_redis()
+        pipe = redis.pipeline()
+        pipe.smembers(dirty_key(room_slug))
+        pipe.delete(dirty_key(room_slug))
+        message_ids = sorted((await pipe.execute())[0])
+
+        pipe = redis.pipeline()
+        for message_id in message_ids:
+            pipe.hgetall(totals_key(message_id))
+        totals = await pipe.execute() if message_ids else []
+        return reaction_counts_event(message_ids, totals)
+
+    await reaction_broadcasts.schedule(channel_layer, group_name, build_event)
+
+
+def reaction_counts_event(message_ids, totals):
+    return frame_event({
+        'type': 'reaction_counts',
+        'messages': {
+            message_id: {name: int(count) for name, count in counts.items()}
+            for message_id, counts in zip(message_ids, totals)
+        }
+    })
+
+
+def queue_reaction_counts(room_slug, group_name):
+    """
+    ``schedule_reaction_counts`` for sync callers such as views.
+
+    Queues at most one ``broadcast_reaction_counts`` task per room and tick.
+    The task clears the marker before reading the dirty set, so a reaction
+    counted after that queues the next one.
+    """
+    from .tasks import broadcast_reaction_counts
+
+    if get_redis().set(f'{BROADCAST_QUEUED_PREFIX}{room_slug}', 1, ex=60, nx=True):
+        broadcast_reaction_counts.apply_async(
+            (room_slug, group_name), countdown=reaction_broadcasts.interval
+        )
+
+
+def broadcast_reaction_counts(room_slug, group_name):
+    """Broadcast totals for every message of the room reacted to; returns the number sent."""
+    redis = get_redis()
+    pipe = redis.pipeline()
+    pipe.delete(f'{BROADCAST_QUEUED_PREFIX}{room_slug}')
+    pipe.smembers(dirty_key(room_slug))
+    pipe.delete(dirty_key(room_slug))
+    message_ids = sorted(pipe.execute()[1])
+    if not message_ids:
+        return 0
+
+    pipe = redis.pipeline()
+    for message_id in message_ids:
+        pipe.hgetall(totals_key(message_id))
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        fanout.group_send_sync(channel_layer, group_name, reaction_counts_event(message_ids, pipe.execute()))
+    return len(message_ids)
+
+
+def apply_deltas(deltas):
+    """
+    Write ``{(message_id, kind): delta}`` with atomic F() updates.
+
+    Returns the ids of messages that are not in the database (yet).
+    """
+    likes_by_delta = defaultdict(list)
+    kinds = defaultdict(list)
+    for (message_id, kind), delta in deltas.items():
+        if not delta:
+            continue
+        if kind == 'like':
+            likes_by_delta[delta].append(message_id)
+        else:
+            kinds[(kind, delta)].append(message_id)
+
+    requested_ids = {message_id for message_id, _ in deltas}
+    existing_ids = set(
+        str(pk) for pk in ChatMessage.objects.filter(id__in=requested_ids).values_list('id', flat=True)
+    )
+
+    with transaction.atomic():
+        for delta, message_ids in likes_by_delta.items():
+            ChatMessage.objects.filter(id__in=message_ids).update(likes=F('likes') + delta)
+
+        for (kind, delta), message_ids in kinds.items():
+            message_ids = [message_id for message_id in message_ids if message_id in existing_ids]
+            MessageReactionCount.objects.bulk_create(
+                [MessageReactionCount(message_id=message_id, kind=kind) for message_id in message_ids],
+                ignore_conflicts=True
+            )
+            MessageReactionCount.objects.filter(
+                message_id__in=message_ids, kind=kind
+            ).update(count=F('count') + delta)
+
+    return requested_ids - existing_ids
+
+
+def flush_reaction_counts():
+    """
+    Move pending reaction deltas into the database.
+
+    The pending hash is renamed before it is read, so increments arriving
+    during the flush land in a fresh hash. A batch that fails to write keeps
+    its key and is retried on the next run. Returns the number of deltas
+    written.
+    """
+    redis = get_redis()
+    token = uuid.uuid4().hex
+    if not redis.set(FLUSH_LOCK_KEY, token, ex=60, nx=True):
+        return 0
+
+    try:
+        if redis.exists(PENDING_KEY):
+            redis.rename(PENDING_KEY, f'{FLUSHING_PREFIX}{uuid.uuid4().hex}')
+
+        flushed = 0
+        for key in list(redis.scan_iter(match=f'{FLUSHING_PREFIX}*')):
+            deltas = {}
+            for field, delta in redis.hgetall(key).items():
+                message_id, kind = field.rsplit(':', 1)
+                deltas[(message_id, kind)] = int(delta)
+            try:
+                missing = apply_deltas(deltas)
+            except Exception:
+                logger.exception("Reaction flush failed for %s; will retry", key)
+                continue
+
+            # Messages still in the write-behind journal get their deltas back
+            pipe = redis.pipeline()
+            for (message_id, kind), delta in deltas.items():
+                if message_id in missing and redis.hget(persistence.PENDING_KEY, message_id):
+                    pipe.hincrby(PENDING_KEY, f'{message_id}:{kind}', delta)
+            pipe.delete(key)
+            pipe.execute()
+            flushed += len(deltas)
+        return flushed
+    finally:
+        release_lock([FLUSH_LOCK_KEY], [token])
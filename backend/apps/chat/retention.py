@@ -0,0 +1,274 @@
+"""
+Retention and archival for chat history.
+
+Messages older than ``CHAT_RETENTION_DAYS`` are removed by the
+``cleanup_old_messages`` task in small batches instead of one large DELETE.
+Expired messages are taken one room and month at a time, oldest first:
+
+1. the month's messages, their reports and reaction totals are read in
+   batches and staged as gzipped JSONL (Django's ``jsonl`` serializer) in a
+   temporary file, one gzip member per batch;
+2. the month's ``ChatArchive`` is written once: a new file holding the
+   previous archive of that room and month, if any, followed by the staged
+   batches, so each room and month keeps a single archive as the cutoff
+   moves through it night after night;
+3. the messages are deleted in short transactions of one batch each, along
+   with the rows cascading from them (activity entries, reports, reaction
+   totals).
+
+Runs stop after ``CHAT_RETENTION_MAX_BATCHES`` batches read and pause
+``CHAT_RETENTION_BATCH_PAUSE`` seconds between deletes, so a large backlog
+is worked off over several nights without holding long locks. A month cut
+short by the batch limit is appended to on the next run. If a run dies
+before its deletes, the next run archives the same messages again; the
+duplicates are skipped on restore.
+
+``restore_archive`` loads an archive back into the database. Restored
+months are kept for ``CHAT_ARCHIVE_RESTORE_DAYS`` before retention may
+remove them again.
+"""
+
+import gzip
+import io
+import logging
+import shutil
+import tempfile
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.common.realtime import get_redis, release_lock
+from . import counters
+from .models import ChatArchive, ChatMessage, MessageReactionCount, MessageReport
+
+logger = logging.getLogger(__name__)
+
+LOCK_KEY = 'chat:retention:lock'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _month_start(moment):
+    return moment.astimezone(dt_timezone.utc).date().replace(day=1)
+
+
+def _month_bounds(month):
+    start = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+
+def restore_holds():
+    """Exclude months restored from an archive within the hold period."""
+    since = timezone.now() - timedelta(days=_setting('CHAT_ARCHIVE_RESTORE_DAYS', 30))
+    holds = Q()
+    for room_id, month in ChatArchive.objects.filter(
+        restored_at__gte=since
+    ).values_list('room_id', 'month').distinct():
+        start, end = _month_bounds(month)
+        holds |= Q(room_id=room_id, created_at__gte=start, created_at__lt=end)
+    return holds
+
+
+def encode_archive(messages):
+    """Gzipped JSONL of ``messages`` followed by their reports and reaction totals."""
+    message_ids = [message.pk for message in messages]
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as archive:
+        stream = io.TextIOWrapper(archive, encoding='utf-8')
+        for queryset in (
+            messages,
+            MessageReport.objects.filter(message_id__in=message_ids),
+            MessageReactionCount.objects.filter(message_id__in=message_ids),
+        ):
+            serializers.serialize('jsonl', queryset, stream=stream)
+        stream.flush()
+        stream.detach()
+    return buffer.getvalue()
+
+
+def write_archive(room_id, month, staged, message_count, first_message_at, last_message_at):
+    """
+    Store the staged batches as the room's archive for ``month``.
+
+    An existing archive for the room and month is carried over in front of
+    them and its old file is removed once the row is updated. Returns the
+    ChatArchive row.
+    """
+    archive = ChatArchive.objects.filter(room_id=room_id, month=month).order_by('created_at').first()
+    with tempfile.TemporaryFile() as combined:
+        previous_name = None
+        if archive is None:
+            archive = ChatArchive(
+                room_id=room_id,
+                month=month,
+                first_message_at=first_message_at,
+                last_message_at=last_message_at,
+            )
+        else:
+            previous_name = archive.file.name
+            with archive.file.open('rb') as previous:
+                shutil.copyfileobj(previous, combined)
+            first_message_at = min(first_message_at, archive.first_message_at)
+            last_message_at = max(last_message_at, archive.last_message_at)
+        staged.seek(0)
+        shutil.copyfileobj(staged, combined)
+        combined.seek(0)
+
+        archive.message_count += message_count
+        archive.first_message_at = first_message_at
+        archive.last_message_at = last_message_at
+        archive.file.save(
+            f'{room_id}/{month:%Y-%m}/{timezone.now():%Y%m%d%H%M%S}.jsonl.gz',
+            File(combined),
+            save=False
+        )
+
+    storage = archive.file.storage
+    with transaction.atomic():
+        archive.save()
+        if previous_name and previous_name != archive.file.name:
+            transaction.on_commit(lambda: storage.delete(previous_name))
+    return archive
+
+
+def cleanup_old_messages(days=None, batch_size=None, max_batches=None, pause=None):
+    """
+    Archive and delete expired messages in bounded batches.
+
+    Returns ``{'archived': n, 'archives': n, 'batches': n}``.
+    """
+    days = days if days is not None else _setting('CHAT_RETENTION_DAYS', 365)
+    batch_size = batch_size or _setting('CHAT_RETENTION_BATCH_SIZE', 1000)
+    max_batches = max_batches or _setting('CHAT_RETENTION_MAX_BATCHES', 500)
+    pause = pause if pause is not None else _setting('CHAT_RETENTION_BATCH_PAUSE', 0.2)
+    result = {'archived': 0, 'archives': 0, 'batches': 0}
+
+    redis = get_redis()
+    token = uuid.uuid4().hex
+    if not redis.set(LOCK_KEY, token, ex=6 * 60 * 60, nx=True):
+        logger.info("Chat retention already running; skipping")
+        return result
+
+    try:
+        cutoff = timezone.now() - timedelta(days=days)
+        expired = ChatMessage.objects.filter(created_at__lt=cutoff).exclude(restore_holds())
+
+        while result['batches'] < max_batches:
+            oldest = expired.order_by('created_at', 'id').values_list('room_id', 'created_at').first()
+            if oldest is None:
+                break
+            room_id, month = oldest[0], _month_start(oldest[1])
+            start, end = _month_bounds(month)
+            month_expired = expired.filter(
+                room_id=room_id, created_at__gte=start, created_at__lt=end
+            ).order_by('created_at', 'id')
+
+            # Stage the month in batches, then write its archive once
+            message_ids, removed = [], Counter()
+            first_message_at = last_message_at = None
+            with tempfile.TemporaryFile() as staged:
+                batch = month_expired
+                while result['batches'] < max_batches:
+                    messages = list(batch[:batch_size])
+                    if not messages:
+                        break
+                    staged.write(encode_archive(messages))
+                    message_ids.extend(message.pk for message in messages)
+                    removed.update(message.room_id for message in messages if message.is_approved)
+                    first_message_at = first_message_at or messages[0].created_at
+                    last = messages[-1]
+                    last_message_at = last.created_at
+                    result['batches'] += 1
+                    if len(messages) < batch_size:
+                        break
+                    batch = month_expired.filter(
+                        Q(created_at__gt=last.created_at) | Q(created_at=last.created_at, id__gt=last.pk)
+                    )
+                write_archive(room_id, month, staged, len(message_ids), first_message_at, last_message_at)
+
+            for offset in range(0, len(message_ids), batch_size):
+                if offset:
+                    time.sleep(pause)
+                with transaction.atomic():
+                    ChatMessage.objects.filter(pk__in=message_ids[offset:offset + batch_size]).delete()
+            counters.record_removed(removed)
+
+            result['archived'] += len(message_ids)
+            result['archives'] += 1
+    finally:
+        release_lock([LOCK_KEY], [token])
+
+    if result['archived']:
+        logger.info(
+            "Archived %(archived)d chat messages into %(archives)d files in %(batches)d batches",
+            result
+        )
+    return result
+
+
+def restore_archive(archive):
+    """
+    Load an archive's messages, reports and reaction totals back.
+
+    Messages already in the database are left alone. Messages from deleted
+    users are skipped, and references to other deleted users are cleared.
+    Returns the number of messages restored.
+    """
+    with archive.file.open('rb') as raw, gzip.open(raw, 'rt', encoding='utf-8') as stream:
+        # Messages archived twice (a run that died before its deletes) are
+        # kept once
+        objects = defaultdict(dict)
+        for item in serializers.deserialize('jsonl', stream, ignorenonexistent=True):
+            objects[type(item.object)].setdefault(item.object.pk, item.object)
+        objects = defaultdict(list, {model: list(rows.values()) for model, rows in objects.items()})
+
+    messages = objects[ChatMessage]
+    user_ids = set()
+    for message in messages:
+        user_ids.update(filter(None, [message.user_id, message.moderated_by_id]))
+    for report in objects[MessageReport]:
+        user_ids.update(filter(None, [report.reported_by_id, report.resolved_by_id]))
+    users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+    existing = set(ChatMessage.objects.filter(
+        pk__in=[message.pk for message in messages]
+    ).values_list('pk', flat=True))
+    messages = [
+        message for message in messages
+        if message.pk not in existing and (not message.user_id or message.user_id in users)
+    ]
+    for message in messages:
+        if message.moderated_by_id not in users:
+            message.moderated_by_id = None
+    message_ids = {message.pk for message in messages}
+
+    # Reports and reaction totals get fresh primary keys
+    reports = [report for report in objects[MessageReport] if report.message_id in message_ids]
+    for report in reports:
+        report.pk = None
+        if report.reported_by_id not in users:
+            report.reported_by_id = None
+        if report.resolved_by_id not in users:
+            report.resolved_by_id = None
+    counts = [count for count in objects[MessageReactionCount] if count.message_id in message_ids]
+    for count in counts:
+        count.pk = None
+
+    with transaction.atomic():
+        restored = len(ChatMessage.objects.bulk_create(messages, ignore_conflicts=True))
+        MessageReport.objects.bulk_create(reports, ignore_conflicts=True)
+        MessageReactionCount.objects.bulk_create(counts, ignore_conflicts=True)
+        archive.restored_at = timezone.now()
+        archive.save(update_fields=['restored_at'])
+    return restored
@@ -0,0 +1,178 @@
+"""
+Hourly and daily chat statistics rollups.
+
+The ``rollup_chat_stats`` task aggregates approved messages into
+``ChatStatsRollup`` rows: one per room and UTC hour, and one per room and
+local day once that day is complete. Each row holds the message count and
+the distinct signed-in senders, so windows spanning several rows can still
+count distinct users exactly.
+
+Hours are rolled up once they are ``CHAT_STATS_GRACE_MINUTES`` old, and the
+last ``CHAT_STATS_REROLL_HOURS`` are recomputed on every run to pick up
+late writes (write-behind recovery) and moderation. Everything after the
+last rolled-up hour is the live tail, read from ``ChatMessage`` directly;
+it is at most an hour or so of rows on the ``created_at`` index.
+"""
+
+from collections import defaultdict
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.common.realtime import get_redis
+from .models import ChatMessage, ChatStatsRollup
+
+WATERMARK_KEY = 'chat:stats:rolled-until'
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def floor_hour(moment):
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def local_midnight(moment):
+    return timezone.localtime(moment).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rolled_until():
+    """End of the last rolled-up hour, or None before the first run."""
+    value = get_redis().get(WATERMARK_KEY)
+    if value:
+        return parse_datetime(value)
+    latest = ChatStatsRollup.objects.filter(period='hour').order_by('-bucket').values_list(
+        'bucket', flat=True
+    ).first()
+    return latest + timedelta(hours=1) if latest else None
+
+
+def _approved(start, end):
+    return ChatMessage.objects.filter(is_approved=True, created_at__gte=start, created_at__lt=end)
+
+
+def rollup_hours(start, end):
+    """Recompute hour rows for ``[start, end)``; both must be on the hour."""
+    rows = {}
+    for row in _approved(start, end).annotate(
+        hour=TruncHour('created_at', tzinfo=dt_timezone.utc)
+    ).order_by().values('room_id', 'hour').annotate(count=Count('id')):
+        rows[(row['room_id'], row['hour'])] = ChatStatsRollup(
+            room_id=row['room_id'], period='hour', bucket=row['hour'],
+            message_count=row['count']
+        )
+    for room_id, hour, user_id in _approved(start, end).filter(user__isnull=False).annotate(
+        hour=TruncHour('created_at', tzinfo=dt_timezone.utc)
+    ).order_by().values_list('room_id', 'hour', 'user_id').distinct():
+        rows[(room_id, hour)].senders.append(user_id)
+
+    with transaction.atomic():
+        ChatStatsRollup.objects.filter(period='hour', bucket__gte=start, bucket__lt=end).delete()
+        ChatStatsRollup.objects.bulk_create(rows.values())
+    return len(rows)
+
+
+def rollup_day(day):
+    """Recompute the day rows for the local day starting at ``day`` from its hour rows."""
+    end = local_midnight(day + timedelta(hours=36))
+    rows = {}
+    for room_id, count, senders in ChatStatsRollup.objects.filter(
+        period='hour', bucket__gte=day, bucket__lt=end
+    ).values_list('room_id', 'message_count', 'senders'):
+        row = rows.setdefault(room_id, ChatStatsRollup(
+            room_id=room_id, period='day', bucket=day, message_count=0, senders=[]
+        ))
+        row.message_count += count
+        row.senders = sorted(set(row.senders) | set(senders))
+
+    with transaction.atomic():
+        ChatStatsRollup.objects.filter(period='day', bucket=day).delete()
+        ChatStatsRollup.objects.bulk_create(rows.values())
+    return len(rows)
+
+
+def rollup_chat_stats():
+    """
+    Bring hour and day rows up to date.
+
+    Works through the backlog a day at a time and returns the new watermark.
+    """
+    now = timezone.now()
+    end = floor_hour(now - timedelta(minutes=_setting('CHAT_STATS_GRACE_MINUTES', 5)))
+    watermark = rolled_until()
+    if watermark is None:
+        start = floor_hour(now - timedelta(days=_setting('CHAT_STATS_BACKFILL_DAYS', 7)))
+    else:
+        start = min(watermark, end - timedelta(hours=_setting('CHAT_STATS_REROLL_HOURS', 2)))
+
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + timedelta(days=1), end)
+        rollup_hours(chunk_start, chunk_end)
+        chunk_start = chunk_end
+
+    # Day rows for every local day that is complete and was touched
+    day = local_midnight(start)
+    while local_midnight(day + timedelta(hours=36)) <= end:
+        rollup_day(day)
+        day = local_midnight(day + timedelta(hours=36))
+
+    get_redis().set(WATERMARK_KEY, end.isoformat())
+    return end
+
+
+def window_totals(days, room_ids=None, senders=False):
+    """
+    Approved message totals per room for today plus the previous ``days - 1`` local days.
+
+    Complete days come from day rows, the rest of the rolled-up range from
+    hour rows, and anything newer from the live tail. Returns
+    ``{room_id: {'messages': n, 'senders': set()}}``; sender sets are only
+    filled when ``senders`` is true.
+    """
+    now = timezone.now()
+    since = local_midnight(now) - timedelta(days=days - 1)
+    until = min(max(rolled_until() or since, since), now)
+    day_end = local_midnight(until)
+
+    totals = defaultdict(lambda: {'messages': 0, 'senders': set()})
+    sources = []
+    if since < day_end:
+        sources.append(ChatStatsRollup.objects.filter(
+            period='day', bucket__gte=since, bucket__lt=day_end
+        ))
+    sources.append(ChatStatsRollup.objects.filter(
+        period='hour', bucket__gte=max(since, day_end), bucket__lt=until
+    ))
+
+    for rows in sources:
+        if room_ids is not None:
+            rows = rows.filter(room_id__in=room_ids)
+        for room_id, count in rows.order_by().values('room_id').annotate(
+            total=Sum('message_count')
+        ).values_list('room_id', 'total'):
+            totals[room_id]['messages'] += count
+        if senders:
+            for room_id, row_senders in rows.values_list('room_id', 'senders'):
+                totals[room_id]['senders'].update(row_senders)
+
+    # Live tail
+    tail = ChatMessage.objects.filter(is_approved=True, created_at__gte=until)
+    if room_ids is not None:
+        tail = tail.filter(room_id__in=room_ids)
+    for room_id, count in tail.order_by().values('room_id').annotate(
+        total=Count('id')
+    ).values_list('room_id', 'total'):
+        totals[room_id]['messages'] += count
+    if senders:
+        for room_id, user_id in tail.filter(user__isnull=False).order_by().values_list(
+            'room_id', 'user_id'
+        ).distinct():
+            totals[room_id]['senders'].add(user_id)
+    return totals
@@ -0,0 +1,58 @@
+"""
+Full-text search over chat history.
+
+On PostgreSQL, ``ChatMessage.content`` is indexed by the GIN expression index
+``chat_msg_search_idx`` over ``to_tsvector(CHAT_SEARCH_CONFIG, content)``.
+PostgreSQL keeps it current on every insert and update, including
+write-behind batches and archive restores, so there is no extra column to
+maintain. ``search_messages`` filters with the very same expression, which
+is what lets the planner use the index.
+
+The index is created by a ``post_migrate`` handler, concurrently so a large
+table keeps taking writes, because the project's other databases cannot
+build it. Changing ``CHAT_SEARCH_CONFIG`` needs the index dropped and
+rebuilt. Other databases fall back to a substring match.
+"""
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchVector
+from django.db import connections
+
+from .models import ChatMessage
+
+INDEX_NAME = 'chat_msg_search_idx'
+
+
+def search_config():
+    return getattr(settings, 'CHAT_SEARCH_CONFIG', 'english')
+
+
+def search_vector():
+    return SearchVector('content', config=search_config())
+
+
+def search_messages(queryset, query):
+    """Filter ``queryset`` to messages matching ``query`` (web search syntax on PostgreSQL)."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.filter(content__icontains=query)
+    return queryset.alias(search=search_vector()).filter(
+        search=SearchQuery(query, config=search_config(), search_type='websearch')
+    )
+
+
+def ensure_search_index(using='default'):
+    """Build the search index if it is missing; returns True if it was created."""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return False
+
+    table = ChatMessage._meta.db_table
+    with connection.cursor() as cursor:
+        if INDEX_NAME in connection.introspection.get_constraints(cursor, table):
+            return False
+
+    index = GinIndex(search_vector(), name=INDEX_NAME)
+    with connection.schema_editor(atomic=False) as editor:
+        editor.execute(index.create_sql(ChatMessage, editor, concurrently=True))
+    return True
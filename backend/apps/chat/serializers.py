@@ -4,27 +4,43 @@ Chat system serializers for GenFree Network.
 
 from rest_framework import serializers
 from .models import ChatRoom, ChatMessage, ChatUserActivity, MessageReport
+from .moderation import BANNED, check_message
+from .presence import chat_presence
+
+
+class ChatRoomListSerializer(serializers.ListSerializer):
+    """Fetch live user counts for a whole page of rooms at once."""
+    
+    def to_representation(self, data):
+        rooms = list(data.all() if hasattr(data, 'all') else data)
+        self.context['active_users'] = chat_presence.counts(room.slug for room in rooms)
+        return super().to_representation(rooms)
 
 
 class ChatRoomSerializer(serializers.ModelSerializer):
     """Serializer for chat rooms."""
     
-    active_users_count = serializers.ReadOnlyField()
+    active_users_count = serializers.SerializerMethodField()
     created_by_name = serializers.CharField(source='created_by.get_full_name', read_only=True)
-    message_count = serializers.SerializerMethodField()
     
     class Meta:
         model = ChatRoom
+        list_serializer_class = ChatRoomListSerializer
         fields = [
             'id', 'name', 'slug', 'room_type', 'description', 'is_active',
             'is_moderated', 'allow_anonymous', 'max_message_length',
             'active_users_count', 'created_by_name', 'message_count',
-            'created_at', 'updated_at'
+            'participant_count', 'created_at', 'updated_at'
+        ]
+        read_only_fields = [
+            'id', 'message_count', 'participant_count', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'created_at', 'updated_at']
     
-    def get_message_count(self, obj):
-        return obj.messages.filter(is_approved=True).count()
+    def get_active_users_count(self, obj):
+        active_users = self.context.get('active_users')
+        if active_users is not None and obj.slug in active_users:
+            return active_users[obj.slug]
+        return obj.active_users_count
 
 
 class ChatMessageSerializer(serializers.ModelSerializer):
@@ -90,12 +106,8 @@ class ChatMessageCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("Emoji reaction is required for emoji messages.")
         
         # Check banned words
-        if room and room.banned_words:
-            content = attrs.get('content', '').lower()
-            banned_words = [word.strip().lower() for word in room.banned_words.split(',')]
-            for word in banned_words:
-                if word and word in content:
-                    raise serializers.ValidationError("Message contains inappropriate content.")
+        if room and check_message(room, attrs.get('content', '')) == BANNED:
+            raise serializers.ValidationError("Message contains inappropriate content.")
         
         return attrs
 
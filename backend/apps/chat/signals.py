@@ -0,0 +1,66 @@
+"""
+Signal handlers for the chat app.
+"""
+
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
+from django.dispatch import receiver
+
+from apps.common.snapshots import push, version_of
+from .models import ChatRoom
+from .search import ensure_search_index
+
+# Fields connected ChatConsumers keep in their room snapshot
+ROOM_SNAPSHOT_FIELDS = [
+    'id', 'slug', 'is_active', 'is_moderated', 'allow_anonymous',
+    'max_message_length', 'banned_words', 'updated_at',
+]
+
+
+def room_snapshot(room):
+    """Snapshot of the room settings a ChatConsumer works from."""
+    return {
+        'id': str(room.id),
+        'slug': room.slug,
+        'is_active': room.is_active,
+        'is_moderated': room.is_moderated,
+        'allow_anonymous': room.allow_anonymous,
+        'max_message_length': room.max_message_length,
+        'banned_words': room.banned_words,
+        'version': version_of(room.updated_at),
+    }
+
+
+@receiver(pre_save, sender=ChatRoom)
+def remember_room_slug(sender, instance, update_fields=None, **kwargs):
+    """Note the slug connected consumers joined under, in case this save changes it."""
+    instance._joined_slug = instance.slug
+    if instance._state.adding or (update_fields and 'slug' not in update_fields):
+        return
+    instance._joined_slug = ChatRoom.objects.filter(pk=instance.pk).values_list(
+        'slug', flat=True
+    ).first() or instance.slug
+
+
+@receiver(post_save, sender=ChatRoom)
+def push_room_snapshot(sender, instance, update_fields=None, **kwargs):
+    """Send connected consumers the room's new settings, under the old slug too after a rename."""
+    if update_fields and not set(update_fields) & set(ROOM_SNAPSHOT_FIELDS):
+        return
+    snapshot = room_snapshot(instance)
+    push(f'chat_{instance.slug}', snapshot)
+    joined_slug = getattr(instance, '_joined_slug', instance.slug)
+    if joined_slug != instance.slug:
+        push(f'chat_{joined_slug}', snapshot)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def push_room_deleted(sender, instance, **kwargs):
+    """Disconnect consumers of a deleted room."""
+    push(f'chat_{instance.slug}', None)
+
+
+@receiver(post_migrate)
+def create_search_index(sender, using='default', **kwargs):
+    """Build the PostgreSQL full-text index on chat messages if it is missing."""
+    if sender.name == 'apps.chat':
+        ensure_search_index(using)
@@ -0,0 +1,71 @@
+"""
+Celery tasks for the chat system.
+"""
+
+from celery import shared_task
+
+from . import activity, counters, moderation_queue, persistence, reactions, retention, rollups
+from .models import ChatArchive
+
+
+@shared_task
+def recover_pending_messages():
+    """Persist write-behind messages from failed batches or crashed nodes."""
+    return persistence.recover_pending_messages()
+
+
+@shared_task
+def flush_reaction_counts():
+    """Apply buffered reaction deltas to the database."""
+    return reactions.flush_reaction_counts()
+
+
+@shared_task
+def broadcast_reaction_counts(room_slug, group_name):
+    """Send a room's pending reaction totals queued by a sync caller."""
+    return reactions.broadcast_reaction_counts(room_slug, group_name)
+
+
+@shared_task
+def flush_room_counters():
+    """Apply buffered room counter deltas to the database."""
+    return counters.flush_room_counters()
+
+
+@shared_task
+def reconcile_room_counters():
+    """Recompute room message and participant counters from scratch."""
+    return counters.reconcile_room_counters()
+
+
+@shared_task
+def flush_activity_log():
+    """Bulk-insert queued chat activity records."""
+    return activity.flush_activity_log()
+
+
+@shared_task
+def apply_moderation_decisions():
+    """Apply queued moderator decisions in batches."""
+    return moderation_queue.apply_moderation_decisions()
+
+
+@shared_task
+def rollup_chat_stats():
+    """Aggregate recent chat messages into hourly and daily rollups."""
+    return rollups.rollup_chat_stats().isoformat()
+
+
+@shared_task
+def cleanup_old_messages():
+    """Archive and delete chat messages past the retention period."""
+    return retention.cleanup_old_messages()
+
+
+@shared_task
+def restore_chat_archive(archive_id):
+    """Load an archived month of messages back into the database."""
+    archive = ChatArchive.objects.filter(pk=archive_id).first()
+    if archive is None:
+        return 0
+    return retention.restore_archive(archive)
@@ -0,0 +1,157 @@
+"""
+Rate limiting for inbound chat WebSocket frames.
+
+Every frame type gets two token buckets, checked before any database or
+channel layer work:
+
+* per connection - kept on the consumer in memory, so a flooding socket is
+  cut off without touching shared state;
+* per user - shared by all of a signed-in user's connections on every node,
+  kept in the real-time store as a GCRA timestamp (the token bucket written
+  as the time the bucket is next full). Two connections racing on the same
+  user can each let one extra frame through, which is harmless.
+
+Rejections are counted per process and added to ``chat:ratelimit:stats``
+``STATS_FLUSH_INTERVAL`` seconds after the first one that is not flushed
+yet, and on interpreter shutdown, so a flood does not turn into one store
+write per dropped frame.
+"""
+
+import asyncio
+import atexit
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from apps.common.realtime import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'chat:ratelimit:stats'
+STATS_FLUSH_INTERVAL = 5
+
+
+def connection_limits():
+    """``{frame type: (tokens per second, burst)}`` for each connection."""
+    return getattr(settings, 'CHAT_RATE_LIMITS', {})
+
+
+def user_limits():
+    """``{frame type: (tokens per second, burst)}`` across a user's connections."""
+    return getattr(settings, 'CHAT_USER_RATE_LIMITS', {})
+
+
+class TokenBucket:
+    """In-memory token bucket."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self):
+        """Take a token; returns 0 on success or the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class ConnectionThrottle:
+    """Per-connection buckets, created lazily for each frame type."""
+
+    def __init__(self):
+        self._buckets = {}
+
+    def consume(self, message_type):
+        limit = connection_limits().get(message_type)
+        if not limit:
+            return 0
+        bucket = self._buckets.get(message_type)
+        if bucket is None:
+            bucket = self._buckets[message_type] = TokenBucket(*limit)
+        return bucket.consume()
+
+
+def user_key(user_id, message_type):
+    return f'chat:ratelimit:{message_type}:user:{user_id}'
+
+
+async def aconsume_user(user_id, message_type):
+    """Take a token from a user's shared bucket; same return value as ``TokenBucket.consume``."""
+    limit = user_limits().get(message_type)
+    if not limit:
+        return 0
+    rate, burst = limit
+    interval = 1.0 / rate
+    redis = get_async_redis()
+    now = time.time()
+
+    full_at = max(float(await redis.get(user_key(user_id, message_type)) or now), now)
+    wait = full_at - now - (burst - 1) * interval
+    if wait > 0:
+        return wait
+    full_at += interval
+    await redis.set(user_key(user_id, message_type), full_at, px=int((full_at - now) * 1000) + 1)
+    return 0
+
+
+_rejected = Counter()
+_flush_task = None
+
+
+async def arecord_rejection(scope, message_type):
+    """Count a throttled frame; the counts are added to the store on a timer."""
+    global _flush_task
+    _rejected[f'{scope}:{message_type}'] += 1
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.ensure_future(_flush_later())
+
+
+def take_rejections():
+    counts = dict(_rejected)
+    _rejected.clear()
+    return counts
+
+
+async def _flush_later():
+    await asyncio.sleep(STATS_FLUSH_INTERVAL)
+    counts = take_rejections()
+    try:
+        pipe = get_async_redis().pipeline()
+        for field, count in counts.items():
+            pipe.hincrby(STATS_KEY, field, count)
+        await pipe.execute()
+    except Exception:
+        logger.exception("Rate limit stats flush failed; keeping %d counters", len(counts))
+        _rejected.update(counts)
+
+
+def flush_sync():
+    """Add the counts not yet flushed to the store; used on interpreter shutdown."""
+    counts = take_rejections()
+    if not counts:
+        return
+    try:
+        pipe = get_redis().pipeline()
+        for field, count in counts.items():
+            pipe.hincrby(STATS_KEY, field, count)
+        pipe.execute()
+    except Exception:
+        logger.exception("Rate limit stats flush failed; dropped %d counters", len(counts))
+
+
+def rate_limit_stats():
+    """Throttled frame counts as ``{'<scope>:<frame type>': count}``."""
+    return {name: int(value) for name, value in get_redis().hgetall(STATS_KEY).items()}
+
+
+atexit.register(flush_sync)
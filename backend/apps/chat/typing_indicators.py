@@ -0,0 +1,91 @@
+"""
+Server-side typing indicator state for chat rooms.
+
+Typing toggles are recorded per typist (a signed-in user, or an anonymous
+connection) in the real-time store with a short expiry instead of being
+fanned out one by one. Rooms receive a ``typing_snapshot`` frame (a capped
+list of names plus the total count) at a fixed cadence while anyone is
+typing, and one final empty snapshot when the last typist stops or lapses.
+"""
+
+import time
+
+from django.conf import settings
+
+from apps.common.broadcast import GroupBroadcastCoalescer, frame_event
+from apps.common.realtime import get_async_redis
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class TypingTracker:
+    """Per-room registry of who is currently typing."""
+
+    def key(self, room_slug):
+        return f'typing:chat:{room_slug}'
+
+    def names_key(self, room_slug):
+        return f'typing:chat:{room_slug}:names'
+
+    @property
+    def ttl(self):
+        return _setting('CHAT_TYPING_TTL', 6)
+
+    async def set_typing(self, room_slug, identity, name, typing):
+        """Record a typing toggle; ``identity`` is unique per typist."""
+        pipe = get_async_redis().pipeline()
+        if typing:
+            pipe.zadd(self.key(room_slug), {identity: time.time() + self.ttl})
+            pipe.hset(self.names_key(room_slug), identity, name)
+            pipe.expire(self.key(room_slug), self.ttl * 2)
+            pipe.expire(self.names_key(room_slug), self.ttl * 2)
+        else:
+            pipe.zrem(self.key(room_slug), identity)
+            pipe.hdel(self.names_key(room_slug), identity)
+        await pipe.execute()
+
+    async def snapshot(self, room_slug):
+        """Return ``(names, count)`` with names capped and de-duplicated."""
+        redis = get_async_redis()
+        now = time.time()
+        pipe = redis.pipeline()
+        pipe.zremrangebyscore(self.key(room_slug), '-inf', now)
+        pipe.zrangebyscore(self.key(room_slug), now, '+inf')
+        pipe.hgetall(self.names_key(room_slug))
+        _, typists, names = await pipe.execute()
+
+        stale = set(names) - set(typists)
+        if stale:
+            await redis.hdel(self.names_key(room_slug), *stale)
+
+        typing = []
+        for identity in typists:
+            name = names.get(identity, 'Anonymous')
+            if name not in typing:
+                typing.append(name)
+        limit = _setting('CHAT_TYPING_SNAPSHOT_LIMIT', 5)
+        return typing[:limit], len(typists)
+
+
+typing_tracker = TypingTracker()
+typing_snapshots = GroupBroadcastCoalescer(
+    'chat_typing', interval_setting='CHAT_TYPING_SNAPSHOT_INTERVAL', default_interval=2.0
+)
+
+
+async def schedule_typing_snapshot(channel_layer, room_slug, group_name):
+    """Queue a snapshot for the room; it re-queues itself while anyone types."""
+
+    async def build_event():
+        names, count = await typing_tracker.snapshot(room_slug)
+        if count:
+            await schedule_typing_snapshot(channel_layer, room_slug, group_name)
+        return frame_event({
+            'type': 'typing_snapshot',
+            'users': names,
+            'count': count
+        })
+
+    await typing_snapshots.schedule(channel_layer, group_name, build_event)
@@ -2,15 +2,24 @@
 Chat system views for GenFree Network.
 """
 
+import uuid
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
-from django.utils import timezone
-from django.db.models import Count, Q
-from datetime import timedelta
+from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated, IsAdminUser
+from django.db.models import Count, F, Q, Sum
 
-from .models import ChatRoom, ChatMessage, ChatUserActivity, MessageReport
+from apps.common.views import parse_bound
+from .models import ChatRoom, ChatMessage, MessageReport
+from . import backfill, counters, moderation_queue, reactions, rollups
+from .activity import activity_stats, log_activity
+from .persistence import write_behind_stats
+from .moderation import FLAGGED, check_message
+from .pagination import ChatMessageCursorPagination, history_page, resolve_cursor
+from .presence import chat_presence
+from .search import search_messages
+from .throttling import rate_limit_stats
 from .serializers import (
     ChatRoomSerializer, ChatMessageSerializer, ChatMessageCreateSerializer,
     ChatUserActivitySerializer, MessageReportSerializer, ChatStatsSerializer
@@ -27,10 +36,17 @@ def get_client_ip(request):
     return ip
 
 
+def moderated_room_ids(user):
+    """Rooms ``user`` may moderate: None for staff (every room)."""
+    if user.is_staff:
+        return None
+    return list(user.moderated_rooms.values_list('id', flat=True))
+
+
 class ChatRoomViewSet(viewsets.ModelViewSet):
     """ViewSet for managing chat rooms."""
     
-    queryset = ChatRoom.objects.filter(is_active=True)
+    queryset = ChatRoom.objects.filter(is_active=True).select_related('created_by')
     serializer_class = ChatRoomSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     lookup_field = 'slug'
@@ -40,17 +56,34 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def messages(self, request, slug=None):
-        """Get messages for a specific chat room."""
-        room = self.get_object()
-        limit = int(request.query_params.get('limit', 50))
+        """
+        Get messages for a specific chat room, oldest first.
         
-        messages = ChatMessage.objects.filter(
-            room=room,
-            is_approved=True
-        ).select_related('user').order_by('-created_at')[:limit]
-        
-        # Reverse to show oldest first
-        messages = list(reversed(messages))
+        Pass ``before=<message id>`` to scroll back or ``after=<message id>``
+        to catch up; both are keyset lookups on the room history index.
+        """
+        room = self.get_object()
+        try:
+            limit = min(max(int(request.query_params.get('limit', 50)), 1), 200)
+        except ValueError:
+            limit = 50
+        
+        cursors = {}
+        for name in ('before', 'after'):
+            message_id = request.query_params.get(name)
+            if message_id:
+                cursors[name] = resolve_cursor(message_id)
+                if cursors[name] is None:
+                    return Response(
+                        {'error': f'Unknown {name} cursor'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+        
+        messages = history_page(
+            ChatMessage.objects.filter(room=room, is_approved=True).select_related('user'),
+            limit=limit,
+            **cursors
+        )
         
         serializer = ChatMessageSerializer(
             messages, many=True, context={'request': request}
@@ -63,11 +96,10 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         room = self.get_object()
         
         # Record join activity
-        ChatUserActivity.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            room=room,
-            session_id=request.session.session_key,
-            activity_type='join'
+        log_activity(
+            'join', room,
+            user=request.user,
+            session_id=request.session.session_key
         )
         
         return Response({'status': 'joined', 'room': room.slug})
@@ -78,11 +110,10 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
         room = self.get_object()
         
         # Record leave activity
-        ChatUserActivity.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            room=room,
-            session_id=request.session.session_key,
-            activity_type='leave'
+        log_activity(
+            'leave', room,
+            user=request.user,
+            session_id=request.session.session_key
         )
         
         return Response({'status': 'left', 'room': room.slug})
@@ -93,6 +124,8 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
     
     queryset = ChatMessage.objects.filter(is_approved=True)
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = ChatMessageCursorPagination
+    ordering_fields = ['created_at']
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -117,50 +150,53 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         user = self.request.user if self.request.user.is_authenticated else None
         session_id = self.request.session.session_key
         
+        # Auto-moderate if needed: flagged words hold the message for review
+        room = serializer.validated_data['room']
+        is_approved = not (room.is_moderated and check_message(
+            room, serializer.validated_data.get('content', '')
+        ) == FLAGGED)
+        
         message = serializer.save(
             user=user,
             session_id=session_id,
             ip_address=ip_address,
-            user_agent=user_agent
+            user_agent=user_agent,
+            is_approved=is_approved
         )
         
         # Record message activity
-        ChatUserActivity.objects.create(
+        log_activity(
+            'message', message.room,
             user=user,
-            room=message.room,
             session_id=session_id,
-            activity_type='message',
             message=message
         )
         
-        # Auto-moderate if needed
-        if message.room.is_moderated:
-            # Simple auto-moderation logic
-            content_lower = message.content.lower()
-            suspicious_words = ['spam', 'fake', 'scam']  # Add more as needed
-            
-            if any(word in content_lower for word in suspicious_words):
-                message.is_approved = False
-                message.save()
+        # Keep the room's WebSocket backfill buffer and counters in step
+        if message.is_approved:
+            backfill.push(message.room.slug, ChatMessageSerializer(message).data)
+            counters.record_message(message.room_id, message.user_id, session_id)
+        else:
+            # Held messages wait in the moderation queue
+            moderation_queue.enqueue(message.pk, moderation_queue.flagged_priority())
     
     @action(detail=True, methods=['post'])
     def like(self, request, pk=None):
         """Like a message."""
         message = self.get_object()
-        message.likes += 1
-        message.save()
+        totals = reactions.increment(message.id, message.room.slug, 'like')
+        reactions.queue_reaction_counts(message.room.slug, f'chat_{message.room.slug}')
         
         # Record reaction activity
-        ChatUserActivity.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            room=message.room,
+        log_activity(
+            'reaction', message.room,
+            user=request.user,
             session_id=request.session.session_key,
-            activity_type='reaction',
             message=message,
             metadata={'reaction': 'like'}
         )
         
-        return Response({'likes': message.likes})
+        return Response({'likes': totals['like']})
     
     @action(detail=True, methods=['post'])
     def report(self, request, pk=None):
@@ -178,16 +214,15 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
             description=description
         )
         
-        # Increment report count
-        message.reports += 1
-        message.save()
+        # Count the report and queue the message for review
+        ChatMessage.objects.filter(pk=message.pk).update(reports=F('reports') + 1)
+        moderation_queue.enqueue(message.pk, moderation_queue.report_priority(reason))
         
         # Record report activity
-        ChatUserActivity.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            room=message.room,
+        log_activity(
+            'report', message.room,
+            user=request.user,
             session_id=request.session.session_key,
-            activity_type='report',
             message=message,
             metadata={'reason': reason}
         )
@@ -195,50 +230,90 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         serializer = MessageReportSerializer(report)
         return Response(serializer.data)
     
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def search(self, request):
+        """
+        Full-text search over chat history for moderators and staff.
+        
+        Takes ``q`` plus optional ``room`` (slug), ``user`` (username) and
+        ``since``/``until`` (ISO dates or datetimes). Results are newest
+        first and cursor-paginated; moderators only see their own rooms.
+        """
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {'error': 'Search query is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        room_ids = moderated_room_ids(request.user)
+        if room_ids == []:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        queryset = ChatMessage.objects.select_related('user', 'room')
+        if room_ids is not None:
+            queryset = queryset.filter(room_id__in=room_ids)
+        room_slug = request.query_params.get('room')
+        if room_slug:
+            queryset = queryset.filter(room__slug=room_slug)
+        username = request.query_params.get('user')
+        if username:
+            queryset = queryset.filter(user__username=username)
+        for name, lookup in (('since', 'created_at__gte'), ('until', 'created_at__lt')):
+            value = request.query_params.get(name)
+            if not value:
+                continue
+            moment = parse_bound(value, end=name == 'until')
+            if moment is None:
+                return Response(
+                    {'error': f'Invalid {name} date'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            queryset = queryset.filter(**{lookup: moment})
+        
+        page = self.paginate_queryset(search_messages(queryset, query))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """Get chat statistics."""
         # Calculate stats
-        total_rooms = ChatRoom.objects.filter(is_active=True).count()
-        total_messages = ChatMessage.objects.filter(is_approved=True).count()
-        
-        # Active users (last 30 minutes)
-        thirty_minutes_ago = timezone.now() - timedelta(minutes=30)
-        active_users = ChatUserActivity.objects.filter(
-            timestamp__gte=thirty_minutes_ago
-        ).values('user', 'session_id').distinct().count()
-        
-        # Messages today
-        today = timezone.now().date()
-        messages_today = ChatMessage.objects.filter(
-            created_at__date=today,
-            is_approved=True
-        ).count()
-        
-        # Most active room
-        most_active_room_data = ChatMessage.objects.filter(
-            created_at__gte=timezone.now() - timedelta(days=7),
-            is_approved=True
-        ).values('room__name').annotate(
-            message_count=Count('id')
-        ).order_by('-message_count').first()
-        
-        most_active_room = most_active_room_data['room__name'] if most_active_room_data else 'None'
+        active_slugs = list(ChatRoom.objects.filter(is_active=True).values_list('slug', flat=True))
+        total_rooms = len(active_slugs)
+        total_messages = ChatRoom.objects.aggregate(total=Sum('message_count'))['total'] or 0
+        
+        # Active users (live connections across active rooms)
+        active_users = sum(chat_presence.counts(active_slugs).values())
+        
+        # Messages today, from the hourly rollups plus the live tail
+        messages_today = sum(room['messages'] for room in rollups.window_totals(1).values())
+        
+        # Most active rooms over the last 7 days
+        week = rollups.window_totals(7)
+        top_room_ids = sorted(week, key=lambda room_id: week[room_id]['messages'], reverse=True)[:5]
+        week_senders = rollups.window_totals(7, room_ids=top_room_ids, senders=True)
+        rooms = ChatRoom.objects.in_bulk(top_room_ids)
+        room_stats = [
+            {
+                'room__name': rooms[room_id].name,
+                'room__slug': rooms[room_id].slug,
+                'message_count': week[room_id]['messages'],
+                'user_count': len(week_senders[room_id]['senders'])
+            }
+            for room_id in top_room_ids if room_id in rooms
+        ]
+        
+        most_active_room = room_stats[0]['room__name'] if room_stats else 'None'
         
         # Recent messages
         recent_messages = ChatMessage.objects.filter(
             is_approved=True
         ).select_related('user', 'room').order_by('-created_at')[:10]
         
-        # Room stats
-        room_stats = list(ChatMessage.objects.filter(
-            created_at__gte=timezone.now() - timedelta(days=7),
-            is_approved=True
-        ).values('room__name', 'room__slug').annotate(
-            message_count=Count('id'),
-            user_count=Count('user', distinct=True)
-        ).order_by('-message_count')[:5])
-        
         data = {
             'total_rooms': total_rooms,
             'total_messages': total_messages,
@@ -251,6 +326,16 @@ class ChatMessageViewSet(viewsets.ModelViewSet):
         
         serializer = ChatStatsSerializer(data)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def metrics(self, request):
+        """Real-time pipeline counters for monitoring."""
+        return Response({
+            'rate_limited': rate_limit_stats(),
+            'write_behind': write_behind_stats(),
+            'activity_log': activity_stats(),
+            'moderation': moderation_queue.moderation_stats()
+        })
 
 
 class MessageReportViewSet(viewsets.ModelViewSet):
@@ -260,6 +345,9 @@ class MessageReportViewSet(viewsets.ModelViewSet):
     serializer_class = MessageReportSerializer
     permission_classes = [IsAuthenticated]
     
+    # resolve action -> moderation queue action
+    RESOLVE_ACTIONS = {'dismiss': 'dismiss', 'remove_message': 'remove'}
+    
     def get_queryset(self):
         queryset = super().get_queryset()
         
@@ -271,12 +359,100 @@ class MessageReportViewSet(viewsets.ModelViewSet):
         
         return queryset.select_related('message', 'reported_by', 'resolved_by')
     
+    @action(detail=False, methods=['get'])
+    def queue(self, request):
+        """Messages awaiting review, highest priority first."""
+        room_ids = moderated_room_ids(request.user)
+        if room_ids == []:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 200)
+        except ValueError:
+            limit = 50
+        reviews = moderation_queue.pending_reviews(limit, room_ids)
+        open_reports = dict(
+            MessageReport.objects.filter(
+                message_id__in=[message.pk for message, _ in reviews], is_resolved=False
+            ).order_by().values('message_id').annotate(count=Count('id')).values_list('message_id', 'count')
+        )
+        
+        return Response([
+            {
+                'priority': priority,
+                'room': message.room.slug,
+                'open_reports': open_reports.get(message.pk, 0),
+                'message': ChatMessageSerializer(message).data
+            }
+            for message, priority in reviews
+        ])
+    
+    @action(detail=False, methods=['post'])
+    def decide(self, request):
+        """
+        Queue a batch of moderator decisions.
+        
+        Expects ``{"decisions": [{"message_id", "action", "note"}]}`` with
+        ``action`` one of approve, remove or dismiss. Decisions are applied
+        shortly after by the moderation task.
+        """
+        decisions = request.data.get('decisions')
+        if not isinstance(decisions, list) or not all(
+            isinstance(decision, dict) and decision.get('action') in moderation_queue.ACTIONS
+            for decision in decisions
+        ):
+            return Response(
+                {'error': 'Expected a list of decisions with action approve, remove or dismiss'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            decisions = [
+                {
+                    'message_id': str(uuid.UUID(str(decision.get('message_id')))),
+                    'action': decision['action'],
+                    'note': str(decision.get('note') or '')
+                }
+                for decision in decisions
+            ]
+        except ValueError:
+            return Response(
+                {'error': 'Invalid message_id'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Only moderators of every affected room can decide
+        room_ids = moderated_room_ids(request.user)
+        if room_ids is not None:
+            message_rooms = set(
+                ChatMessage.objects.filter(
+                    pk__in=[decision['message_id'] for decision in decisions]
+                ).values_list('room_id', flat=True)
+            )
+            if not message_rooms <= set(room_ids):
+                return Response(
+                    {'error': 'Permission denied'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+        
+        queued = moderation_queue.submit_decisions(decisions, request.user)
+        return Response({'queued': queued}, status=status.HTTP_202_ACCEPTED)
+    
     @action(detail=True, methods=['post'])
     def resolve(self, request, pk=None):
         """Resolve a message report."""
         report = self.get_object()
         resolution_note = request.data.get('resolution_note', '')
-        action = request.data.get('action', 'dismiss')  # dismiss, remove_message, ban_user
+        action = request.data.get('action', 'dismiss')  # dismiss, remove_message
+        
+        if action not in self.RESOLVE_ACTIONS:
+            return Response(
+                {'error': 'Expected action dismiss or remove_message'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         # Only moderators can resolve reports
         if not (request.user.is_staff or 
@@ -286,20 +462,12 @@ class MessageReportViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Mark as resolved
-        report.is_resolved = True
-        report.resolved_by = request.user
-        report.resolved_at = timezone.now()
-        report.resolution_note = resolution_note
-        report.save()
-        
-        # Take action based on resolution
-        if action == 'remove_message':
-            report.message.is_approved = False
-            report.message.save()
-        elif action == 'ban_user' and report.message.user:
-            # Implement user banning logic here
-            pass
-        
-        serializer = self.get_serializer(report)
-        return Response(serializer.data)
\ No newline at end of file
+        # Queue the decision; it resolves every open report on the message
+        decision = {
+            'message_id': str(report.message_id),
+            'action': self.RESOLVE_ACTIONS[action],
+            'note': str(resolution_note or '')
+        }
+        moderation_queue.submit_decisions([decision], request.user)
+        
+        return Response({'queued': decision}, status=status.HTTP_202_ACCEPTED)
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Group broadcast helpers for the WebSocket consumers.
+
+Frames sent to a whole group are encoded once by the sender and shipped
+through the channel layer as ready-to-write text; each consumer writes them
+out without re-running ``json.dumps`` (see ``FrameBroadcastMixin``).
+
+Joins and leaves used to trigger one ``group_send`` each, so N joiners meant
+O(N^2) frames. A coalescer instead sends at most one frame per group per
+tick, carrying the value read at send time. Ticks are aligned to wall-clock
+multiples of the interval and claimed with ``SET NX`` in the real-time store,
+so when several ASGI nodes see changes in the same tick only one of them
+broadcasts it.
+
+Group membership and sends go through ``fanout``, which splits large groups
+into shards; consumers only ever deal with the plain group name.
+
+Group events carry only the JSON text. Connections that negotiated
+MessagePack (see ``wire``) pack it on receipt through ``wire.pack_encoded``,
+which caches the result, so the channel layer ships each frame once and a
+process packs it at most once however many binary clients it serves.
+"""
+
+import asyncio
+import json
+import logging
+import time
+
+from django.conf import settings
+
+from . import fanout, wire
+from .realtime import get_async_redis
+
+logger = logging.getLogger(__name__)
+
+
+def frame_event(payload):
+    """Channel layer event carrying ``payload`` already encoded for clients."""
+    return {
+        'type': 'broadcast_frame',
+        'text': json.dumps(payload)
+    }
+
+
+class FrameBroadcastMixin:
+    """Consumer mixin for wire formats, group membership and pre-encoded group frames."""
+
+    wire_protocol = None
+
+    async def accept_connection(self):
+        """Accept the socket with the best wire format the client offered."""
+        self.wire_protocol = wire.choose_protocol(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=self.wire_protocol)
+
+    @property
+    def binary_frames(self):
+        return self.wire_protocol == wire.MSGPACK_PROTOCOL
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        """Decode an inbound frame in the connection's format; raises ValueError."""
+        return wire.decode(text_data, bytes_data, self.wire_protocol)
+
+    async def send_frame(self, payload):
+        """Encode ``payload`` for this connection and send it."""
+        if self.binary_frames:
+            await self.send(bytes_data=wire.pack(payload))
+        else:
+            await self.send(text_data=json.dumps(payload))
+
+    async def send_encoded(self, text):
+        """Send a frame that is already JSON-encoded."""
+        if self.binary_frames:
+            await self.send(bytes_data=wire.pack_encoded(text))
+        else:
+            await self.send(text_data=text)
+
+    async def group_join(self, group):
+        """Join ``group`` (on whichever shard this connection lands)."""
+        if not hasattr(self, 'group_shards'):
+            self.group_shards = {}
+        self.group_shards[group] = await fanout.join(self.channel_layer, group, self.channel_name)
+
+    async def touch_groups(self):
+        """Keep this connection's group memberships registered; call from the keepalive task."""
+        for group in getattr(self, 'group_shards', {}):
+            await fanout.touch(group, self.channel_name)
+
+    async def group_leave(self, group):
+        """Leave ``group`` if this connection joined it."""
+        shard = getattr(self, 'group_shards', {}).pop(group, None)
+        if shard:
+            await fanout.leave(self.channel_layer, group, shard, self.channel_name)
+
+    async def group_send_frame(self, group, payload):
+        """Encode ``payload`` once and fan it out to every shard of ``group``."""
+        await fanout.group_send(self.channel_layer, group, frame_event(payload))
+
+    async def broadcast_frame(self, event):
+        """Write a pre-encoded frame to the WebSocket, packing it for binary clients."""
+        if 'packed' in event and self.binary_frames:
+            await self.send(bytes_data=event['packed'])  # From a node on an older release
+        else:
+            await self.send_encoded(event['text'])
+
+
+class GroupBroadcastCoalescer:
+    """Rate-limit broadcasts of one kind of value to at most one per tick."""
+
+    def __init__(self, name, interval_setting='REALTIME_COUNT_BROADCAST_INTERVAL', default_interval=1.0):
+        self.name = name
+        self.interval_setting = interval_setting
+        self.default_interval = default_interval
+        self._pending = {}
+
+    @property
+    def interval(self):
+        return getattr(settings, self.interval_setting, self.default_interval)
+
+    async def schedule(self, channel_layer, group, build_event):
+        """
+        Broadcast to ``group`` on the next tick.
+
+        ``build_event`` is an async callable returning the event to send
+        (usually a ``frame_event``); it runs once per tick so the frame
+        carries the latest value.
+        """
+        first = group not in self._pending
+        self._pending[group] = build_event
+        if first:
+            asyncio.get_running_loop().create_task(self._fire(channel_layer, group))
+
+    async def _fire(self, channel_layer, group):
+        interval = self.interval
+        tick = int(time.time() / interval) + 1
+        await asyncio.sleep(max(0.0, tick * interval - time.time()))
+        build_event = self._pending.pop(group)
+
+        try:
+            claimed = await get_async_redis().set(
+                f'coalesce:{self.name}:{group}:{tick}', 1,
+                px=int(interval * 2000), nx=True
+            )
+            if not claimed:
+                return  # Another node is broadcasting this tick
+            await fanout.group_send(channel_layer, group, await build_event())
+        except Exception:
+            logger.exception("Coalesced %s broadcast to %s failed", self.name, group)
@@ -0,0 +1,128 @@
+"""
+Sharded channel groups for large WebSocket rooms.
+
+A room's group (``chat_<slug>``, ``livestream_<id>``) is split into shards
+once it outgrows ``REALTIME_GROUP_SHARD_SIZE`` members. Shard 0 keeps the
+plain group name, so small rooms are unchanged; later shards are named
+``<group>.<n>``. Each joiner is hashed onto one of the shards the room
+currently needs, and a broadcast is one ``group_send`` per shard in use,
+sent concurrently. On the Redis channel layer every shard is its own key,
+so the fan-out spreads across channel layer hosts instead of one hot group.
+
+The real-time store tracks, per group, its connections in a sorted set
+scored by heartbeat expiry (like ``presence``) and the set of shards anyone
+has been placed in. Consumers refresh their entry with ``touch`` from their
+keepalive task, so connections of a crashed node lapse instead of inflating
+the count forever. The shard set only grows while the room has members and
+is dropped by the same script that removes the last one, so a broadcast
+always reaches every shard that can hold one.
+"""
+
+import asyncio
+import math
+import time
+import zlib
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+
+from .realtime import Script, get_async_redis, get_redis
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _ttl():
+    return _setting('REALTIME_PRESENCE_TTL', 90)
+
+
+def members_key(group):
+    return f'fanout:{group}:connections'
+
+
+def shards_key(group):
+    return f'fanout:{group}:shards'
+
+
+def shard_name(group, shard):
+    return group if shard == 0 else f'{group}.{shard}'
+
+
+def shard_count(members):
+    """Number of shards a group with ``members`` connections should use."""
+    size = _setting('REALTIME_GROUP_SHARD_SIZE', 500)
+    limit = _setting('REALTIME_GROUP_MAX_SHARDS', 32)
+    return max(1, min(limit, math.ceil(members / size)))
+
+
+def _leave_local(redis, keys, args):
+    redis.zrem(keys[0], args[0])
+    redis.zremrangebyscore(keys[0], '-inf', float(args[1]))
+    remaining = redis.zcard(keys[0])
+    if not remaining:
+        redis.delete(keys[0], keys[1])
+    return remaining
+
+
+# KEYS: members zset, shards set; ARGV: channel name, now. Drops the
+# connection and, once nobody is left, the group's shard set.
+leave_group = Script("""
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local remaining = redis.call('ZCARD', KEYS[1])
+if remaining == 0 then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+return remaining
+""", _leave_local)
+
+
+async def join(channel_layer, group, channel_name):
+    """Add a connection to its shard of ``group``; returns the shard name."""
+    now, ttl = time.time(), _ttl()
+    pipe = get_async_redis().pipeline()
+    pipe.zadd(members_key(group), {channel_name: now + ttl})
+    pipe.zremrangebyscore(members_key(group), '-inf', now)
+    pipe.expire(members_key(group), math.ceil(ttl * 2))
+    pipe.zcard(members_key(group))
+    members = (await pipe.execute())[-1]
+    shard = zlib.crc32(channel_name.encode()) % shard_count(members)
+    if shard:
+        pipe = get_async_redis().pipeline()
+        pipe.sadd(shards_key(group), shard)
+        pipe.expire(shards_key(group), math.ceil(ttl * 2))
+        await pipe.execute()
+    name = shard_name(group, shard)
+    await channel_layer.group_add(name, channel_name)
+    return name
+
+
+async def touch(group, channel_name):
+    """Refresh a connection's entry, and the group's keys, while it stays connected."""
+    ttl = _ttl()
+    pipe = get_async_redis().pipeline()
+    pipe.zadd(members_key(group), {channel_name: time.time() + ttl})
+    pipe.expire(members_key(group), math.ceil(ttl * 2))
+    pipe.expire(shards_key(group), math.ceil(ttl * 2))
+    await pipe.execute()
+
+
+async def leave(channel_layer, group, shard, channel_name):
+    """Remove a connection from the shard it joined."""
+    await channel_layer.group_discard(shard, channel_name)
+    await leave_group.acall([members_key(group), shards_key(group)], [channel_name, time.time()])
+
+
+async def group_send(channel_layer, group, event):
+    """Send ``event`` to every shard of ``group``."""
+    shards = await get_async_redis().smembers(shards_key(group))
+    names = [group] + [shard_name(group, int(shard)) for shard in shards]
+    await asyncio.gather(*(channel_layer.group_send(name, event) for name in names))
+
+
+def group_send_sync(channel_layer, group, event):
+    """``group_send`` for sync callers such as views and signal handlers."""
+    shards = get_redis().smembers(shards_key(group))
+    for name in [group] + [shard_name(group, int(shard)) for shard in shards]:
+        async_to_sync(channel_layer.group_send)(name, event)
@@ -0,0 +1,97 @@
+"""
+Connection presence tracking for WebSocket groups.
+
+Each group (a chat room, a live stream) keeps a sorted set in the real-time
+store mapping channel names to the time their heartbeat lapses. Consumers run
+``keepalive`` for each open connection to refresh it from the server, so
+idle clients stay counted. Connections that stop heartbeating - a crashed
+ASGI node, a socket the server never saw close - fall out of the count on
+their own once their score is in the past.
+"""
+
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+from .realtime import get_async_redis, get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """Per-group connection registry with heartbeat expiry."""
+
+    def __init__(self, namespace, ttl=None):
+        self.namespace = namespace
+        self._ttl = ttl
+
+    @property
+    def ttl(self):
+        return self._ttl or getattr(settings, 'REALTIME_PRESENCE_TTL', 90)
+
+    def key(self, group):
+        return f'presence:{self.namespace}:{group}'
+
+    # Consumer side (async)
+    async def ajoin(self, group, member):
+        """Register a connection, or refresh its heartbeat."""
+        now = time.time()
+        pipe = get_async_redis().pipeline()
+        pipe.zadd(self.key(group), {member: now + self.ttl})
+        pipe.zremrangebyscore(self.key(group), '-inf', now)
+        pipe.expire(self.key(group), self.ttl * 2)
+        pipe.zcard(self.key(group))
+        results = await pipe.execute()
+        return results[-1]
+
+    atouch = ajoin
+
+    async def aleave(self, group, member):
+        """Drop a connection and return the remaining count."""
+        pipe = get_async_redis().pipeline()
+        pipe.zrem(self.key(group), member)
+        pipe.zremrangebyscore(self.key(group), '-inf', time.time())
+        pipe.zcard(self.key(group))
+        results = await pipe.execute()
+        return results[-1]
+
+    async def acount(self, group):
+        pipe = get_async_redis().pipeline()
+        pipe.zremrangebyscore(self.key(group), '-inf', time.time())
+        pipe.zcard(self.key(group))
+        results = await pipe.execute()
+        return results[-1]
+
+    # Read side (sync)
+    def count(self, group):
+        """Number of live connections in ``group``."""
+        return self.counts([group])[group]
+
+    def counts(self, groups):
+        """Live connection counts for many groups in one round trip."""
+        groups = list(groups)
+        if not groups:
+            return {}
+        now = time.time()
+        pipe = get_redis().pipeline()
+        for group in groups:
+            pipe.zremrangebyscore(self.key(group), '-inf', now)
+            pipe.zcard(self.key(group))
+        results = pipe.execute()
+        return dict(zip(groups, results[1::2]))
+
+    def members(self, group):
+        """Channel names whose heartbeat has not lapsed."""
+        return get_redis().zrangebyscore(self.key(group), time.time(), '+inf')
+
+
+async def keepalive(touch, interval):
+    """Await ``touch()`` every ``interval`` seconds until cancelled; failures are logged and retried."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await touch()
+        except Exception:
+            logger.exception("Presence keepalive failed")
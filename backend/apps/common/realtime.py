@@ -0,0 +1,449 @@
+"""
+Shared real-time state store for GenFree Network.
+
+Presence, counters and other connection state that every ASGI node must see
+live in Redis. When ``REALTIME_REDIS_URL`` is empty the same subset of Redis
+commands is served from process memory, which is enough for a single
+development server or an in-memory channel layer.
+"""
+
+import fnmatch
+import threading
+import time
+
+from django.conf import settings
+
+try:
+    import redis
+    import redis.asyncio as aioredis
+except ImportError:  # redis is not part of the minimal requirements
+    redis = None
+    aioredis = None
+
+
+_sync_client = None
+_async_client = None
+_local_backend = None
+_lock = threading.Lock()
+
+
+def _redis_url():
+    return getattr(settings, 'REALTIME_REDIS_URL', '')
+
+
+def _timeouts():
+    # An unreachable store fails a request or task instead of hanging it
+    return {
+        'socket_timeout': getattr(settings, 'REALTIME_REDIS_SOCKET_TIMEOUT', 5),
+        'socket_connect_timeout': getattr(settings, 'REALTIME_REDIS_CONNECT_TIMEOUT', 2),
+    }
+
+
+def get_local_backend():
+    """Return the process-wide in-memory store."""
+    global _local_backend
+    with _lock:
+        if _local_backend is None:
+            _local_backend = LocalRedis()
+        return _local_backend
+
+
+def get_redis():
+    """Get a synchronous client for views, tasks and serializers."""
+    global _sync_client
+    if _sync_client is None:
+        url = _redis_url()
+        if url and redis is not None:
+            _sync_client = redis.Redis.from_url(url, decode_responses=True, **_timeouts())
+        else:
+            _sync_client = get_local_backend()
+    return _sync_client
+
+
+def get_async_redis():
+    """Get an asyncio client for WebSocket consumers."""
+    global _async_client
+    if _async_client is None:
+        url = _redis_url()
+        if url and aioredis is not None:
+            _async_client = aioredis.Redis.from_url(url, decode_responses=True, **_timeouts())
+        else:
+            _async_client = AsyncLocalRedis(get_local_backend())
+    return _async_client
+
+
+class Script:
+    """
+    A Lua script run atomically by Redis.
+
+    The in-memory store has no Lua, so it runs ``local(backend, keys, args)``,
+    the script written in Python against :class:`LocalRedis`, under the
+    store lock instead.
+    """
+
+    def __init__(self, lua, local):
+        self.lua = lua
+        self.local = local
+        self._sync = None
+        self._async = None
+
+    def _run_local(self, backend, keys, args):
+        with backend._lock:
+            return self.local(backend, list(keys), list(args))
+
+    def __call__(self, keys=(), args=()):
+        client = get_redis()
+        if isinstance(client, LocalRedis):
+            return self._run_local(client, keys, args)
+        if self._sync is None:
+            self._sync = client.register_script(self.lua)
+        return self._sync(keys=list(keys), args=list(args))
+
+    async def acall(self, keys=(), args=()):
+        client = get_async_redis()
+        if isinstance(client, AsyncLocalRedis):
+            return self._run_local(client._backend, keys, args)
+        if self._async is None:
+            self._async = client.register_script(self.lua)
+        return await self._async(keys=list(keys), args=list(args))
+
+
+def _release_lock_local(redis, keys, args):
+    if redis.get(keys[0]) == args[0]:
+        return redis.delete(keys[0])
+    return 0
+
+
+# KEYS: lock key; ARGV: the token it was taken with. Deletes the lock only
+# if this worker still owns it.
+release_lock = Script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""", _release_lock_local)
+
+
+class LocalRedis:
+    """In-process stand-in for the Redis commands used by the real-time apps."""
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.RLock()
+
+    # Internal helpers
+    def _alive(self, key):
+        expires_at = self._expiry.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return key in self._data
+
+    def _get(self, key, factory):
+        if not self._alive(key):
+            self._data[key] = factory()
+        return self._data[key]
+
+    def _lookup(self, key, default=None):
+        return self._data[key] if self._alive(key) else default
+
+    # Keys
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._alive(key):
+                    removed += 1
+                self._data.pop(key, None)
+                self._expiry.pop(key, None)
+            return removed
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for key in keys if self._alive(key))
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if not self._alive(key):
+                return False
+            self._expiry[key] = time.time() + seconds
+            return True
+
+    def ttl(self, key):
+        with self._lock:
+            if not self._alive(key):
+                return -2
+            expires_at = self._expiry.get(key)
+            return -1 if expires_at is None else int(expires_at - time.time())
+
+    def rename(self, src, dst):
+        with self._lock:
+            if not self._alive(src):
+                raise KeyError(src)
+            self._data[dst] = self._data.pop(src)
+            self._expiry.pop(dst, None)
+            if src in self._expiry:
+                self._expiry[dst] = self._expiry.pop(src)
+            return True
+
+    def scan_iter(self, match='*', count=None):
+        with self._lock:
+            keys = [key for key in list(self._data) if self._alive(key)]
+        return iter([key for key in keys if fnmatch.fnmatchcase(key, match)])
+
+    # Strings
+    def get(self, key):
+        with self._lock:
+            return self._lookup(key)
+
+    def set(self, key, value, ex=None, px=None, nx=False):
+        with self._lock:
+            if nx and self._alive(key):
+                return None
+            self._data[key] = str(value)
+            self._expiry.pop(key, None)
+            if ex is not None:
+                self._expiry[key] = time.time() + ex
+            elif px is not None:
+                self._expiry[key] = time.time() + px / 1000.0
+            return True
+
+    def incrby(self, key, amount=1):
+        with self._lock:
+            value = int(self._lookup(key, 0)) + amount
+            self._data[key] = str(value)
+            return value
+
+    def incr(self, key, amount=1):
+        return self.incrby(key, amount)
+
+    def decrby(self, key, amount=1):
+        return self.incrby(key, -amount)
+
+    def decr(self, key, amount=1):
+        return self.incrby(key, -amount)
+
+    # Hashes
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            bucket = self._get(key, dict)
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = sum(1 for name in items if name not in bucket)
+            bucket.update({name: str(val) for name, val in items.items()})
+            return added
+
+    def hsetnx(self, key, field, value):
+        with self._lock:
+            bucket = self._get(key, dict)
+            if field in bucket:
+                return 0
+            bucket[field] = str(value)
+            return 1
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._lookup(key, {}).get(field)
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._lookup(key, {}))
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            bucket = self._lookup(key, {})
+            return sum(1 for field in fields if bucket.pop(field, None) is not None)
+
+    def hlen(self, key):
+        with self._lock:
+            return len(self._lookup(key, {}))
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            bucket = self._get(key, dict)
+            value = int(bucket.get(field, 0)) + amount
+            bucket[field] = str(value)
+            return value
+
+    # Sets
+    def sadd(self, key, *members):
+        with self._lock:
+            bucket = self._get(key, set)
+            added = sum(1 for member in members if str(member) not in bucket)
+            bucket.update(str(member) for member in members)
+            return added
+
+    def srem(self, key, *members):
+        with self._lock:
+            bucket = self._lookup(key, set())
+            removed = sum(1 for member in members if str(member) in bucket)
+            bucket.difference_update(str(member) for member in members)
+            return removed
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._lookup(key, set()))
+
+    def scard(self, key):
+        with self._lock:
+            return len(self._lookup(key, set()))
+
+    # Sorted sets
+    def zadd(self, key, mapping, nx=False, xx=False, gt=False):
+        with self._lock:
+            bucket = self._get(key, dict)
+            added = 0
+            for member, score in mapping.items():
+                member = str(member)
+                exists = member in bucket
+                if (nx and exists) or (xx and not exists):
+                    continue
+                if gt and exists and float(score) <= bucket[member]:
+                    continue
+                added += 0 if exists else 1
+                bucket[member] = float(score)
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            bucket = self._lookup(key, {})
+            return sum(1 for member in members if bucket.pop(str(member), None) is not None)
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._lookup(key, {}))
+
+    def zscore(self, key, member):
+        with self._lock:
+            return self._lookup(key, {}).get(str(member))
+
+    def zincrby(self, key, amount, member):
+        with self._lock:
+            bucket = self._get(key, dict)
+            bucket[str(member)] = bucket.get(str(member), 0.0) + amount
+            return bucket[str(member)]
+
+    def _range_by_score(self, key, min, max):
+        low, high = float(min), float(max)
+        bucket = self._lookup(key, {})
+        return sorted(
+            ((member, score) for member, score in bucket.items() if low <= score <= high),
+            key=lambda item: (item[1], item[0])
+        )
+
+    def zrangebyscore(self, key, min, max, start=None, num=None, withscores=False):
+        with self._lock:
+            items = self._range_by_score(key, min, max)
+            if start is not None and num is not None:
+                items = items[start:start + num]
+            return items if withscores else [member for member, _ in items]
+
+    def zremrangebyscore(self, key, min, max):
+        with self._lock:
+            items = self._range_by_score(key, min, max)
+            bucket = self._lookup(key, {})
+            for member, _ in items:
+                bucket.pop(member, None)
+            return len(items)
+
+    def zrange(self, key, start, end, desc=False, withscores=False):
+        with self._lock:
+            items = sorted(
+                self._lookup(key, {}).items(),
+                key=lambda item: (item[1], item[0]),
+                reverse=desc
+            )
+            end = len(items) if end == -1 else end + 1
+            items = items[start:end]
+            return items if withscores else [member for member, _ in items]
+
+    # Lists
+    def rpush(self, key, *values):
+        with self._lock:
+            bucket = self._get(key, list)
+            bucket.extend(str(value) for value in values)
+            return len(bucket)
+
+    def lpush(self, key, *values):
+        with self._lock:
+            bucket = self._get(key, list)
+            for value in values:
+                bucket.insert(0, str(value))
+            return len(bucket)
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            bucket = self._lookup(key, [])
+            end = len(bucket) if end == -1 else end + 1
+            return list(bucket[start:end])
+
+    def ltrim(self, key, start, end):
+        with self._lock:
+            bucket = self._lookup(key, [])
+            end = len(bucket) if end == -1 else end + 1
+            bucket[:] = bucket[start:end]
+            return True
+
+    def llen(self, key):
+        with self._lock:
+            return len(self._lookup(key, []))
+
+    def lpop(self, key, count=None):
+        with self._lock:
+            bucket = self._lookup(key, [])
+            if count is None:
+                return bucket.pop(0) if bucket else None
+            popped, bucket[:] = bucket[:count], bucket[count:]
+            return popped
+
+    # Pipelines
+    def pipeline(self, transaction=True):
+        return LocalPipeline(self)
+
+
+class LocalPipeline:
+    """Queue commands and run them under the store lock, like MULTI/EXEC."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self._backend, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self._backend._lock:
+            results = [command(*args, **kwargs) for command, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+
+class AsyncLocalPipeline(LocalPipeline):
+    """Pipeline whose ``execute`` is awaitable, matching ``redis.asyncio``."""
+
+    async def execute(self):
+        return LocalPipeline.execute(self)
+
+
+class AsyncLocalRedis:
+    """Awaitable facade over :class:`LocalRedis`; no thread hop is needed."""
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def pipeline(self, transaction=True):
+        return AsyncLocalPipeline(self._backend)
+
+    def __getattr__(self, name):
+        command = getattr(self._backend, name)
+
+        async def run(*args, **kwargs):
+            return command(*args, **kwargs)
+        return run
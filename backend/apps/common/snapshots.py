@@ -0,0 +1,98 @@
+"""
+Versioned snapshots of the object a WebSocket connection is bound to.
+
+Consumers resolve their room or stream once, before accepting the socket,
+and keep a plain dict of the fields they need instead of querying the row
+for every frame. Each snapshot carries a ``version`` (the row's
+``updated_at`` in microseconds).
+
+When the row changes, a ``post_save`` handler builds the new snapshot and
+``push`` sends it to every connection in the object's group once the
+transaction commits; a deleted row pushes ``None``. Consumers ignore pushes
+older than the snapshot they hold, so late deliveries cannot roll them
+back. Writes that bypass signals (``QuerySet.update``) are picked up when a
+snapshot reaches ``REALTIME_SNAPSHOT_MAX_AGE`` seconds: consumers call
+``refresh_snapshot`` from their keepalive task, so idle connections reload
+too.
+
+Groups are named after the object as connections joined it. When a save
+renames the object, the handler pushes to the previous name's group as well.
+"""
+
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from . import fanout
+
+logger = logging.getLogger(__name__)
+
+
+def version_of(updated_at):
+    return int(updated_at.timestamp() * 1000000)
+
+
+def push(group, snapshot):
+    """Send ``snapshot`` to every connection in ``group`` after the current transaction commits."""
+
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        try:
+            fanout.group_send_sync(channel_layer, group, {
+                'type': 'snapshot_update',
+                'snapshot': snapshot
+            })
+        except Exception:
+            logger.exception("Snapshot push to %s failed", group)
+
+    transaction.on_commit(send)
+
+
+class SnapshotConsumerMixin:
+    """
+    Consumer mixin holding the connection's snapshot.
+
+    Subclasses implement ``load_snapshot`` (returns the snapshot dict or None)
+    and may override ``snapshot_changed`` to react to pushed changes. They
+    call ``refresh_snapshot`` periodically, e.g. from their keepalive task.
+    """
+
+    snapshot = None
+
+    async def resolve_snapshot(self):
+        """Load the snapshot at connect; returns False if the object does not exist."""
+        self.snapshot = await self.load_snapshot()
+        self.snapshot_loaded_at = time.monotonic()
+        return self.snapshot is not None
+
+    async def refresh_snapshot(self):
+        """Reload a snapshot older than ``REALTIME_SNAPSHOT_MAX_AGE``."""
+        max_age = getattr(settings, 'REALTIME_SNAPSHOT_MAX_AGE', 300)
+        if time.monotonic() - self.snapshot_loaded_at >= max_age:
+            snapshot = await self.load_snapshot()
+            self.snapshot_loaded_at = time.monotonic()
+            await self.apply_snapshot(snapshot)
+
+    async def snapshot_update(self, event):
+        """Apply a snapshot pushed to the group."""
+        await self.apply_snapshot(event['snapshot'])
+
+    async def apply_snapshot(self, snapshot):
+        previous = self.snapshot
+        if snapshot is not None and previous is not None and snapshot['version'] < previous['version']:
+            return
+        if snapshot == previous:
+            return
+        self.snapshot = snapshot
+        await self.snapshot_changed(previous)
+
+    async def load_snapshot(self):
+        raise NotImplementedError
+
+    async def snapshot_changed(self, previous):
+        """Called after the snapshot changed; ``self.snapshot`` is None once the object is gone."""
@@ -6,6 +6,9 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime, time, timedelta
 import platform
 import sys
 
@@ -46,4 +49,24 @@ def api_info(request):
             'swagger': '/api/schema/swagger-ui/',
             'redoc': '/api/schema/redoc/'
         }
-    })
\ No newline at end of file
+    })
+
+
+def parse_bound(value, end=False):
+    """
+    Parse an ISO date or datetime query parameter, or return None.
+    
+    A plain date as an ``end`` bound means the end of that day.
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                return None
+            moment = datetime.combine(day + timedelta(days=1 if end else 0), time.min)
+    except ValueError:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
@@ -0,0 +1,141 @@
+"""
+WebSocket wire formats for GenFree Network.
+
+Clients pick a format per connection through the WebSocket subprotocol
+handshake (``Sec-WebSocket-Protocol``):
+
+* ``genfree.json`` - JSON text frames. Clients that offer no subprotocol get
+  the same frames.
+* ``genfree.msgpack.v1`` - binary MessagePack frames. A frame is a two-item
+  array ``[type, body]``. ``type`` is the index of the frame type in
+  ``FRAME_TYPES``, or the type string if it is not listed there. ``body``
+  is the rest of the payload, with every map key listed in ``KEYS``
+  replaced by its index at any depth. Integer map keys are therefore
+  reserved. Inbound binary frames use the same encoding.
+
+``FRAME_TYPES`` and ``KEYS`` are append-only. Any other change needs a new
+protocol version.
+"""
+
+import json
+from functools import lru_cache
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # Installed with channels-redis; the JSON format still works without it
+    msgpack = None
+
+JSON_PROTOCOL = 'genfree.json'
+MSGPACK_PROTOCOL = 'genfree.msgpack.v1'
+
+FRAME_TYPES = [
+    None, 'chat_message', 'user_count', 'typing_snapshot', 'reaction_counts',
+    'backfill', 'error', 'pong', 'rate_limited', 'message_pending',
+    'viewer_count', 'connection_established', 'stream_status', 'announcement',
+    'system_message', 'typing', 'reaction', 'ping', 'heartbeat', 'analytics',
+    'quality_report', 'message_deleted',
+]
+
+KEYS = [
+    'message', 'messages', 'count', 'users', 'user', 'id', 'message_type',
+    'content', 'emoji_reaction', 'sender_name', 'username', 'anonymous_name',
+    'is_approved', 'likes', 'reports', 'is_own_message', 'created_at',
+    'updated_at', 'message_id', 'reaction', 'typing', 'scope', 'retry_after',
+    'viewer_count', 'stream_status', 'status', 'title', 'platform', 'is_live',
+    'priority', 'event', 'data', 'quality', 'buffering_rate', 'message_ids',
+]
+
+_TYPE_CODES = {name: code for code, name in enumerate(FRAME_TYPES) if name}
+_KEY_CODES = {name: code for code, name in enumerate(KEYS)}
+
+
+def enabled_protocols():
+    """Subprotocols this server accepts, in order of preference."""
+    protocols = getattr(settings, 'REALTIME_WIRE_PROTOCOLS', [MSGPACK_PROTOCOL, JSON_PROTOCOL])
+    if msgpack is None:
+        protocols = [protocol for protocol in protocols if protocol != MSGPACK_PROTOCOL]
+    return protocols
+
+
+def msgpack_enabled():
+    return MSGPACK_PROTOCOL in enabled_protocols()
+
+
+def choose_protocol(offered):
+    """Return the preferred enabled subprotocol the client offered, or None."""
+    for protocol in enabled_protocols():
+        if protocol in offered:
+            return protocol
+    return None
+
+
+def _compact(value):
+    if isinstance(value, dict):
+        return {_KEY_CODES.get(key, key): _compact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_compact(item) for item in value]
+    return value
+
+
+def _expand(value):
+    if isinstance(value, dict):
+        return {
+            (KEYS[key] if isinstance(key, int) else key): _expand(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+def pack(payload):
+    """Encode a frame payload (a dict with a ``type``) as MessagePack bytes."""
+    body = dict(payload)
+    frame_type = body.pop('type', None)
+    return msgpack.packb(
+        [_TYPE_CODES.get(frame_type, frame_type), _compact(body)],
+        use_bin_type=True
+    )
+
+
+@lru_cache(maxsize=128)
+def pack_encoded(text):
+    """
+    ``pack`` for a frame that is already JSON-encoded.
+
+    Cached: every binary connection in a process receives the same group
+    frame, so it is packed once per process rather than once per recipient.
+    """
+    return pack(json.loads(text))
+
+
+def unpack(data):
+    """Decode MessagePack frame bytes back into a payload dict; raises ValueError."""
+    try:
+        frame = msgpack.unpackb(data, raw=False, strict_map_key=False)
+        frame_type, body = frame
+        if isinstance(frame_type, int):
+            if frame_type < 0:
+                raise ValueError('Negative frame type')
+            frame_type = FRAME_TYPES[frame_type]
+        payload = _expand(body)
+        payload['type'] = frame_type
+    except Exception as exc:  # msgpack raises several unrelated exception types
+        raise ValueError('Invalid frame format') from exc
+    return payload
+
+
+def decode(text_data=None, bytes_data=None, protocol=None):
+    """Decode an inbound frame into a dict; raises ValueError."""
+    if bytes_data is not None and protocol == MSGPACK_PROTOCOL:
+        payload = unpack(bytes_data)
+    else:
+        try:
+            payload = json.loads(text_data if text_data is not None else bytes_data)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ValueError('Invalid JSON format') from exc
+    if not isinstance(payload, dict):
+        raise ValueError('Invalid frame format')
+    return payload
@@ -3,7 +3,7 @@ Live streaming admin configuration for GenFree Network.
 """
 
 from django.contrib import admin
-from .models import LiveStream, StreamAnalytics, StreamViewer
+from .models import LiveStream, StreamAnalytics, StreamAnalyticsRollup, StreamViewer
 
 
 @admin.register(LiveStream)
@@ -54,6 +54,22 @@ class StreamAnalyticsAdmin(admin.ModelAdmin):
     readonly_fields = ['timestamp']
 
 
+@admin.register(StreamAnalyticsRollup)
+class StreamAnalyticsRollupAdmin(admin.ModelAdmin):
+    """Admin interface for compacted stream analytics."""
+    
+    list_display = [
+        'stream', 'period', 'bucket', 'concurrent_viewers',
+        'chat_messages', 'reactions', 'stream_quality'
+    ]
+    list_filter = ['period', 'stream']
+    date_hierarchy = 'bucket'
+    readonly_fields = [
+        'stream', 'period', 'bucket', 'concurrent_viewers', 'new_viewers', 'returning_viewers',
+        'chat_messages', 'reactions', 'shares', 'stream_quality', 'buffering_rate', 'samples'
+    ]
+
+
 @admin.register(StreamViewer)
 class StreamViewerAdmin(admin.ModelAdmin):
     """Admin interface for stream viewers."""
@@ -0,0 +1,153 @@
+"""
+In-process aggregation of viewer analytics events.
+
+Viewers report joins, chat messages, reactions, shares and quality samples
+over the stream socket. Instead of one ``StreamAnalytics`` row per event,
+each process sums them per stream into buckets of
+``LIVESTREAM_ANALYTICS_BUCKET_SECONDS`` and writes one row per bucket, with
+``timestamp`` at the start of the bucket, once the bucket has closed.
+``concurrent_viewers`` is the stream's viewer count at flush time,
+``stream_quality`` the most reported quality and ``buffering_rate`` the
+mean of the samples.
+
+Buckets are flushed by a background task on the consumer's event loop and,
+including the one still open, on interpreter shutdown. Several processes
+each write their own row for a bucket; readers sum the event counts and
+take the largest ``concurrent_viewers``.
+"""
+
+import asyncio
+import atexit
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from apps.common.realtime import get_redis
+from .models import LiveStream, StreamAnalytics
+from .viewers import COUNTS_KEY
+
+logger = logging.getLogger(__name__)
+
+# Client analytics event -> StreamAnalytics counter
+EVENT_FIELDS = {
+    'viewer_joined': 'new_viewers',
+    'chat_message': 'chat_messages',
+    'reaction': 'reactions',
+    'share': 'shares',
+}
+
+
+class Bucket:
+    """Event counts and quality samples of one stream over one bucket."""
+
+    def __init__(self):
+        self.events = Counter()
+        self.qualities = Counter()
+        self.buffering_total = 0.0
+        self.samples = 0
+
+    def row(self, stream_id, start, viewers):
+        quality = self.qualities.most_common(1)[0][0] if self.qualities else '1080p'
+        buffering = self.buffering_total / self.samples if self.samples else 0.0
+        return StreamAnalytics(
+            stream_id=stream_id,
+            timestamp=datetime.fromtimestamp(start, tz=dt_timezone.utc),
+            concurrent_viewers=viewers,
+            stream_quality=quality,
+            buffering_rate=round(min(max(buffering, 0.0), 999.99), 2),
+            **{field: self.events[field] for field in EVENT_FIELDS.values()}
+        )
+
+
+class StreamAnalyticsAggregator:
+    """Per-process buckets of stream analytics, written once they close."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._task = None
+
+    @property
+    def width(self):
+        return getattr(settings, 'LIVESTREAM_ANALYTICS_BUCKET_SECONDS', 10)
+
+    def _bucket(self, stream_id):
+        start = int(time.time() // self.width * self.width)
+        key = (str(stream_id), start)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = Bucket()
+            self._ensure_running()
+        return bucket
+
+    def record_event(self, stream_id, event_type):
+        """Count a client analytics event; unknown event types are ignored."""
+        field = EVENT_FIELDS.get(event_type)
+        if field:
+            self._bucket(stream_id).events[field] += 1
+
+    def record_quality(self, stream_id, quality, buffering_rate):
+        """Add a quality sample; raises ValueError for a non-numeric buffering rate."""
+        try:
+            buffering_rate = float(buffering_rate)
+        except (TypeError, ValueError):
+            raise ValueError('Invalid buffering rate')
+        bucket = self._bucket(stream_id)
+        bucket.qualities[str(quality)[:10]] += 1
+        bucket.buffering_total += buffering_rate
+        bucket.samples += 1
+
+    def _ensure_running(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Outside a consumer; left for the shutdown flush
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self._buckets:
+            await asyncio.sleep(self.width)
+            await database_sync_to_async(self.write)(self.take(closed_only=True))
+
+    def take(self, closed_only=False):
+        """Remove and return the buckets to write, by default all of them."""
+        cutoff = time.time() - self.width if closed_only else float('inf')
+        taken = {key: bucket for key, bucket in self._buckets.items() if key[1] <= cutoff}
+        for key in taken:
+            del self._buckets[key]
+        return taken
+
+    def write(self, buckets):
+        """Insert one row per bucket; returns the number of rows written."""
+        if not buckets:
+            return 0
+        stream_ids = sorted({stream_id for stream_id, _ in buckets})
+        try:
+            pipe = get_redis().pipeline()
+            for stream_id in stream_ids:
+                pipe.hget(COUNTS_KEY, stream_id)
+            viewers = dict(zip(stream_ids, pipe.execute()))
+            # Streams deleted since the events arrived are skipped
+            existing = {
+                str(pk) for pk in LiveStream.objects.filter(id__in=stream_ids).values_list('id', flat=True)
+            }
+            rows = StreamAnalytics.objects.bulk_create([
+                bucket.row(stream_id, start, max(int(viewers[stream_id] or 0), 0))
+                for (stream_id, start), bucket in buckets.items() if stream_id in existing
+            ])
+        except Exception:
+            logger.exception("Stream analytics flush failed; dropped %d buckets", len(buckets))
+            return 0
+        return len(rows)
+
+    def flush_sync(self):
+        """Write every bucket, open ones included; used on interpreter shutdown."""
+        return self.write(self.take())
+
+
+analytics_aggregator = StreamAnalyticsAggregator()
+atexit.register(analytics_aggregator.flush_sync)
@@ -4,4 +4,10 @@ from django.apps import AppConfig
 class LivestreamConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.livestream'
-    verbose_name = 'Live Streaming'
\ No newline at end of file
+    verbose_name = 'Live Streaming'
+    
+    def ready(self):
+        """
+        Import signals when the app is ready.
+        """
+        import apps.livestream.signals
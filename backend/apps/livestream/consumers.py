@@ -2,138 +2,193 @@
 LiveStream WebSocket consumers for real-time viewer tracking.
 """
 
-import json
+import asyncio
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.utils import timezone
-from .models import LiveStream, StreamViewer, StreamAnalytics
+from apps.common.broadcast import FrameBroadcastMixin, GroupBroadcastCoalescer, frame_event
+from apps.common.presence import keepalive
+from apps.common.snapshots import SnapshotConsumerMixin
+from .models import LiveStream, StreamViewer
+from .signals import STREAM_SNAPSHOT_FIELDS, stream_snapshot
+from . import viewers
+from .aggregation import analytics_aggregator
 
+viewer_count_broadcasts = GroupBroadcastCoalescer('livestream_viewer_count')
 
-class LiveStreamConsumer(AsyncWebsocketConsumer):
+
+class LiveStreamConsumer(SnapshotConsumerMixin, FrameBroadcastMixin, AsyncWebsocketConsumer):
     """WebSocket consumer for live streaming functionality."""
     
     async def connect(self):
         self.stream_id = self.scope['url_route']['kwargs']['stream_id']
+        
+        # Refuse unknown streams before the handshake completes
+        if not await self.resolve_snapshot():
+            await self.close()
+            return
+        self.stream_id = self.snapshot['id']
         self.stream_group_name = f'livestream_{self.stream_id}'
         
         # Join stream group
-        await self.channel_layer.group_add(
-            self.stream_group_name,
-            self.channel_name
-        )
+        await self.group_join(self.stream_group_name)
         
-        await self.accept()
+        await self.accept_connection()
         
-        # Record viewer
-        await self.add_viewer()
+        # Record the visit, count the viewer and keep it counted while the
+        # socket is open
+        self.viewer_id = await self.add_viewer()
+        viewer_count = await viewers.ajoin(self.stream_id, self.channel_name, self.viewer_id)
+        self.keepalive_task = asyncio.ensure_future(
+            keepalive(self.keep_alive, viewers.stream_presence.ttl / 3)
+        )
         
         # Send current viewer count and stream status
-        viewer_count = await self.get_viewer_count()
-        stream_status = await self.get_stream_status()
-        
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'connection_established',
             'viewer_count': viewer_count,
-            'stream_status': stream_status
-        }))
+            'stream_status': self.get_stream_status()
+        })
         
-        # Broadcast updated viewer count
-        await self.channel_layer.group_send(
-            self.stream_group_name,
-            {
-                'type': 'viewer_count_update',
-                'count': viewer_count
-            }
+        # Broadcast updated viewer count, coalesced per tick
+        await viewer_count_broadcasts.schedule(
+            self.channel_layer, self.stream_group_name, self.viewer_count_event
         )
     
     async def disconnect(self, close_code):
+        if not hasattr(self, 'stream_group_name'):
+            return  # Refused at connect
+        
+        if hasattr(self, 'keepalive_task'):
+            self.keepalive_task.cancel()
+        
         # Remove viewer
+        await viewers.aleave(self.stream_id, self.channel_name, getattr(self, 'viewer_id', None))
         await self.remove_viewer()
         
         # Leave stream group
-        await self.channel_layer.group_discard(
-            self.stream_group_name,
-            self.channel_name
-        )
+        await self.group_leave(self.stream_group_name)
         
         # Update viewer count
-        viewer_count = await self.get_viewer_count()
-        await self.channel_layer.group_send(
-            self.stream_group_name,
-            {
-                'type': 'viewer_count_update',
-                'count': viewer_count
-            }
+        await viewer_count_broadcasts.schedule(
+            self.channel_layer, self.stream_group_name, self.viewer_count_event
         )
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = self.decode_frame(text_data, bytes_data)
             message_type = data.get('type')
             
             if message_type == 'heartbeat':
-                await self.send(text_data=json.dumps({'type': 'pong'}))
+                await self.send_frame({'type': 'pong'})
             elif message_type == 'analytics':
                 await self.handle_analytics(data)
             elif message_type == 'quality_report':
                 await self.handle_quality_report(data)
                 
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+        except ValueError as exc:
+            await self.send_frame({
                 'type': 'error',
-                'message': 'Invalid JSON format'
-            }))
+                'message': str(exc)
+            })
     
     async def handle_analytics(self, data):
         """Handle analytics events from viewer."""
         event_type = data.get('event')
-        metadata = data.get('data', {})
         
-        await self.save_analytics_event(event_type, metadata)
+        analytics_aggregator.record_event(self.stream_id, event_type)
     
     async def handle_quality_report(self, data):
         """Handle video quality reports from viewers."""
         quality = data.get('quality', '1080p')
         buffering_rate = data.get('buffering_rate', 0)
         
-        await self.save_quality_data(quality, buffering_rate)
+        analytics_aggregator.record_quality(self.stream_id, quality, buffering_rate)
+    
+    async def keep_alive(self):
+        """Run by the keepalive task: refresh presence, heartbeat and groups, reload a stale snapshot."""
+        await viewers.atouch(self.stream_id, self.channel_name, self.viewer_id)
+        await self.touch_groups()
+        await self.refresh_snapshot()
+    
+    def get_stream_status(self):
+        """Current stream status from the snapshot."""
+        stream = self.snapshot
+        if stream is None:
+            return {'status': 'not_found'}
+        return {
+            'status': stream['status'],
+            'title': stream['title'],
+            'platform': stream['platform'],
+            'is_live': stream['status'] == 'live'
+        }
+    
+    async def snapshot_changed(self, previous):
+        """Tell the viewer about status changes; close once the stream is deleted."""
+        if self.snapshot is None:
+            await self.close()
+        elif previous is None or previous['status'] != self.snapshot['status']:
+            await self.send_frame({
+                'type': 'stream_status',
+                'status': self.snapshot['status'],
+                'message': ''
+            })
+    
+    async def viewer_count_event(self):
+        """Build a viewer count update carrying the latest count."""
+        return frame_event({
+            'type': 'viewer_count',
+            'count': await self.get_viewer_count()
+        })
     
     # Message broadcast handlers
+    # Group frames normally arrive pre-encoded via broadcast_frame; these
+    # handlers serve events sent by other code and by older nodes.
     async def viewer_count_update(self, event):
         """Send viewer count update to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'viewer_count',
             'count': event['count']
-        }))
+        })
     
     async def stream_status_update(self, event):
         """Send stream status update to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'stream_status',
             'status': event['status'],
             'message': event.get('message', '')
-        }))
+        })
     
     async def stream_announcement(self, event):
         """Send stream announcement to WebSocket."""
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             'type': 'announcement',
             'message': event['message'],
             'priority': event.get('priority', 'normal')
-        }))
+        })
     
     # Database operations
+    @database_sync_to_async
+    def load_snapshot(self):
+        """Load the stream snapshot, or None for an unknown id."""
+        try:
+            stream_id = uuid.UUID(self.stream_id)
+        except ValueError:
+            return None
+        stream = LiveStream.objects.only(*STREAM_SNAPSHOT_FIELDS).filter(id=stream_id).first()
+        return stream_snapshot(stream) if stream else None
+    
     @database_sync_to_async
     def add_viewer(self):
-        """Add viewer to the stream."""
+        """Record the viewer's visit and return the row id; the live count is kept in ``viewers``."""
         try:
-            stream = LiveStream.objects.get(id=self.stream_id)
             user = self.scope['user'] if self.scope['user'].is_authenticated else None
             session_id = self.scope.get('session', {}).get('session_key', '')
             
             # Create or get viewer record
             viewer, created = StreamViewer.objects.get_or_create(
-                stream=stream,
+                stream_id=self.stream_id,
                 user=user,
                 session_id=session_id,
                 defaults={
@@ -142,101 +197,36 @@ class LiveStreamConsumer(AsyncWebsocketConsumer):
                 }
             )
             
-            # Update stream's current viewer count
-            stream.current_viewers += 1
-            if stream.current_viewers > stream.max_viewers:
-                stream.max_viewers = stream.current_viewers
-            stream.save(update_fields=['current_viewers', 'max_viewers'])
-            
-            return True
-        except LiveStream.DoesNotExist:
-            return False
+            return viewer.pk
         except Exception as e:
             print(f"Error adding viewer: {e}")
-            return False
+            return None
     
     @database_sync_to_async
     def remove_viewer(self):
-        """Remove viewer from the stream."""
+        """Close the viewer's visit record."""
         try:
             user = self.scope['user'] if self.scope['user'].is_authenticated else None
             session_id = self.scope.get('session', {}).get('session_key', '')
             
-            # Update viewer record
-            StreamViewer.objects.filter(
-                stream_id=self.stream_id,
-                user=user,
-                session_id=session_id,
-                left_at__isnull=True
-            ).update(left_at=timezone.now())
-            
-            # Update stream's current viewer count
-            stream = LiveStream.objects.get(id=self.stream_id)
-            stream.current_viewers = max(0, stream.current_viewers - 1)
-            stream.save(update_fields=['current_viewers'])
+            # Close this connection's own row, even if it was reaped meanwhile
+            viewer_id = getattr(self, 'viewer_id', None)
+            if viewer_id:
+                viewer_rows = StreamViewer.objects.filter(pk=viewer_id)
+            else:
+                viewer_rows = StreamViewer.objects.filter(
+                    stream_id=self.stream_id,
+                    user=user,
+                    session_id=session_id,
+                    left_at__isnull=True
+                )
+            viewer_rows.update(left_at=timezone.now())
             
             return True
         except Exception as e:
             print(f"Error removing viewer: {e}")
             return False
     
-    @database_sync_to_async
-    def get_viewer_count(self):
+    async def get_viewer_count(self):
         """Get current viewer count for the stream."""
-        try:
-            stream = LiveStream.objects.get(id=self.stream_id)
-            return stream.current_viewers
-        except LiveStream.DoesNotExist:
-            return 0
-    
-    @database_sync_to_async
-    def get_stream_status(self):
-        """Get current stream status."""
-        try:
-            stream = LiveStream.objects.get(id=self.stream_id)
-            return {
-                'status': stream.status,
-                'title': stream.title,
-                'platform': stream.platform,
-                'is_live': stream.is_live
-            }
-        except LiveStream.DoesNotExist:
-            return {'status': 'not_found'}
-    
-    @database_sync_to_async
-    def save_analytics_event(self, event_type, metadata):
-        """Save analytics event to database."""
-        try:
-            stream = LiveStream.objects.get(id=self.stream_id)
-            
-            StreamAnalytics.objects.create(
-                stream=stream,
-                concurrent_viewers=stream.current_viewers,
-                new_viewers=1 if event_type == 'viewer_joined' else 0,
-                chat_messages=1 if event_type == 'chat_message' else 0,
-                reactions=1 if event_type == 'reaction' else 0,
-                shares=1 if event_type == 'share' else 0
-            )
-            
-            return True
-        except Exception as e:
-            print(f"Error saving analytics: {e}")
-            return False
-    
-    @database_sync_to_async
-    def save_quality_data(self, quality, buffering_rate):
-        """Save video quality data."""
-        try:
-            stream = LiveStream.objects.get(id=self.stream_id)
-            
-            StreamAnalytics.objects.create(
-                stream=stream,
-                concurrent_viewers=stream.current_viewers,
-                stream_quality=quality,
-                buffering_rate=buffering_rate
-            )
-            
-            return True
-        except Exception as e:
-            print(f"Error saving quality data: {e}")
-            return False
\ No newline at end of file
+        return await viewers.acount(self.stream_id)
@@ -88,7 +88,8 @@ class StreamAnalytics(models.Model):
     """Model for storing stream analytics data."""
     
     stream = models.ForeignKey(LiveStream, on_delete=models.CASCADE, related_name='analytics')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: aggregated rows carry the start of their bucket
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     
     # Viewership metrics
     concurrent_viewers = models.IntegerField(default=0)
@@ -106,10 +107,51 @@ class StreamAnalytics(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='stream_analytics_ts_idx'),
+            models.Index(fields=['stream', 'timestamp'], name='stream_analytics_stream_ts_idx'),
+        ]
         verbose_name = 'Stream Analytics'
         verbose_name_plural = 'Stream Analytics'
 
 
+class StreamAnalyticsRollup(models.Model):
+    """Stream analytics compacted per stream and minute or hour."""
+    
+    PERIOD_CHOICES = [
+        ('minute', 'Minute'),
+        ('hour', 'Hour'),
+    ]
+    
+    stream = models.ForeignKey(LiveStream, on_delete=models.CASCADE, related_name='analytics_rollups')
+    period = models.CharField(max_length=10, choices=PERIOD_CHOICES)
+    bucket = models.DateTimeField(help_text="Start of the minute or hour (UTC)")
+    
+    # Peak over the period; the counters below are totals
+    concurrent_viewers = models.IntegerField(default=0)
+    new_viewers = models.IntegerField(default=0)
+    returning_viewers = models.IntegerField(default=0)
+    chat_messages = models.IntegerField(default=0)
+    reactions = models.IntegerField(default=0)
+    shares = models.IntegerField(default=0)
+    
+    # Most reported quality and mean buffering rate over ``samples`` raw rows
+    stream_quality = models.CharField(max_length=10, default='1080p')
+    buffering_rate = models.DecimalField(max_digits=5, decimal_places=2, default=0.0)
+    samples = models.IntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['stream', 'period', 'bucket']
+        indexes = [
+            models.Index(fields=['period', 'bucket'], name='stream_rollup_period_bkt_idx'),
+        ]
+        verbose_name = 'Stream Analytics Rollup'
+        verbose_name_plural = 'Stream Analytics Rollups'
+    
+    def __str__(self):
+        return f"{self.stream_id} {self.period} {self.bucket:%Y-%m-%d %H:%M}"
+
+
 class StreamViewer(models.Model):
     """Track individual viewers of streams."""
     
@@ -131,6 +173,13 @@ class StreamViewer(models.Model):
     
     class Meta:
         unique_together = ['stream', 'user', 'session_id']
+        indexes = [
+            # Open visits, scanned by the lapsed viewer reaper
+            models.Index(
+                fields=['joined_at'], name='stream_viewer_open_idx',
+                condition=models.Q(left_at__isnull=True)
+            ),
+        ]
         verbose_name = 'Stream Viewer'
         verbose_name_plural = 'Stream Viewers'
     
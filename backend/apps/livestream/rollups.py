@@ -0,0 +1,284 @@
+"""
+Minute and hour rollups of stream analytics.
+
+Raw ``StreamAnalytics`` rows (one per stream, bucket and process, see
+``aggregation``) are compacted by the ``compact_stream_analytics`` task into
+``StreamAnalyticsRollup`` rows: one per stream and UTC minute built from the
+raw rows, and one per stream and UTC hour built from the minute rows.
+Counters are summed, ``concurrent_viewers`` is the peak, ``buffering_rate``
+the mean over the raw rows covered and ``stream_quality`` the most common.
+
+Minutes are compacted once they are ``LIVESTREAM_ANALYTICS_GRACE_SECONDS``
+old, and the last ``LIVESTREAM_ANALYTICS_REROLL_MINUTES`` are recomputed on
+every run for rows flushed late. Runs never overlap, and the first one goes
+back at most ``LIVESTREAM_ANALYTICS_BACKFILL_DAYS``; older raw rows are left
+to retention. Each tier is kept for
+``LIVESTREAM_ANALYTICS_RETENTION_DAYS[tier]`` days (None keeps it forever),
+and rows are otherwise only deleted once the next tier covers them, in
+batches of ``LIVESTREAM_ANALYTICS_PRUNE_BATCH_SIZE``.
+
+``series`` serves reads from the coarsest tier the range needs: the finest
+one that keeps it within ``LIVESTREAM_ANALYTICS_MAX_POINTS`` buckets and
+still holds its start. Whatever a rollup tier has not compacted yet is
+aggregated from raw rows on the fly.
+"""
+
+import logging
+import uuid
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.common.realtime import get_redis, release_lock
+from .models import StreamAnalytics, StreamAnalyticsRollup
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_KEY = 'livestream:analytics:rolled-until:{}'
+LOCK_KEY = 'livestream:analytics:compact-lock'
+
+TIERS = ['raw', 'minute', 'hour']
+COUNTERS = ['new_viewers', 'returning_viewers', 'chat_messages', 'reactions', 'shares']
+FIELDS = ['timestamp', 'concurrent_viewers', *COUNTERS, 'stream_quality', 'buffering_rate']
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def retention_days(tier):
+    return _setting('LIVESTREAM_ANALYTICS_RETENTION_DAYS', {}).get(tier)
+
+
+def width(tier):
+    if tier == 'raw':
+        return timedelta(seconds=_setting('LIVESTREAM_ANALYTICS_BUCKET_SECONDS', 10))
+    return timedelta(minutes=1) if tier == 'minute' else timedelta(hours=1)
+
+
+def floor(moment, period):
+    moment = moment.astimezone(dt_timezone.utc).replace(second=0, microsecond=0)
+    return moment.replace(minute=0) if period == 'hour' else moment
+
+
+def rolled_until(period):
+    """End of the last compacted ``period`` bucket, or None before the first run."""
+    value = get_redis().get(WATERMARK_KEY.format(period))
+    if value:
+        return parse_datetime(value)
+    latest = StreamAnalyticsRollup.objects.filter(period=period).order_by('-bucket').values_list(
+        'bucket', flat=True
+    ).first()
+    return latest + width(period) if latest else None
+
+
+def aggregate(rows, period, source='raw'):
+    """
+    Group ``rows`` per stream into ``period`` buckets.
+
+    ``rows`` are raw rows, or minute rollups with ``source='minute'``.
+    Returns unsaved rollups keyed by ``(stream_id, bucket)``.
+    """
+    time_field = 'timestamp' if source == 'raw' else 'bucket'
+
+    def weights():
+        # Raw rows count once each, minute rows for the raw rows they cover
+        if source == 'raw':
+            return Count('id'), Sum('buffering_rate')
+        return Sum('samples'), Sum(F('buffering_rate') * F('samples'))
+
+    rows = rows.annotate(slot=Trunc(time_field, period, tzinfo=dt_timezone.utc)).order_by()
+    weight, buffering = weights()
+    buckets = {}
+    for row in rows.values('stream_id', 'slot').annotate(
+        peak=Max('concurrent_viewers'),
+        weight=weight,
+        buffering=buffering,
+        **{f'total_{field}': Sum(field) for field in COUNTERS}
+    ):
+        samples = row['weight'] or 0
+        buffering_rate = float(row['buffering'] or 0) / samples if samples else 0.0
+        buckets[(row['stream_id'], row['slot'])] = StreamAnalyticsRollup(
+            stream_id=row['stream_id'],
+            period=period,
+            bucket=row['slot'],
+            concurrent_viewers=row['peak'] or 0,
+            buffering_rate=round(min(buffering_rate, 999.99), 2),
+            samples=samples,
+            **{field: row[f'total_{field}'] or 0 for field in COUNTERS}
+        )
+
+    weight, _ = weights()
+    qualities = {}
+    for stream_id, slot, quality, count in rows.values('stream_id', 'slot', 'stream_quality').annotate(
+        count=weight
+    ).values_list('stream_id', 'slot', 'stream_quality', 'count'):
+        if count > qualities.get((stream_id, slot), ('', -1))[1]:
+            qualities[(stream_id, slot)] = (quality, count)
+    for key, (quality, _) in qualities.items():
+        buckets[key].stream_quality = quality
+    return buckets
+
+
+def rollup(period, start, end):
+    """Recompute the ``period`` rows for ``[start, end)``; both must be on a ``period`` boundary."""
+    if period == 'minute':
+        buckets = aggregate(
+            StreamAnalytics.objects.filter(timestamp__gte=start, timestamp__lt=end), period
+        )
+    else:
+        buckets = aggregate(
+            StreamAnalyticsRollup.objects.filter(period='minute', bucket__gte=start, bucket__lt=end),
+            period, source='minute'
+        )
+    with transaction.atomic():
+        StreamAnalyticsRollup.objects.filter(period=period, bucket__gte=start, bucket__lt=end).delete()
+        StreamAnalyticsRollup.objects.bulk_create(buckets.values())
+    return len(buckets)
+
+
+def delete_in_batches(queryset):
+    """Delete ``queryset`` a bounded pk batch at a time; returns rows deleted."""
+    batch_size = _setting('LIVESTREAM_ANALYTICS_PRUNE_BATCH_SIZE', 5000)
+    deleted = 0
+    while True:
+        pks = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += queryset.model.objects.filter(pk__in=pks).delete()[0]
+
+
+def prune(now, minute_until, hour_until):
+    """Delete rows past their tier's retention that the next tier covers; returns rows deleted."""
+    deleted = 0
+    days = retention_days('raw')
+    if days is not None:
+        cutoff = min(now - timedelta(days=days), minute_until)
+        deleted += delete_in_batches(StreamAnalytics.objects.filter(timestamp__lt=cutoff))
+    days = retention_days('minute')
+    if days is not None:
+        cutoff = min(now - timedelta(days=days), hour_until)
+        deleted += delete_in_batches(
+            StreamAnalyticsRollup.objects.filter(period='minute', bucket__lt=cutoff)
+        )
+    days = retention_days('hour')
+    if days is not None:
+        cutoff = now - timedelta(days=days)
+        deleted += delete_in_batches(
+            StreamAnalyticsRollup.objects.filter(period='hour', bucket__lt=cutoff)
+        )
+    return deleted
+
+
+def compact_stream_analytics():
+    """
+    Bring minute and hour rollups up to date and apply retention.
+
+    Returns the new watermarks and the number of rows pruned, or None
+    while another run holds the lock.
+    """
+    redis = get_redis()
+    token = uuid.uuid4().hex
+    if not redis.set(LOCK_KEY, token, ex=30 * 60, nx=True):
+        logger.info("Stream analytics compaction already running; skipping")
+        return None
+    try:
+        return _compact()
+    finally:
+        release_lock([LOCK_KEY], [token])
+
+
+def _compact():
+    now = timezone.now()
+    minute_end = floor(now - timedelta(seconds=_setting('LIVESTREAM_ANALYTICS_GRACE_SECONDS', 60)), 'minute')
+    watermark = rolled_until('minute')
+    if watermark is None:
+        backfill_from = now - timedelta(days=_setting('LIVESTREAM_ANALYTICS_BACKFILL_DAYS', 7))
+        first = StreamAnalytics.objects.filter(timestamp__gte=backfill_from).order_by(
+            'timestamp'
+        ).values_list('timestamp', flat=True).first()
+        start = floor(first, 'minute') if first else minute_end
+    else:
+        start = min(watermark, minute_end - timedelta(minutes=_setting('LIVESTREAM_ANALYTICS_REROLL_MINUTES', 5)))
+
+    chunk_start = start
+    while chunk_start < minute_end:
+        chunk_end = min(chunk_start + timedelta(hours=1), minute_end)
+        rollup('minute', chunk_start, chunk_end)
+        chunk_start = chunk_end
+
+    # Hours that are complete and had minutes recomputed
+    hour_end = floor(minute_end, 'hour')
+    chunk_start = floor(start, 'hour')
+    while chunk_start < hour_end:
+        chunk_end = min(chunk_start + timedelta(days=1), hour_end)
+        rollup('hour', chunk_start, chunk_end)
+        chunk_start = chunk_end
+
+    pipe = get_redis().pipeline()
+    pipe.set(WATERMARK_KEY.format('minute'), minute_end.isoformat())
+    pipe.set(WATERMARK_KEY.format('hour'), hour_end.isoformat())
+    pipe.execute()
+
+    return {
+        'minute': minute_end.isoformat(),
+        'hour': hour_end.isoformat(),
+        'pruned': prune(now, minute_end, hour_end),
+    }
+
+
+def choose_tier(since, until):
+    """The finest tier within ``LIVESTREAM_ANALYTICS_MAX_POINTS`` buckets that still holds ``since``."""
+    now = timezone.now()
+    max_points = _setting('LIVESTREAM_ANALYTICS_MAX_POINTS', 1500)
+    for tier in TIERS[:-1]:
+        days = retention_days(tier)
+        if days is not None and since < now - timedelta(days=days):
+            continue
+        if (until - since) / width(tier) <= max_points:
+            return tier
+    return TIERS[-1]
+
+
+def point(row):
+    return {
+        'stream_id': row.stream_id,
+        'timestamp': row.bucket,
+        **{field: getattr(row, field) for field in FIELDS[1:]}
+    }
+
+
+def series(since, until, stream_id=None, tier=None):
+    """
+    Analytics buckets in ``[since, until)``, oldest first, as ``(tier, rows)``.
+
+    ``tier`` defaults to ``choose_tier``. Rows are dicts with the
+    ``StreamAnalytics`` fields and ``stream_id``, one per stream and bucket
+    (by stream within a bucket) when ``stream_id`` is not given.
+    """
+    tier = tier or choose_tier(since, until)
+    raw = StreamAnalytics.objects.all()
+    if stream_id:
+        raw = raw.filter(stream_id=stream_id)
+    if tier == 'raw':
+        return tier, list(
+            raw.filter(timestamp__gte=since, timestamp__lt=until).order_by(
+                'timestamp', 'stream_id'
+            ).values('stream_id', *FIELDS)
+        )
+
+    # Compacted buckets, then the tail aggregated from raw rows
+    boundary = min(max(rolled_until(tier) or since, since), until)
+    rolled = StreamAnalyticsRollup.objects.filter(period=tier, bucket__gte=since, bucket__lt=boundary)
+    if stream_id:
+        rolled = rolled.filter(stream_id=stream_id)
+    tail = aggregate(raw.filter(timestamp__gte=boundary, timestamp__lt=until), tier)
+    rows = list(rolled.order_by('bucket', 'stream_id')) + sorted(
+        tail.values(), key=lambda row: (row.bucket, row.stream_id)
+    )
+    return tier, [point(row) for row in rows]
@@ -48,10 +48,12 @@ class LiveStreamCreateSerializer(serializers.ModelSerializer):
 class StreamAnalyticsSerializer(serializers.ModelSerializer):
     """Serializer for stream analytics."""
     
+    stream_id = serializers.ReadOnlyField()
+    
     class Meta:
         model = StreamAnalytics
         fields = [
-            'timestamp', 'concurrent_viewers', 'new_viewers', 'returning_viewers',
+            'stream_id', 'timestamp', 'concurrent_viewers', 'new_viewers', 'returning_viewers',
             'chat_messages', 'reactions', 'shares', 'stream_quality', 'buffering_rate'
         ]
 
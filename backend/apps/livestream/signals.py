@@ -0,0 +1,45 @@
+"""
+Signal handlers for the livestream app.
+"""
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.common.snapshots import push, version_of
+from . import summary
+from .models import LiveStream
+
+# Fields connected LiveStreamConsumers keep in their stream snapshot
+STREAM_SNAPSHOT_FIELDS = ['id', 'title', 'platform', 'status', 'updated_at']
+
+
+def stream_snapshot(stream):
+    """Snapshot of the stream details a LiveStreamConsumer works from."""
+    return {
+        'id': str(stream.id),
+        'title': stream.title,
+        'platform': stream.platform,
+        'status': stream.status,
+        'version': version_of(stream.updated_at),
+    }
+
+
+@receiver(post_save, sender=LiveStream)
+def push_stream_snapshot(sender, instance, update_fields=None, **kwargs):
+    """Send connected consumers the stream's new details, e.g. after ``end_stream``."""
+    if update_fields and not set(update_fields) & set(STREAM_SNAPSHOT_FIELDS):
+        return
+    push(f'livestream_{instance.id}', stream_snapshot(instance))
+
+
+@receiver(post_delete, sender=LiveStream)
+def push_stream_deleted(sender, instance, **kwargs):
+    """Disconnect consumers of a deleted stream."""
+    push(f'livestream_{instance.id}', None)
+
+
+@receiver(post_save, sender=LiveStream)
+@receiver(post_delete, sender=LiveStream)
+def invalidate_stream_summary(sender, **kwargs):
+    """Drop the cached analytics summary when streams start, end, appear or go away."""
+    summary.invalidate()
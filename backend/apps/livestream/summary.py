@@ -0,0 +1,72 @@
+"""
+Cached stream statistics for ``LiveStreamViewSet.analytics``.
+
+``compute_summary`` gets the totals in a single aggregate query: streams,
+hours streamed (``actual_end - actual_start`` summed in the database),
+views, average and peak viewers, and the number of streams per platform for
+the most popular one.
+
+``cached_analytics`` keeps the endpoint's serialized response in the
+real-time store, so a hit runs no query. The ``LiveStream`` signal handlers
+drop it whenever a stream is saved (started, ended, created or edited) or
+deleted. Viewer counts synced while a stream is live skip signals; they
+show up with the stream's ``end_stream`` save, or once
+``LIVESTREAM_SUMMARY_CACHE_TTL`` runs out.
+"""
+
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Max, Q, Sum
+
+from apps.common.realtime import get_redis
+from .models import LiveStream
+
+SUMMARY_KEY = 'livestream:analytics:summary'
+
+
+def compute_summary():
+    """Stream totals, hours streamed and the most popular platform, in one query."""
+    platforms = [code for code, _ in LiveStream.PLATFORM_CHOICES]
+    totals = LiveStream.objects.aggregate(
+        total_streams=Count('id'),
+        duration=Sum(
+            ExpressionWrapper(F('actual_end') - F('actual_start'), output_field=DurationField()),
+            filter=Q(actual_start__isnull=False, actual_end__isnull=False)
+        ),
+        total_views=Sum('total_views'),
+        average_viewers=Avg('max_viewers'),
+        peak_viewers=Max('max_viewers'),
+        **{f'platform_{code}': Count('id', filter=Q(platform=code)) for code in platforms}
+    )
+    streams_per_platform = {code: totals.pop(f'platform_{code}') for code in platforms}
+    duration = totals.pop('duration')
+    return {
+        'total_streams': totals['total_streams'],
+        'total_hours_streamed': round(duration.total_seconds() / 3600, 2) if duration else 0,
+        'total_views': totals['total_views'] or 0,
+        'average_viewers': round(totals['average_viewers'] or 0, 2),
+        'peak_viewers': totals['peak_viewers'] or 0,
+        'most_popular_platform': (
+            max(platforms, key=streams_per_platform.get) if totals['total_streams'] else 'youtube'
+        ),
+    }
+
+
+def cached_analytics(build):
+    """The cached analytics response, or ``build()`` stored for next time."""
+    redis = get_redis()
+    cached = redis.get(SUMMARY_KEY)
+    if cached:
+        return json.loads(cached)
+    data = build()
+    redis.set(
+        SUMMARY_KEY, json.dumps(data, cls=DjangoJSONEncoder),
+        ex=getattr(settings, 'LIVESTREAM_SUMMARY_CACHE_TTL', 600)
+    )
+    return data
+
+
+def invalidate():
+    get_redis().delete(SUMMARY_KEY)
@@ -0,0 +1,31 @@
+"""
+Celery tasks for live streams.
+"""
+
+from celery import shared_task
+
+from . import rollups, viewers
+
+
+@shared_task
+def sync_viewer_counts():
+    """Copy live viewer counts and peaks to the stream rows."""
+    return viewers.sync_viewer_counts()
+
+
+@shared_task
+def reconcile_viewer_counts():
+    """Reset viewer counters to the connections still present."""
+    return viewers.reconcile_viewer_counts()
+
+
+@shared_task
+def reap_lapsed_viewers():
+    """Close viewer records whose heartbeat lapsed and fix the counts."""
+    return viewers.reap_lapsed_viewers()
+
+
+@shared_task
+def compact_stream_analytics():
+    """Compact raw stream analytics into minute and hour rollups."""
+    return rollups.compact_stream_analytics()
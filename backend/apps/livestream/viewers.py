@@ -0,0 +1,228 @@
+"""
+Live viewer counts for streams.
+
+Connects and disconnects never touch the ``LiveStream`` row. Each one is a
+``HINCRBY`` of the stream's field in ``livestream:viewers``, atomic in the
+real-time store, and a join raises the stream's peak in
+``livestream:viewers:peak`` with ``ZADD GT`` (Redis 6.2+). The
+``sync_viewer_counts`` task copies both to ``LiveStream.current_viewers``
+and ``max_viewers`` every few seconds, one update per stream that changed.
+
+Every connection is also registered in ``stream_presence``, refreshed by
+the consumer's keepalive task while the socket is open. A node that dies
+never decrements its viewers, so ``reconcile_viewer_counts`` resets each
+counter to the number of connections still present, in one script so no
+join or leave lands between the read and the write. A leave never takes a
+counter below zero.
+
+The keepalive also records a heartbeat for the connection's
+``StreamViewer`` row in ``livestream:viewers:heartbeats``, whether or not
+the client sends anything. When a node crashes or a socket dies without the
+server seeing it close, ``left_at`` is never set; ``reap_lapsed_viewers``
+closes those rows at their last heartbeat and reconciles the affected
+streams' counts.
+"""
+
+import logging
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from apps.common.presence import PresenceTracker
+from apps.common.realtime import Script, get_async_redis, get_redis
+from .models import LiveStream, StreamViewer
+
+logger = logging.getLogger(__name__)
+
+COUNTS_KEY = 'livestream:viewers'
+PEAKS_KEY = 'livestream:viewers:peak'
+HEARTBEATS_KEY = 'livestream:viewers:heartbeats'
+
+stream_presence = PresenceTracker('livestream')
+
+
+def _decrement_local(redis, keys, args):
+    count = redis.hincrby(keys[0], args[0], -1)
+    if count < 0:
+        redis.hset(keys[0], args[0], 0)
+        count = 0
+    return count
+
+
+# KEYS: counts hash; ARGV: stream id. Returns the new count.
+decrement_viewers = Script("""
+local count = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if count < 0 then
+    redis.call('HSET', KEYS[1], ARGV[1], 0)
+    count = 0
+end
+return count
+""", _decrement_local)
+
+
+def _reconcile_local(redis, keys, args):
+    now, corrected = float(args[0]), []
+    for key, stream_id in zip(keys[1:], args[1:]):
+        redis.zremrangebyscore(key, '-inf', now)
+        present = redis.zcard(key)
+        count = redis.hget(keys[0], stream_id)
+        if count is None or int(count) != present:
+            redis.hset(keys[0], stream_id, present)
+            corrected.append(stream_id)
+    return corrected
+
+
+# KEYS: counts hash, then each stream's presence key; ARGV: now, then the
+# stream ids. Returns the ids of the counters corrected.
+reconcile_counts = Script("""
+local corrected = {}
+for i = 2, #KEYS do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', ARGV[1])
+    local present = redis.call('ZCARD', KEYS[i])
+    local count = redis.call('HGET', KEYS[1], ARGV[i])
+    if not count or tonumber(count) ~= present then
+        redis.call('HSET', KEYS[1], ARGV[i], present)
+        table.insert(corrected, ARGV[i])
+    end
+end
+return corrected
+""", _reconcile_local)
+
+
+async def ajoin(stream_id, channel_name, viewer_id=None):
+    """Count a new viewer connection; returns the stream's viewer count."""
+    stream_id = str(stream_id)
+    redis = get_async_redis()
+    count = await redis.hincrby(COUNTS_KEY, stream_id, 1)
+    await redis.zadd(PEAKS_KEY, {stream_id: count}, gt=True)
+    await atouch(stream_id, channel_name, viewer_id)
+    return max(count, 0)
+
+
+async def atouch(stream_id, channel_name, viewer_id=None):
+    """Refresh the connection's presence and its viewer row's heartbeat."""
+    await stream_presence.atouch(str(stream_id), channel_name)
+    if viewer_id:
+        await get_async_redis().zadd(HEARTBEATS_KEY, {viewer_id: time.time()})
+
+
+async def aleave(stream_id, channel_name, viewer_id=None):
+    """Count a viewer leaving; returns the stream's viewer count."""
+    stream_id = str(stream_id)
+    redis = get_async_redis()
+    await stream_presence.aleave(stream_id, channel_name)
+    if viewer_id:
+        await redis.zrem(HEARTBEATS_KEY, viewer_id)
+    return await decrement_viewers.acall([COUNTS_KEY], [stream_id])
+
+
+async def acount(stream_id):
+    return max(int(await get_async_redis().hget(COUNTS_KEY, str(stream_id)) or 0), 0)
+
+
+def sync_viewer_counts():
+    """Copy viewer counts and peaks to the stream rows; returns the number of rows updated."""
+    redis = get_redis()
+    pipe = redis.pipeline()
+    pipe.hgetall(COUNTS_KEY)
+    pipe.zrange(PEAKS_KEY, 0, -1, withscores=True)
+    counts, peaks = pipe.execute()
+    if not counts:
+        return 0
+    peaks = {stream_id: int(peak) for stream_id, peak in peaks}
+
+    updated = 0
+    finished = []
+    rows = LiveStream.objects.filter(id__in=list(counts)).values_list(
+        'id', 'status', 'current_viewers', 'max_viewers'
+    )
+    for pk, status, current, peak in rows:
+        stream_id = str(pk)
+        viewers = max(int(counts.pop(stream_id)), 0)
+        new_peak = max(peak, peaks.get(stream_id, 0), viewers)
+        if (viewers, new_peak) != (current, peak):
+            LiveStream.objects.filter(id=pk).update(
+                current_viewers=viewers,
+                max_viewers=Greatest(F('max_viewers'), new_peak)
+            )
+            updated += 1
+        if status == 'ended' and viewers == 0:
+            finished.append(stream_id)
+
+    # Whatever is left in ``counts`` belongs to deleted streams
+    finished.extend(counts)
+    if finished:
+        pipe = redis.pipeline()
+        pipe.hdel(COUNTS_KEY, *finished)
+        pipe.zrem(PEAKS_KEY, *finished)
+        pipe.execute()
+    return updated
+
+
+def reconcile_viewer_counts(stream_ids=None):
+    """
+    Reset counters to the streams' live connections and sync the rows.
+
+    Covers ``stream_ids``, by default every stream with a counter and every
+    stream marked live. Returns the number of counters corrected.
+    """
+    if stream_ids is None:
+        stream_ids = set(get_redis().hgetall(COUNTS_KEY)) | {
+            str(pk) for pk in LiveStream.objects.filter(status='live').values_list('id', flat=True)
+        }
+    stream_ids = sorted(stream_ids)
+    corrected = []
+    if stream_ids:
+        corrected = reconcile_counts(
+            [COUNTS_KEY, *[stream_presence.key(stream_id) for stream_id in stream_ids]],
+            [time.time(), *stream_ids]
+        )
+    if corrected:
+        logger.info("Reconciled viewer counts for %d streams", len(corrected))
+    sync_viewer_counts()
+    return len(corrected)
+
+
+def reap_lapsed_viewers(batch_size=1000):
+    """
+    Close open viewer rows whose heartbeat lapsed and fix their streams' counts.
+
+    A row without any heartbeat on record is closed at ``joined_at``.
+    Returns the number of viewers reaped.
+    """
+    redis = get_redis()
+    cutoff = time.time() - stream_presence.ttl
+    joined_before = datetime.fromtimestamp(cutoff, tz=dt_timezone.utc)
+
+    reaped, streams, last_pk = 0, set(), 0
+    while True:
+        rows = list(StreamViewer.objects.filter(
+            left_at__isnull=True, joined_at__lt=joined_before, pk__gt=last_pk
+        ).order_by('pk').values_list('pk', 'stream_id', 'joined_at')[:batch_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        pipe = redis.pipeline()
+        for pk, _, _ in rows:
+            pipe.zscore(HEARTBEATS_KEY, pk)
+        lapsed = []
+        for (pk, stream_id, joined_at), beat in zip(rows, pipe.execute()):
+            if beat is not None and beat >= cutoff:
+                continue
+            left_at = datetime.fromtimestamp(beat, tz=dt_timezone.utc) if beat is not None else joined_at
+            lapsed.append(StreamViewer(pk=pk, left_at=left_at))
+            streams.add(str(stream_id))
+        if lapsed:
+            StreamViewer.objects.bulk_update(lapsed, ['left_at'])
+            redis.zrem(HEARTBEATS_KEY, *[viewer.pk for viewer in lapsed])
+            reaped += len(lapsed)
+
+    # Heartbeats of rows closed some other way
+    redis.zremrangebyscore(HEARTBEATS_KEY, '-inf', cutoff)
+    if streams:
+        logger.info("Reaped %d lapsed viewers from %d streams", reaped, len(streams))
+        reconcile_viewer_counts(streams)
+    return reaped
@@ -7,9 +7,11 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 from django.utils import timezone
-from django.db.models import Avg, Sum, Max, Count
+from django.db.models import Sum
 from datetime import timedelta
 
+from apps.common.views import parse_bound
+from . import rollups, summary
 from .models import LiveStream, StreamAnalytics, StreamViewer
 from .serializers import (
     LiveStreamSerializer, LiveStreamCreateSerializer, StreamAnalyticsSerializer,
@@ -67,64 +69,25 @@ class LiveStreamViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def analytics(self, request):
-        """Get stream analytics and statistics."""
-        # Calculate overall stats
-        total_streams = LiveStream.objects.count()
-        
-        # Total streaming hours
-        streams_with_duration = LiveStream.objects.filter(
-            actual_start__isnull=False,
-            actual_end__isnull=False
-        )
-        total_hours = 0
-        for stream in streams_with_duration:
-            if stream.duration:
-                total_hours += stream.duration.total_seconds() / 3600
-        
-        # Viewership stats
-        total_views = LiveStream.objects.aggregate(
-            total=Sum('total_views')
-        )['total'] or 0
-        
-        average_viewers = LiveStream.objects.aggregate(
-            avg=Avg('max_viewers')
-        )['avg'] or 0
-        
-        peak_viewers = LiveStream.objects.aggregate(
-            peak=Max('max_viewers')
-        )['peak'] or 0
-        
-        # Most popular platform
-        most_popular = LiveStream.objects.values('platform').annotate(
-            count=Count('id')
-        ).order_by('-count').first()
-        
-        most_popular_platform = most_popular['platform'] if most_popular else 'youtube'
+        """Get stream analytics and statistics, cached until a stream starts or ends."""
+        return Response(summary.cached_analytics(self.build_analytics))
+    
+    def build_analytics(self):
+        """Serialized analytics response for the cache."""
+        # Overall stats and most popular platform, in one query
+        data = summary.compute_summary()
         
-        # Recent analytics (last 30 days)
-        thirty_days_ago = timezone.now() - timedelta(days=30)
-        recent_analytics = StreamAnalytics.objects.filter(
-            timestamp__gte=thirty_days_ago
-        ).order_by('-timestamp')[:20]
+        # Recent analytics (last 30 days), from the rollup tier that covers them
+        now = timezone.now()
+        _, recent_analytics = rollups.series(now - timedelta(days=30), now)
+        data['recent_analytics'] = recent_analytics[::-1][:20]
         
         # Top streams by views
-        top_streams = LiveStream.objects.filter(
+        data['top_streams'] = LiveStream.objects.filter(
             status='ended'
-        ).order_by('-total_views')[:10]
-        
-        data = {
-            'total_streams': total_streams,
-            'total_hours_streamed': round(total_hours, 2),
-            'total_views': total_views,
-            'average_viewers': round(average_viewers, 2),
-            'peak_viewers': peak_viewers,
-            'most_popular_platform': most_popular_platform,
-            'recent_analytics': recent_analytics,
-            'top_streams': top_streams
-        }
+        ).select_related('created_by').order_by('-total_views')[:10]
         
-        serializer = StreamStatsSerializer(data)
-        return Response(serializer.data)
+        return StreamStatsSerializer(data).data
     
     @action(detail=True, methods=['post'])
     def start(self, request, pk=None):
@@ -192,6 +155,39 @@ class StreamAnalyticsViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(stream_id=stream_id)
         
         return queryset
+    
+    def list(self, request, *args, **kwargs):
+        """
+        Raw rows, or buckets over a time range.
+        
+        With ``since`` and/or ``until`` (ISO dates or datetimes; the last
+        day by default) the buckets come from the coarsest rollup tier the
+        range needs, or from ``resolution`` (raw, minute or hour) if given.
+        """
+        params = request.query_params
+        if 'since' not in params and 'until' not in params:
+            return super().list(request, *args, **kwargs)
+        
+        until = parse_bound(params['until'], end=True) if params.get('until') else timezone.now()
+        if until is None:
+            return Response({'error': 'Invalid until date'}, status=status.HTTP_400_BAD_REQUEST)
+        since = parse_bound(params['since']) if params.get('since') else until - timedelta(days=1)
+        if since is None or since >= until:
+            return Response({'error': 'Invalid since date'}, status=status.HTTP_400_BAD_REQUEST)
+        resolution = params.get('resolution')
+        if resolution and resolution not in rollups.TIERS:
+            return Response(
+                {'error': f"Resolution must be one of: {', '.join(rollups.TIERS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        tier, rows = rollups.series(since, until, stream_id=params.get('stream_id'), tier=resolution)
+        return Response({
+            'resolution': tier,
+            'since': since,
+            'until': until,
+            'results': StreamAnalyticsSerializer(rows, many=True).data
+        })
 
 
 class StreamViewerViewSet(viewsets.ReadOnlyModelViewSet):
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmark: per-recipient JSON encoding vs serialize-once broadcast frames.
+
+Delivers the same chat message to N ChatConsumer instances through the
+legacy ``chat_message_broadcast`` handler (one ``json.dumps`` per socket) and
+through ``broadcast_frame`` (encoded once by the sender), and reports the
+CPU time per 1,000 recipients.
+
+Usage: python benchmarks/broadcast_frames.py [recipients] [rounds]
+"""
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genfree_backend.settings.development')
+
+import django
+django.setup()
+
+from apps.chat.consumers import ChatConsumer
+from apps.common.broadcast import frame_event
+
+
+MESSAGE = {
+    'id': '7c8d1f8e-3a0b-4e4f-9a57-0c1d2e3f4a5b',
+    'message_type': 'text',
+    'content': 'Praise God! Joining from Kampala, blessings to everyone watching tonight.',
+    'emoji_reaction': '',
+    'sender_name': 'Grace N.',
+    'username': 'grace',
+    'anonymous_name': '',
+    'is_approved': True,
+    'likes': 0,
+    'reports': 0,
+    'is_own_message': False,
+    'created_at': '2026-10-17T19:04:11.512093+03:00',
+    'updated_at': '2026-10-17T19:04:11.512093+03:00',
+}
+
+
+def make_consumers(count):
+    """Consumers whose ``send`` just counts bytes instead of writing."""
+    consumers = []
+    written = [0]
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        written[0] += len(text_data)
+
+    for _ in range(count):
+        consumer = ChatConsumer()
+        consumer.send = send
+        consumers.append(consumer)
+    return consumers, written
+
+
+async def legacy_fanout(consumers):
+    event = {'type': 'chat_message_broadcast', 'message': MESSAGE}
+    for consumer in consumers:
+        await consumer.chat_message_broadcast(event)
+
+
+async def frame_fanout(consumers):
+    event = frame_event({'type': 'chat_message', 'message': MESSAGE})
+    for consumer in consumers:
+        await consumer.broadcast_frame(event)
+
+
+def measure(fanout, consumers, rounds):
+    start = time.process_time()
+    for _ in range(rounds):
+        asyncio.run(fanout(consumers))
+    return (time.process_time() - start) / rounds
+
+
+def main():
+    recipients = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    consumers, written = make_consumers(recipients)
+
+    legacy = measure(legacy_fanout, consumers, rounds)
+    framed = measure(frame_fanout, consumers, rounds)
+    per_thousand = 1000.0 / recipients
+
+    print(f"Recipients: {recipients}, rounds: {rounds}")
+    print(f"Per-recipient json.dumps: {legacy * per_thousand * 1000:.3f} ms CPU per 1,000 recipients")
+    print(f"Serialize-once frames:    {framed * per_thousand * 1000:.3f} ms CPU per 1,000 recipients")
+    print(f"CPU saved:                {(legacy - framed) * per_thousand * 1000:.3f} ms per 1,000 recipients "
+          f"({(1 - framed / legacy) * 100:.1f}%)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Benchmark: chat history scroll-back, OFFSET pagination vs keyset cursors.
+
+Fills one room with N messages (10M by default) and times fetching a page
+of 50 at increasing depths, both the old way (COUNT(*) + OFFSET, as
+page-number pagination does) and with the ``before`` cursor used by
+``ChatRoomViewSet.messages``. Run it against PostgreSQL for meaningful
+numbers; the composite index is ``chat_msg_room_history_idx``.
+
+Usage:
+    python benchmarks/chat_history.py [--messages 10000000] [--skip-populate]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genfree_backend.settings.development')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from apps.chat.models import ChatRoom, ChatMessage
+from apps.chat.pagination import history_page
+
+ROOM_SLUG = 'benchmark-history'
+PAGE = 50
+
+
+def populate(room, total, batch_size=10000):
+    """Insert ``total`` messages, one second apart, in bulk batches."""
+    start = timezone.now() - timedelta(seconds=total)
+    created = ChatMessage.objects.filter(room=room).count()
+    while created < total:
+        count = min(batch_size, total - created)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(
+                id=uuid.uuid4(),
+                room=room,
+                anonymous_name='bench',
+                content=f'Benchmark message {created + i}',
+                created_at=start + timedelta(seconds=created + i),
+            )
+            for i in range(count)
+        ])
+        created += count
+        print(f"\r  {created:,}/{total:,} messages", end='', flush=True)
+    print()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--messages', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-populate', action='store_true')
+    args = parser.parse_args()
+
+    owner, _ = User.objects.get_or_create(username='benchmark')
+    room, _ = ChatRoom.objects.get_or_create(
+        slug=ROOM_SLUG, defaults={'name': 'Benchmark history', 'created_by': owner}
+    )
+    if not args.skip_populate:
+        print(f"Populating {args.messages:,} messages...")
+        populate(room, args.messages)
+
+    queryset = ChatMessage.objects.filter(room=room, is_approved=True)
+    total = queryset.count()
+    print(f"\nRoom holds {total:,} messages; page size {PAGE}, median of {args.repeat}\n")
+    print(f"{'depth':>12} {'offset (ms)':>14} {'keyset (ms)':>14}")
+
+    depth = PAGE
+    while depth < total:
+        def offset_page():
+            queryset.count()  # page-number pagination always counts
+            list(queryset.order_by('-created_at')[depth:depth + PAGE])
+
+        # The cursor a client would hold after scrolling back ``depth`` messages
+        cursor = queryset.order_by('-created_at', '-id').values_list('created_at', 'id')[depth - 1]
+
+        def keyset_page():
+            history_page(queryset, before=cursor, limit=PAGE)
+
+        print(f"{depth:>12,} {timed(offset_page, args.repeat):>14.2f} {timed(keyset_page, args.repeat):>14.2f}")
+        depth *= 10
+
+
+if __name__ == '__main__':
+    main()
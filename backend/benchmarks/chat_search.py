@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Benchmark: chat search, ``icontains`` scan vs the full-text GIN index.
+
+Fills N messages (10M by default) across a handful of rooms with generated
+chat and prayer-request text, builds ``chat_msg_search_idx`` and times the
+first page of results (50, newest first) for rare and common terms, with
+and without room and date filters, both through ``content__icontains`` (what
+the admin did) and through ``search_messages``. Needs PostgreSQL
+(``USE_POSTGRES=1`` with the development settings).
+
+Usage:
+    python benchmarks/chat_search.py [--messages 10000000] [--skip-populate]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genfree_backend.settings.development')
+
+import django
+django.setup()
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.utils import timezone
+
+from apps.chat.models import ChatRoom, ChatMessage
+from apps.chat.search import ensure_search_index, search_messages
+
+ROOM_SLUGS = [f'benchmark-search-{n}' for n in range(8)]
+PAGE = 50
+
+OPENINGS = [
+    'Please pray for', 'Praying for', 'Thank you Lord for', 'Amen to', 'Blessings on',
+    'Greetings from Kampala,', 'Joining from Gulu,', 'Standing in faith for', 'Good evening,',
+]
+SUBJECTS = [
+    'my family', 'my mother', 'our church', 'the youth', 'my exams', 'my job search',
+    'my brother', 'the sick', 'our nation', 'the choir', 'my marriage', 'the children',
+]
+ENDINGS = [
+    'tonight', 'this week', 'in Jesus name', 'God is good', 'hallelujah',
+    'what a message', 'thank you pastor', 'so encouraged', '', '',
+]
+RARE = ['healing from malaria', 'visa interview', 'twins', 'surgery on Friday']
+
+
+def message_text(rng):
+    text = f'{rng.choice(OPENINGS)} {rng.choice(SUBJECTS)} {rng.choice(ENDINGS)}'.strip()
+    if rng.random() < 0.001:
+        text += f', {rng.choice(RARE)}'
+    return text
+
+
+def populate(rooms, total, batch_size=10000):
+    """Insert ``total`` messages, one second apart, in bulk batches."""
+    rng = random.Random(42)
+    start = timezone.now() - timedelta(seconds=total)
+    created = ChatMessage.objects.filter(room__in=rooms).count()
+    while created < total:
+        count = min(batch_size, total - created)
+        ChatMessage.objects.bulk_create([
+            ChatMessage(
+                id=uuid.uuid4(),
+                room=rooms[(created + i) % len(rooms)],
+                anonymous_name='bench',
+                content=message_text(rng),
+                created_at=start + timedelta(seconds=created + i),
+            )
+            for i in range(count)
+        ])
+        created += count
+        print(f"\r  {created:,}/{total:,} messages", end='', flush=True)
+    print()
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--messages', type=int, default=10_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-populate', action='store_true')
+    args = parser.parse_args()
+
+    if connection.vendor != 'postgresql':
+        sys.exit("Full-text search needs PostgreSQL; set USE_POSTGRES=1")
+
+    owner, _ = User.objects.get_or_create(username='benchmark')
+    rooms = [
+        ChatRoom.objects.get_or_create(
+            slug=slug, defaults={'name': slug.replace('-', ' ').title(), 'created_by': owner}
+        )[0]
+        for slug in ROOM_SLUGS
+    ]
+    if not args.skip_populate:
+        print(f"Populating {args.messages:,} messages...")
+        populate(rooms, args.messages)
+
+    started = time.perf_counter()
+    if ensure_search_index():
+        print(f"Built search index in {time.perf_counter() - started:.1f}s")
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE chat_chatmessage')
+
+    queryset = ChatMessage.objects.filter(room__in=rooms)
+    total = queryset.count()
+    week_ago = timezone.now() - timedelta(days=7)
+    cases = [
+        ('rare term', 'visa interview', queryset),
+        ('rare term, one room', 'visa interview', queryset.filter(room=rooms[0])),
+        ('common term', 'family', queryset),
+        ('common term, one room', 'family', queryset.filter(room=rooms[0])),
+        ('common term, last 7 days', 'family', queryset.filter(created_at__gte=week_ago)),
+    ]
+
+    print(f"\n{total:,} messages; first page of {PAGE}, median of {args.repeat}\n")
+    print(f"{'query':<28} {'icontains (ms)':>15} {'full-text (ms)':>15}")
+    for label, term, base in cases:
+        def scan():
+            list(base.filter(content__icontains=term).order_by('-created_at')[:PAGE])
+
+        def indexed():
+            list(search_messages(base, term).order_by('-created_at')[:PAGE])
+
+        print(f"{label:<28} {timed(scan, args.repeat):>15.2f} {timed(indexed, args.repeat):>15.2f}")
+
+
+if __name__ == '__main__':
+    main()
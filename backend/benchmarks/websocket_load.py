@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+"""
+Load generator for the chat and livestream WebSocket consumers.
+
+Runs thousands of simulated clients in one process against ``ChatConsumer``
+and ``LiveStreamConsumer`` through Channels' ASGI test communicator, so no
+server is needed. Chat clients spread over ``--rooms`` rooms and pick
+actions at random from ``--mix`` (weights for ``chat_message``, ``typing``
+and ``reaction``) at ``--rate`` actions per client per second. Stream
+clients, like the frontend's player, send no heartbeats and only the odd
+analytics event; the server keeps their presence alive.
+
+By default the channel layer and the real-time store are in-process
+(``--backend memory``). ``--backend configured`` uses the project's
+``CHANNEL_LAYERS`` and ``REALTIME_REDIS_URL`` instead, for example a local
+Redis. Rate limits stay in force, so throttled frames are counted too.
+
+Reported: connect latency, broadcast latency (send to delivery, for every
+recipient of every chat message) at p50/p99, and sent and delivered
+messages per second.
+
+Usage:
+    python benchmarks/websocket_load.py [--chat-clients 2000] [--stream-clients 500]
+        [--rooms 10] [--duration 30] [--rate 0.2] [--mix chat_message=1,typing=3,reaction=2]
+        [--backend memory|configured] [--write-behind]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genfree_backend.settings.development')
+
+import django
+django.setup()
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+
+class Stats:
+    """Samples and counters shared by every simulated client."""
+
+    def __init__(self):
+        self.connect_ms = []
+        self.broadcast_ms = []
+        self.failed_connects = 0
+        self.sent = Counter()
+        self.received = Counter()
+        self.sent_at = {}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - {'chat_message', 'typing', 'reaction'}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown actions: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def configure(backend, write_behind):
+    """Point Channels and the real-time store at in-process backends if asked."""
+    if backend == 'memory':
+        settings.CHANNEL_LAYERS = {
+            'default': {
+                'BACKEND': 'channels.layers.InMemoryChannelLayer',
+                'CONFIG': {'capacity': 10000, 'expiry': 60},
+            },
+        }
+        settings.REALTIME_REDIS_URL = ''
+    settings.CHAT_WRITE_BEHIND = write_behind
+
+
+def prepare(rooms):
+    """Create the rooms and the live stream the clients connect to."""
+    from django.contrib.auth.models import User
+    from django.utils import timezone
+
+    from apps.chat.models import ChatRoom
+    from apps.livestream.models import LiveStream
+
+    owner, _ = User.objects.get_or_create(username='loadtest')
+    slugs = []
+    for n in range(rooms):
+        room, _ = ChatRoom.objects.update_or_create(
+            slug=f'loadtest-{n}',
+            defaults={'name': f'Load test {n}', 'created_by': owner, 'is_active': True, 'is_moderated': False}
+        )
+        slugs.append(room.slug)
+    stream = LiveStream.objects.filter(title='Load test').first() or LiveStream.objects.create(
+        title='Load test', platform='custom', scheduled_start=timezone.now(),
+        status='live', created_by=owner
+    )
+    return slugs, str(stream.id)
+
+
+async def pause(delay, deadline):
+    """Sleep for ``delay`` seconds, but not past the end of the run."""
+    await asyncio.sleep(max(0.0, min(delay, deadline - time.perf_counter())))
+
+
+async def connect(application, path, session_key, stats):
+    from channels.testing import WebsocketCommunicator
+    from django.contrib.auth.models import AnonymousUser
+
+    communicator = WebsocketCommunicator(application, path)
+    communicator.scope['user'] = AnonymousUser()
+    communicator.scope['session'] = {'session_key': session_key}
+    started = time.perf_counter()
+    try:
+        connected, _ = await communicator.connect(timeout=30)
+    except asyncio.TimeoutError:
+        connected = False
+    if not connected:
+        stats.failed_connects += 1
+        return None
+    stats.connect_ms.append((time.perf_counter() - started) * 1000)
+    return communicator
+
+
+async def read_frames(communicator, stats, seen_messages):
+    """Record every frame a client receives until cancelled."""
+    while True:
+        output = await communicator.output_queue.get()
+        if output.get('type') != 'websocket.send' or output.get('text') is None:
+            continue
+        frame = json.loads(output['text'])
+        frame_type = frame.get('type')
+        stats.received[frame_type] += 1
+        if frame_type == 'chat_message':
+            message = frame['message']
+            sent_at = stats.sent_at.get(message['content'])
+            if sent_at is not None:
+                stats.broadcast_ms.append((time.perf_counter() - sent_at) * 1000)
+            seen_messages.append(message['id'])
+            del seen_messages[:-20]
+
+
+async def chat_client(application, slug, number, args, stats, deadline, ids):
+    communicator = await connect(application, f'/ws/chat/{slug}/', f'load-chat-{number}', stats)
+    if communicator is None:
+        return
+    rng = random.Random(number)
+    seen_messages = []
+    reader = asyncio.ensure_future(read_frames(communicator, stats, seen_messages))
+    actions, weights = zip(*args.mix.items())
+    typing = False
+    try:
+        while True:
+            await pause(rng.expovariate(args.rate), deadline)
+            if time.perf_counter() >= deadline:
+                break
+            action = rng.choices(actions, weights)[0]
+            if action == 'chat_message':
+                content = f'load {number}:{next(ids)} praise and worship tonight'
+                stats.sent_at[content] = time.perf_counter()
+                frame = {'type': 'chat_message', 'content': content}
+            elif action == 'typing':
+                typing = not typing
+                frame = {'type': 'typing', 'typing': typing}
+            elif seen_messages:
+                frame = {'type': 'reaction', 'message_id': rng.choice(seen_messages), 'reaction': 'like'}
+            else:
+                continue
+            await communicator.send_to(text_data=json.dumps(frame))
+            stats.sent[action] += 1
+    finally:
+        reader.cancel()
+        await communicator.disconnect()
+
+
+async def stream_client(application, stream_id, number, args, stats, deadline):
+    communicator = await connect(application, f'/ws/stream/{stream_id}/', f'load-stream-{number}', stats)
+    if communicator is None:
+        return
+    rng = random.Random(-number)
+    reader = asyncio.ensure_future(read_frames(communicator, stats, []))
+    try:
+        while True:
+            await pause(rng.uniform(5, 15), deadline)
+            if time.perf_counter() >= deadline:
+                break
+            if rng.random() >= 0.1:
+                continue
+            frame = {'type': 'analytics', 'event': 'reaction', 'data': {}}
+            await communicator.send_to(text_data=json.dumps(frame))
+            stats.sent[frame['type']] += 1
+    finally:
+        reader.cancel()
+        await communicator.disconnect()
+
+
+async def run(args):
+    from channels.routing import URLRouter
+
+    from apps.chat.routing import websocket_urlpatterns as chat_patterns
+    from apps.livestream.routing import websocket_urlpatterns as stream_patterns
+
+    application = URLRouter(chat_patterns + stream_patterns)
+    slugs, stream_id = await sync_to_async(prepare)(args.rooms)
+    stats = Stats()
+    ids = itertools.count()
+    total = args.chat_clients + args.stream_clients
+    started = time.perf_counter()
+    deadline = started + args.ramp + args.duration
+
+    clients = []
+    for number in range(total):
+        if number < args.chat_clients:
+            client = chat_client(application, slugs[number % len(slugs)], number, args, stats, deadline, ids)
+        else:
+            client = stream_client(application, stream_id, number, args, stats, deadline)
+        clients.append(asyncio.ensure_future(client))
+        # Spread joins evenly over the ramp-up period
+        await asyncio.sleep(args.ramp / total)
+    await asyncio.gather(*clients)
+    return stats, deadline - started
+
+
+def report(args, stats, elapsed):
+    sent = sum(stats.sent.values())
+    received = sum(stats.received.values())
+    print(f"Chat clients: {args.chat_clients} in {args.rooms} rooms, stream clients: {args.stream_clients}")
+    print(f"Backend: {args.backend}, write-behind: {'on' if args.write_behind else 'off'}, "
+          f"rates over {elapsed:.0f}s including a {args.ramp:.0f}s ramp-up\n")
+    print(f"Connect latency (ms):   p50 {percentile(stats.connect_ms, 50):8.2f}   "
+          f"p99 {percentile(stats.connect_ms, 99):8.2f}   max {max(stats.connect_ms, default=0):8.2f}   "
+          f"failed {stats.failed_connects}")
+    print(f"Broadcast latency (ms): p50 {percentile(stats.broadcast_ms, 50):8.2f}   "
+          f"p99 {percentile(stats.broadcast_ms, 99):8.2f}   max {max(stats.broadcast_ms, default=0):8.2f}   "
+          f"samples {len(stats.broadcast_ms)}")
+    print(f"Sent:      {sent:>9} frames  {sent / elapsed:>9.1f}/s  "
+          + ', '.join(f'{name} {count}' for name, count in stats.sent.most_common()))
+    print(f"Delivered: {received:>9} frames  {received / elapsed:>9.1f}/s  "
+          + ', '.join(f'{name} {count}' for name, count in stats.received.most_common()))
+    print(f"Chat messages delivered: {stats.received['chat_message'] / elapsed:.1f}/s, "
+          f"rate limited: {stats.received['rate_limited']}, errors: {stats.received['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--chat-clients', type=int, default=2000)
+    parser.add_argument('--stream-clients', type=int, default=500)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30, help='seconds of load after ramp-up')
+    parser.add_argument('--ramp', type=float, default=10, help='seconds over which clients join')
+    parser.add_argument('--rate', type=float, default=0.2, help='actions per chat client per second')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('chat_message=1,typing=3,reaction=2'))
+    parser.add_argument('--backend', choices=['memory', 'configured'], default='memory')
+    parser.add_argument('--write-behind', action='store_true', help='buffer message inserts')
+    args = parser.parse_args()
+    if args.chat_clients + args.stream_clients < 1 or args.rooms < 1:
+        parser.error('need at least one client and one room')
+
+    configure(args.backend, args.write_behind)
+    stats, elapsed = asyncio.run(run(args))
+    report(args, stats, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmark: JSON text frames vs the MessagePack wire format.
+
+Encodes the frames a busy chat room sends most often in both formats and
+reports the bytes on the wire per frame and the encode time per 1,000
+frames (the cost paid once per broadcast: by ``frame_event`` for JSON, and
+by ``wire.pack_encoded`` in each process serving binary clients).
+
+Usage: python benchmarks/wire_protocols.py [rounds]
+"""
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add the backend directory to Python path
+backend_dir = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(backend_dir))
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genfree_backend.settings.development')
+
+import django
+django.setup()
+
+from apps.common import wire
+
+
+MESSAGE = {
+    'id': '7c8d1f8e-3a0b-4e4f-9a57-0c1d2e3f4a5b',
+    'message_type': 'text',
+    'content': 'Praise God! Joining from Kampala, blessings to everyone watching tonight.',
+    'emoji_reaction': '',
+    'sender_name': 'Grace N.',
+    'username': 'grace',
+    'anonymous_name': '',
+    'is_approved': True,
+    'likes': 0,
+    'reports': 0,
+    'is_own_message': False,
+    'created_at': '2026-10-17T19:04:11.512093+03:00',
+    'updated_at': '2026-10-17T19:04:11.512093+03:00',
+}
+
+FRAMES = {
+    'chat_message': {'type': 'chat_message', 'message': MESSAGE},
+    'backfill (50)': {'type': 'backfill', 'messages': [MESSAGE] * 50},
+    'user_count': {'type': 'user_count', 'count': 1342},
+    'reaction_counts': {
+        'type': 'reaction_counts',
+        'messages': {MESSAGE['id']: {'like': 87, 'amen': 41, 'pray': 12}},
+    },
+    'typing_snapshot': {
+        'type': 'typing_snapshot',
+        'users': ['Grace N.', 'Samuel K.', 'Anonymous 4821'],
+        'count': 7,
+    },
+}
+
+
+def measure(encode, payload, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encode(payload)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    if wire.msgpack is None:
+        sys.exit("msgpack is not installed")
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"Rounds: {rounds}")
+    print(f"{'frame':<18}{'json B':>9}{'msgpack B':>11}{'saved':>8}"
+          f"{'json ms/1k':>13}{'msgpack ms/1k':>16}")
+    for name, payload in FRAMES.items():
+        text = json.dumps(payload).encode('utf-8')
+        packed = wire.pack(payload)
+        assert wire.unpack(packed) == json.loads(text)
+        json_time = measure(json.dumps, payload, rounds)
+        packed_time = measure(wire.pack, payload, rounds)
+        print(f"{name:<18}{len(text):>9}{len(packed):>11}{(1 - len(packed) / len(text)) * 100:>7.1f}%"
+              f"{json_time * 1e6:>13.3f}{packed_time * 1e6:>16.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ Celery configuration for GenFree Network backend.
 
 import os
 from celery import Celery
+from celery.schedules import crontab
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'genfree_backend.settings.production')
@@ -23,6 +24,22 @@ app.conf.beat_schedule = {
         'task': 'apps.livestream.tasks.check_live_status',
         'schedule': 30.0,  # Every 30 seconds
     },
+    'sync-livestream-viewer-counts': {
+        'task': 'apps.livestream.tasks.sync_viewer_counts',
+        'schedule': 5.0,  # Every 5 seconds
+    },
+    'reconcile-livestream-viewer-counts': {
+        'task': 'apps.livestream.tasks.reconcile_viewer_counts',
+        'schedule': 300.0,  # Every 5 minutes
+    },
+    'reap-lapsed-stream-viewers': {
+        'task': 'apps.livestream.tasks.reap_lapsed_viewers',
+        'schedule': 60.0,  # Every minute
+    },
+    'compact-stream-analytics': {
+        'task': 'apps.livestream.tasks.compact_stream_analytics',
+        'schedule': 60.0,  # Every minute
+    },
     'process-pending-donations': {
         'task': 'apps.donations.tasks.process_pending_donations',
         'schedule': 60.0,  # Every minute
@@ -31,6 +48,34 @@ app.conf.beat_schedule = {
         'task': 'apps.analytics.tasks.send_daily_report',
         'schedule': crontab(hour=8, minute=0),  # Daily at 8 AM
     },
+    'recover-pending-chat-messages': {
+        'task': 'apps.chat.tasks.recover_pending_messages',
+        'schedule': 60.0,  # Every minute
+    },
+    'flush-chat-reaction-counts': {
+        'task': 'apps.chat.tasks.flush_reaction_counts',
+        'schedule': 10.0,  # Every 10 seconds
+    },
+    'flush-chat-room-counters': {
+        'task': 'apps.chat.tasks.flush_room_counters',
+        'schedule': 10.0,  # Every 10 seconds
+    },
+    'reconcile-chat-room-counters': {
+        'task': 'apps.chat.tasks.reconcile_room_counters',
+        'schedule': crontab(hour=3, minute=30),  # Daily at 3:30 AM, after cleanup
+    },
+    'flush-chat-activity-log': {
+        'task': 'apps.chat.tasks.flush_activity_log',
+        'schedule': 5.0,  # Every 5 seconds
+    },
+    'apply-chat-moderation-decisions': {
+        'task': 'apps.chat.tasks.apply_moderation_decisions',
+        'schedule': 5.0,  # Every 5 seconds
+    },
+    'rollup-chat-stats': {
+        'task': 'apps.chat.tasks.rollup_chat_stats',
+        'schedule': 300.0,  # Every 5 minutes
+    },
     'cleanup-old-chat-messages': {
         'task': 'apps.chat.tasks.cleanup_old_messages',
         'schedule': crontab(hour=2, minute=0),  # Daily at 2 AM
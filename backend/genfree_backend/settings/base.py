@@ -169,6 +169,99 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Real-time state (presence, counters) shared by every ASGI node.
+# An empty URL keeps this state in-process, which only suits a single node.
+REALTIME_REDIS_URL = config('REALTIME_REDIS_URL', default=config('REDIS_URL', default='redis://localhost:6379'))
+REALTIME_REDIS_SOCKET_TIMEOUT = 5  # Seconds before a real-time store command fails
+REALTIME_REDIS_CONNECT_TIMEOUT = 2
+REALTIME_PRESENCE_TTL = 90  # Seconds a connection stays counted without a heartbeat
+REALTIME_COUNT_BROADCAST_INTERVAL = 1.0  # At most one user/viewer count frame per group per interval
+REALTIME_GROUP_SHARD_SIZE = 500  # Members per channel group shard before a room is split further
+REALTIME_GROUP_MAX_SHARDS = 32
+REALTIME_WIRE_PROTOCOLS = ['genfree.msgpack.v1', 'genfree.json']  # Accepted WebSocket subprotocols, most preferred first
+REALTIME_SNAPSHOT_MAX_AGE = 300  # Seconds before a consumer reloads its room/stream snapshot without a push
+
+# Chat typing indicators: per-room state with expiry, sent as periodic snapshots
+CHAT_TYPING_TTL = 6  # Seconds a typing toggle lasts without a refresh
+CHAT_TYPING_SNAPSHOT_INTERVAL = 2.0
+CHAT_TYPING_SNAPSHOT_LIMIT = 5  # Names listed per snapshot; the count covers everyone
+
+# Chat reactions: counted in the real-time store, flushed to the database by Celery
+CHAT_REACTION_KINDS = ['like', 'love', 'amen', 'pray', 'praise']
+CHAT_REACTION_BROADCAST_INTERVAL = 1.0
+
+# Chat join backfill: recent messages per room, kept warm by the broadcast path
+CHAT_BACKFILL_SIZE = 50
+CHAT_BACKFILL_TTL = 6 * 60 * 60
+
+# Chat write-behind: broadcast first, then bulk insert messages in batches
+CHAT_WRITE_BEHIND = config('CHAT_WRITE_BEHIND', default=False, cast=bool)
+CHAT_WRITE_BEHIND_INTERVAL_MS = 250
+CHAT_WRITE_BEHIND_BATCH_SIZE = 200
+
+# Chat moderation: room banned words reject a message, these hold it for review
+# in moderated rooms.
+CHAT_FLAGGED_WORDS = ['spam', 'fake', 'scam']
+
+# Chat moderation queue: review priority added per report reason and per held
+# message; decisions are applied in batches by Celery
+CHAT_REPORT_PRIORITIES = {
+    'violence': 8,
+    'hate_speech': 8,
+    'harassment': 5,
+    'inappropriate': 3,
+    'spam': 2,
+    'other': 1,
+}
+CHAT_FLAGGED_PRIORITY = 2
+CHAT_MODERATION_BATCH_SIZE = 500
+
+# Chat search: PostgreSQL text search configuration behind the message index
+CHAT_SEARCH_CONFIG = 'english'
+
+# Chat retention: archive to compressed JSONL, then delete in bounded batches
+CHAT_RETENTION_DAYS = config('CHAT_RETENTION_DAYS', default=365, cast=int)
+CHAT_RETENTION_BATCH_SIZE = 1000
+CHAT_RETENTION_MAX_BATCHES = 500  # Per nightly run; the rest waits for the next run
+CHAT_RETENTION_BATCH_PAUSE = 0.2  # Seconds between batches
+CHAT_ARCHIVE_RESTORE_DAYS = 30  # Restored months are kept this long
+
+# Chat statistics rollups (hourly and daily, plus a live tail)
+CHAT_STATS_GRACE_MINUTES = 5  # An hour is rolled up this long after it ends
+CHAT_STATS_REROLL_HOURS = 2  # Recent hours recomputed on every run
+CHAT_STATS_BACKFILL_DAYS = 7  # History aggregated on the first run
+
+# Chat activity log: queued in the real-time store, bulk-inserted by Celery
+CHAT_ACTIVITY_QUEUE_LIMIT = 100000  # Oldest records are dropped beyond this
+CHAT_ACTIVITY_FLUSH_BATCH_SIZE = 1000
+
+# Chat WebSocket rate limits: frame type -> (tokens per second, burst)
+CHAT_RATE_LIMITS = {  # Per connection
+    'chat_message': (1, 5),
+    'typing': (2, 6),
+    'reaction': (5, 20),
+    'ping': (0.5, 3),
+    'invalid': (1, 3),
+}
+CHAT_USER_RATE_LIMITS = {  # Per signed-in user, across all connections
+    'chat_message': (2, 10),
+    'reaction': (10, 40),
+}
+
+# Live stream analytics: client events are summed per stream into buckets of this width
+LIVESTREAM_ANALYTICS_BUCKET_SECONDS = 10
+LIVESTREAM_ANALYTICS_GRACE_SECONDS = 60  # A minute is compacted this long after it ends
+LIVESTREAM_ANALYTICS_REROLL_MINUTES = 5  # Recent minutes recomputed on every run
+LIVESTREAM_ANALYTICS_BACKFILL_DAYS = 7  # Raw history compacted on the first run
+LIVESTREAM_ANALYTICS_RETENTION_DAYS = {  # Per tier; None keeps it forever
+    'raw': 2,
+    'minute': 30,
+    'hour': None,
+}
+LIVESTREAM_ANALYTICS_PRUNE_BATCH_SIZE = 5000  # Rows per DELETE when applying retention
+LIVESTREAM_ANALYTICS_MAX_POINTS = 1500  # Reads use the finest tier within this many buckets
+LIVESTREAM_SUMMARY_CACHE_TTL = 600  # Seconds; streams starting or ending clear it sooner
+
 # Celery Configuration
 CELERY_BROKER_URL = config('REDIS_URL', default='redis://localhost:6379')
 CELERY_RESULT_BACKEND = config('REDIS_URL', default='redis://localhost:6379')
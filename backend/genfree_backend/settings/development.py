@@ -53,6 +53,9 @@ CACHES = {
     }
 }
 
+# Keep real-time state in-process unless a Redis URL is given
+REALTIME_REDIS_URL = config('REALTIME_REDIS_URL', default='')
+
 # Static files serving in development
 STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
 